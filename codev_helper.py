@@ -4,30 +4,351 @@ The functions here will receive the code V session object as a parameter
 and perform specific tasks.
 """
 
+import csv
+import math
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+import xy_polynomial as xyp
+
+# default commands shared by the sweep and calibration scripts
+VIGNETTING_COMMAND = 'run "C:\\CODEV202203_SR1\\macro\\setvig.seq" 1e-07 0.1 100 NO YES ;GO'
+OPTIMIZATION_COMMAND = "AUT; P YES; ERR CDV; MNC 5; DRA S1..30  NO; EFP ALL Y; EFT TA; GLA SO..I  NFK5 NSK16 NLAF2 SF4; GO"
+LOHMANN_SURFACES = ["S8", "S9", "S17", "S18"]
+LOHMANN_C0 = 1/0.00013312  # in mm
+
+# single real ray at relative pupil (x, y) for a field; the coordinates of the
+# last traced ray are then read from the database at the requested surface
+RAY_TRACE_FUNCTION = "RAYRSI({zoom}, {wavelength}, {field}, {px}, {py}, 0)"
+RAY_TAG = "@@RAY"
+
+# parameters that take their own value in every zoom position of a distance
+# sweep; everything else is shared by the positions
+ZOOM_SLM_PARAMETERS = ["SCO S13 C2"]
+ZOOM_TAG = "@@ZOOM"
+
+# what to do when CODE V reports an event during a command: "abort" raises
+# CodeVCommandError, "retry" sends the command again (then aborts), "flag"
+# records the event for the current point and "ignore" drops it
+DEFAULT_EVENT_POLICY = {"license": "abort", "error": "abort", "warning": "flag"}
+
+# image simulation settings used by the calibration scripts
+IMS_SETTINGS = {"tgr": 1024, "pmx": 15, "pmy": 15, "dex": 3.75e-3, "dey": 3.75e-3}
+
+# image names of the processes a CODE V session runs in, for killing a hung one
+CODEV_PROCESS_PATTERN = re.compile(r"^(cv|codev)\w*\.exe$", re.IGNORECASE)
+
+# CODE V tolerance analysis: the tolerances (DLT, DLX, ...) are set in the lens,
+# the compensators are made variables, and every row of the sensitivity listing
+# gives the tolerance followed by the compensator change for +tol and -tol
+TOR_COMMAND = "TOR; GO"
+TOR_ROW_PATTERN = re.compile(r"^\s*(DL[A-Z]|DS[XY]|BT[XY]|TR[XY])\s+(S\d+(?:\.\.\d+)?)\s+(.*)$",
+                             re.IGNORECASE)
+# the sensitivity rows are only read from the compensator change table; the
+# performance tables before it have rows with the same tolerance codes
+TOR_CHANGE_HEADER = re.compile(r"^.*COMPENSATOR\s+CHANGES?\b.*$", re.IGNORECASE | re.MULTILINE)
+TOR_CHANGE_COLUMNS = (0, 1)
+# variable codes of the compensator database items
+COMPENSATOR_CODES = {"SCO": "SCC", "THI": "THC"}
+
+
+class CodeVCommandError(RuntimeError):
+
+    def __init__(self, command, events):
+        self.command = command
+        self.events = events
+        details = "; ".join(f"{kind}: {message}" for kind, message in events)
+        super().__init__(f"CODE V reported {details} for command: {command.strip()[:200]}")
+
+
+def event_sink(event_log):
+    """
+    ICVCommandEvents sink (see Example_CV_Events.py) appending (kind, message)
+    tuples to `event_log`. A new class per session, so every session has its
+    own log; the session object exposes it as cv_session.event_log.
+    """
+
+    class CodeVEvents:
+        def OnLicenseError(self, error):
+            self.event_log.append(("license", str(error)))
+
+        def OnCodeVError(self, error):
+            self.event_log.append(("error", str(error)))
+
+        def OnCodeVWarning(self, warning):
+            self.event_log.append(("warning", str(warning)))
+
+    CodeVEvents.event_log = event_log
+    return CodeVEvents
+
+
+def start_session(working_dir, lens_file=None, setup_commands=(), debug=False, events=False):
+    """
+    Creates the CODE V COM object, starts the background process and
+    restores the lens file. Returns the session object. With events=True the
+    session is connected to the CODE V error / warning events.
+    """
+    if events and "pythoncom" not in sys.modules:
+        # events are delivered on COM threads while Command() blocks
+        sys.coinit_flags = 0  # COINIT_MULTITHREADED
+    import win32com.client
+
+    if events:
+        cv_session = win32com.client.DispatchWithEvents("CodeV.Application", event_sink([]))
+    else:
+        cv_session = win32com.client.Dispatch("CodeV.Application")
+    cv_session.StartingDirectory = working_dir
+    cv_session.StartCodeV()
+    if debug:
+        print(f"CODE V background process started. Version: {cv_session.CodeVVersion}")
+
+    if lens_file:
+        output = cv_session.Command(f"RES {lens_file}")
+        if debug:
+            print(f"Lens opened. CODE V response: {output}")
+
+    for command in setup_commands:
+        cv_session.Command(command)
+
+    return cv_session
+
+
+def stop_session(cv_session):
+    # stop the background process, ignoring sessions that already died
+    if cv_session is None:
+        return
+    try:
+        cv_session.StopCodeV()
+    except Exception as e:
+        print(f"Could not stop CODE V session: {e}")
+
+
+def codev_process_ids():
+    """
+    Ids of the running CODE V processes. Taken before and after
+    start_session, the difference is the process of the new session.
+    """
+    output = subprocess.run(["tasklist", "/FO", "CSV", "/NH"], capture_output=True, text=True, check=True).stdout
+    return {int(row[1]) for row in csv.reader(output.splitlines())
+            if len(row) > 1 and CODEV_PROCESS_PATTERN.match(row[0])}
+
+
+def kill_process(pid):
+    # force-kills a process (and its children); True once it is gone
+    subprocess.run(["taskkill", "/F", "/T", "/PID", str(pid)], capture_output=True)
+    output = subprocess.run(["tasklist", "/FI", f"PID eq {pid}", "/FO", "CSV", "/NH"],
+                            capture_output=True, text=True).stdout
+    return f'"{pid}"' not in output
+
+
+# ==============================================================================
+# Command builders (shared by the helper methods and the macro executor)
+# ==============================================================================
+
+def translate_lohmann_commands(delta, surfaces=LOHMANN_SURFACES):
+    # decenter and return each lohmann surface, then translate it along z
+    commands = []
+    for surface in surfaces:
+        commands.append(f"DAR {surface}")
+        commands.append(f"ZDE {surface} {delta}")
+    return commands
+
+
+def rotate_lohmann_commands(surface, theta=0, c0=LOHMANN_C0):
+    # rotate the cubic terms (C7-C10) of the lohmann surface by theta (radians), in one command
+    base = xyp.coeffs_from_dict({"C7": 1/c0, "C10": 1/c0}, max_order=3)
+    rotated = xyp.coeffs_to_dict(xyp.rotate_coeffs(base, theta))
+    return [xyp.upload_command(surface, {order: rotated[order] for order in ["C7", "C8", "C9", "C10"]})]
+
+
+def rotate_SLM_commands(dummy_surface, theta=0):
+    # pick up the SLM tilt terms (C4, C7) from C2 of the dummy surface rotated by theta
+    sin_th = math.sin(theta)
+    cos_th = math.cos(theta)
+    return [
+        f"PIK SCO C4 {dummy_surface} SCO C2 {dummy_surface} {sin_th} {cos_th}",
+        f"PIK SCO C7 {dummy_surface} SCO C2 {dummy_surface} {cos_th} {-sin_th}",
+    ]
+
+
+def distance_zoom_commands(distances, zoomed=ZOOM_SLM_PARAMETERS):
+    """
+    Commands turning the current lens into a multi-configuration system with
+    one zoom position per object distance (m). Only S0 and the `zoomed`
+    parameters differ between positions.
+    """
+    commands = [f"INS Z{k}" for k in range(2, len(distances) + 1)]
+    commands.append("ZOO THI S0")
+    commands.extend(f"ZOO {item}" for item in zoomed)
+    commands.extend(f"THI S0 Z{k} {distance*1000}" for k, distance in enumerate(distances, start=1))
+    return commands
+
+
+def zoom_expression(expression, position):
+    # "(SCO S13 C2)" -> "(SCO S13 C2 Z2)"
+    return f"{expression.rstrip()[:-1]} Z{position})"
+
+
+def tolerance_commands(tolerances):
+    # {"DLT S3": 0.1, "DLX S8..9": 0.05} -> ["DLT S3 0.1", "DLX S8..9 0.05"]
+    return [f"{code} {value}" for code, value in tolerances.items()]
+
+
+def compensator_commands(compensators):
+    # "SCO S13 C2" -> "SCC S13 C2 0", i.e. a variable during the tolerance analysis
+    commands = []
+    for compensator in compensators:
+        item, *rest = compensator.split()
+        if item.upper() not in COMPENSATOR_CODES:
+            raise ValueError(f"Unsupported compensator '{compensator}'")
+        commands.append(" ".join([COMPENSATOR_CODES[item.upper()]] + rest + ["0"]))
+    return commands
+
+
+def parse_tor_sensitivity(output, columns=TOR_CHANGE_COLUMNS):
+    """
+    Rows of the compensator change table of a TOR listing as dicts with the
+    tolerance "code" ("DLT S3"), the "tolerance" value and the compensator
+    change for the positive and negative tolerance ("plus", "minus"). Raises
+    ValueError when the table is missing, empty or a row lacks a column.
+    """
+    header = TOR_CHANGE_HEADER.search(output or "")
+    if header is None:
+        raise ValueError("TOR listing has no compensator change table")
+
+    rows = []
+    for line in output[header.end():].splitlines():
+        match = TOR_ROW_PATTERN.match(line)
+        if match is None:
+            # column headings before the rows, end of the table after them
+            if rows:
+                break
+            continue
+        numbers = []
+        for token in match.group(3).split():
+            try:
+                numbers.append(float(token))
+            except ValueError:
+                continue
+        code = f"{match.group(1).upper()} {match.group(2).upper()}"
+        if len(numbers) <= 1 + max(columns):
+            raise ValueError(f"TOR row '{code}' has no compensator change in column {1 + max(columns)}: "
+                             f"{line.strip()}")
+        tolerance, changes = numbers[0], numbers[1:]
+        rows.append({"code": code, "tolerance": tolerance,
+                     "plus": changes[columns[0]], "minus": changes[columns[1]]})
+    if not rows:
+        raise ValueError("TOR compensator change table has no rows")
+    return rows
+
+
+class LensSnapshot:
+    """
+    Full lens state saved with SAV to a temporary .len file. restore() brings
+    the lens back with a single RES, including everything AUT changed. Used as
+    a context manager it restores and deletes the file on exit; it can also be
+    kept and restored before every sweep point. The measured SAV and RES times
+    are kept in save_time and restore_times.
+    """
+
+    def __init__(self, helper, path=None):
+        self.helper = helper
+        self.path = path or os.path.join(tempfile.gettempdir(), f"cv_snapshot_{uuid.uuid4().hex[:8]}")
+        self.save_time = None
+        self.restore_times = []
+
+    def save(self):
+        t0 = time.perf_counter()
+        self.helper.command(f"SAV {self.path}")
+        self.save_time = time.perf_counter() - t0
+        return self
+
+    def restore(self):
+        t0 = time.perf_counter()
+        output = self.helper.command(f"RES {self.path}")
+        self.restore_times.append(time.perf_counter() - t0)
+        return output
+
+    def discard(self):
+        if os.path.exists(self.path + ".len"):
+            os.remove(self.path + ".len")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.restore()
+        finally:
+            self.discard()
+
 
 class CodeVHelper:
 
     # init
-    def __init__(self, cv_session, debug=False):
+    def __init__(self, cv_session, debug=False, event_policy=None, retries=1):
         self.cv_session = cv_session
         self.debug = debug
+        # only sessions started with events=True have an event log
+        try:
+            self.event_log = cv_session.event_log
+        except AttributeError:
+            self.event_log = None
+        self.event_policy = dict(DEFAULT_EVENT_POLICY, **(event_policy or {}))
+        self.retries = retries
+        self.flags = []
+
+    def _send(self, command):
+        """
+        Sends a command and attaches the CODE V events it raised to it. The
+        event policy then aborts, retries or flags.
+        """
+        for attempt in range(self.retries + 1):
+            start = len(self.event_log) if self.event_log is not None else 0
+            output = self.cv_session.Command(command)
+            if self.event_log is None:
+                return output
+            events = self.event_log[start:]
+            actions = {self.event_policy.get(kind, "flag") for kind, _ in events}
+            if "abort" in actions or ("retry" in actions and attempt == self.retries):
+                raise CodeVCommandError(command, events)
+            if "retry" in actions:
+                if self.debug:
+                    print(f"Retrying command after {events}")
+                continue
+            if "flag" in actions:
+                self.flags.extend({"command": command.strip(), "kind": kind, "message": message}
+                                  for kind, message in events if self.event_policy.get(kind, "flag") == "flag")
+            return output
+
+    def take_flags(self):
+        # flagged events since the last call
+        flags, self.flags = self.flags, []
+        return flags
 
     def plot_lens(self, plot_filename):
         # Set the graphics output to a file
-        self.cv_session.Command(f"GRA {plot_filename}")
+        self._send(f"GRA {plot_filename}")
         # Generate the 2D plot
-        self.cv_session.Command("VIE; PLC; GO")
+        self._send("VIE; PLC; GO")
         print(f"Plot saved to {plot_filename}.plt")
 
         # convert the .plt file to .jpg
-        self.cv_session.Command(f"GCV JPG {plot_filename}.plt")
+        self._send(f"GCV JPG {plot_filename}.plt")
         print(f"Converted {plot_filename}.plt to {plot_filename}.jpg")
 
     def query_surf_thickness(self, surface):
         command = f"?THI {surface}"
         if self.debug:
             print(f"Executing command: {command}")
-        output = self.cv_session.Command(command)
+        output = self._send(command)
         if output:
             value = float(output.split("=")[1].split("\r")[0])
             if self.debug:
@@ -40,7 +361,7 @@ class CodeVHelper:
         command = f"?SCO {surface} {order}"
         if self.debug:
             print(f"Executing command: {command}")
-        output = self.cv_session.Command(command)
+        output = self._send(command)
         if output:
             if self.debug:
                 print(f"Output: {output}")
@@ -53,15 +374,177 @@ class CodeVHelper:
         command = f"THI {surface} {new_thickness}"
         if self.debug:
             print(f"Executing command: {command}")
-        output = self.cv_session.Command(command)
+        output = self._send(command)
         if self.debug:
             print(f"Output: {output}")
 
     def apply_vignetting(self):
-        vignetting_command = 'run "C:\\CODEV202203_SR1\\macro\\setvig.seq" 1e-07 0.1 100 NO YES ;GO'
+        vignetting_command = VIGNETTING_COMMAND
         if self.debug:
             print(f"  Applying vignetting: {vignetting_command}")
-        output = self.cv_session.Command(vignetting_command)
+        output = self._send(vignetting_command)
         if self.debug:
             print(f"Output: {output}")
-        return output
\ No newline at end of file
+        return output
+
+    def snapshot(self, path=None):
+        # save the full lens state; `with helper.snapshot():` rolls back on exit
+        return LensSnapshot(self, path).save()
+
+    def command(self, command):
+        if self.debug:
+            print(f"Executing command: {command}")
+        output = self._send(command)
+        if self.debug:
+            print(f"Output: {output}")
+        return output
+
+    def evaluate(self, expression):
+        # evaluate a database item such as "(SCO S13 C2)" and return a float
+        output = self.cv_session.EvaluateExpression(expression)
+        try:
+            return float(output)
+        except (TypeError, ValueError):
+            return None
+
+    def set_xypolynomial_coeff(self, surface, order, value):
+        return self.command(f"SCO {surface} {order} {value}")
+
+    def set_xypolynomial_coeffs(self, surface, coeffs, skip_zeros=False):
+        # upload a whole coefficient set (array ordered C2, C3, ... or dict) in one command
+        return self.command(xyp.upload_command(surface, coeffs, skip_zeros=skip_zeros))
+
+    def translate_lohmann(self, delta, surfaces=LOHMANN_SURFACES):
+        # decenter and return the lohmann surfaces along z
+        for command in translate_lohmann_commands(delta, surfaces):
+            self.command(command)
+
+    def optimize(self, optimization_command=OPTIMIZATION_COMMAND):
+        return self.command(optimization_command)
+
+    def set_object_distance(self, distance):
+        # distance in meters
+        return self.command(f"THI S0 {distance*1000}")
+
+    def set_slm_tilt(self, tilt, surface="S13"):
+        return self.command(f"SCO {surface} X {tilt:.6f}")
+
+    def run_ims(self, image_file, output_file, tgr=None, pmx=None, pmy=None, dex=None, dey=None):
+        """
+        Runs an image simulation of `image_file` and saves the result to
+        `output_file`.bmp. Settings default to IMS_SETTINGS.
+        """
+        settings = dict(IMS_SETTINGS)
+        for key, value in {"tgr": tgr, "pmx": pmx, "pmy": pmy, "dex": dex, "dey": dey}.items():
+            if value is not None:
+                settings[key] = value
+
+        ims_command = f"""
+        IMS;
+        TGR {settings["tgr"]};
+        OBJ "{image_file}";
+        PMX {settings["pmx"]};
+        PMY {settings["pmy"]};
+        DEX {settings["dex"]};
+        DEY {settings["dey"]};
+        SVI BMP "{output_file}";
+        GO;
+        """
+        return self.command(ims_command)
+
+    def rotate_lohmann_lens(self, surface, theta=0, c0=LOHMANN_C0):
+        for command in rotate_lohmann_commands(surface, theta, c0):
+            self.command(command)
+
+    def rotate_SLM(self, dummy_surface, theta=0):
+        for command in rotate_SLM_commands(dummy_surface, theta):
+            self.command(command)
+
+    def build_distance_zoom(self, distances, zoomed=ZOOM_SLM_PARAMETERS):
+        # one zoom position per object distance, sent in a single command
+        return self.command("; ".join(distance_zoom_commands(distances, zoomed)))
+
+    def query_zoom_positions(self, expressions, n_positions):
+        """
+        Reads each database item of `expressions` (e.g. "(SCO S13 C2)") in every
+        zoom position with a single command. Returns an array of shape
+        (expressions, positions), NaN where a value could not be read.
+        """
+        if not expressions:
+            return np.empty((0, n_positions))
+        commands = [f'WRI "{ZOOM_TAG} {i} {k} " {zoom_expression(expression, k + 1)}'
+                    for i, expression in enumerate(expressions) for k in range(n_positions)]
+        output = self.command("; ".join(commands))
+
+        values = np.full((len(expressions), n_positions), np.nan)
+        for match in re.finditer(rf"{ZOOM_TAG}\s+(\d+)\s+(\d+)\s+(\S+)", output or ""):
+            try:
+                values[int(match.group(1)), int(match.group(2))] = float(match.group(3))
+            except ValueError:
+                continue
+        return values
+
+    def query_zoom_coeffs(self, n_positions, surface="S13", order="C2"):
+        # the SLM tilt (by default) of every zoom position
+        return self.query_zoom_positions([f"(SCO {surface} {order})"], n_positions)[0]
+
+    def run_tolerance_analysis(self, tolerances, compensators=ZOOM_SLM_PARAMETERS, tor_command=TOR_COMMAND):
+        """
+        Runs CODE V's tolerance analysis (TOR) for `tolerances` ({"DLT S3":
+        0.1, ...} in lens units) with the `compensators` as variables, and
+        returns the parsed sensitivity rows. The lens is restored afterwards,
+        so the tolerances and variables do not leak into later commands.
+        """
+        with self.snapshot():
+            self.command("; ".join(tolerance_commands(tolerances) + compensator_commands(compensators)))
+            output = self.command(tor_command)
+        return parse_tor_sensitivity(output)
+
+    def trace_rays(self, fields, distances, px, py, wavelength=1, zoom=1, surface="SI"):
+        """
+        Traces the pupil rays (px, py) for every field number and object
+        distance (m) in a single macro run. Returns the x and y coordinates
+        on `surface` as arrays of shape (distances, fields, rays), NaN where a
+        ray failed. Pass distances=None to trace at the current distance.
+        """
+        px = np.asarray(px, dtype=float).ravel()
+        py = np.asarray(py, dtype=float).ravel()
+        fields = list(fields)
+        trace_distances = [None] if distances is None else list(distances)
+
+        original_distance = self.query_surf_thickness("S0") if distances is not None else None
+        lines = []
+        for i, distance in enumerate(trace_distances):
+            if distance is not None:
+                lines.append(f"THI S0 {distance*1000}")
+            for j, field in enumerate(fields):
+                for k in range(len(px)):
+                    function = RAY_TRACE_FUNCTION.format(zoom=zoom, wavelength=wavelength, field=field,
+                                                         px=px[k], py=py[k])
+                    lines.append(f"^ray_status == {function}")
+                    lines.append(f'WRI "{RAY_TAG} {i} {j} {k} " ^ray_status (X {surface}) (Y {surface})')
+        if original_distance is not None:
+            lines.append(f"THI S0 {original_distance}")
+
+        fd, macro_file = tempfile.mkstemp(suffix=".seq", prefix="trace_")
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            output = self.command(f'run "{macro_file}"')
+        finally:
+            os.remove(macro_file)
+
+        x = np.full((len(trace_distances), len(fields), len(px)), np.nan)
+        y = np.full_like(x, np.nan)
+        pattern = rf"{RAY_TAG}\s+(\d+)\s+(\d+)\s+(\d+)\s+(\S+)\s+(\S+)\s+(\S+)"
+        for match in re.finditer(pattern, output or ""):
+            i, j, k = int(match.group(1)), int(match.group(2)), int(match.group(3))
+            try:
+                if float(match.group(4)) != 0:
+                    continue
+                x[i, j, k] = float(match.group(5))
+                y[i, j, k] = float(match.group(6))
+            except ValueError:
+                continue
+        return x, y
+
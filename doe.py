@@ -0,0 +1,356 @@
+"""
+Design of experiments over the gaps, with a quadratic response surface.
+
+sensitiviy_analysis.py spends a 10x10 grid of optimizations on each pair of
+gaps, so E1xE3 and E2xE3 were never run and the 28 pairs of the 7 gaps +
+lohmann translation are out of reach. Here all factors are varied together
+following a space-filling or factorial design, and a full quadratic model
+
+    P = b0 + sum bi xi + sum bii xi^2 + sum bij xi xj
+
+is fitted per object distance (45 terms for 8 factors). Every pairwise
+contour is then drawn from the model, with the other factors at nominal,
+from a few hundred CODE V runs in total.
+
+Designs (all in the unit cube, mapped to the factor bounds):
+    "lhs"                   Latin hypercube, n runs
+    "sobol"                 Sobol sequence (n rounded up to a power of 2)
+    "fractional_factorial"  face-centred composite design: a resolution V
+                            2^(k-p) fraction, 2k axial points and centre points
+
+The design goes in a sweep spec as an axis that assigns several parameters at
+once (see sweeps/doe_gaps.json):
+
+    {"name": "run", "design": {"method": "lhs", "n": 200, "seed": 1,
+                               "factors": {"S3": [-2e-3, 2e-3], "S9": [-2e-3, 2e-3]}}}
+
+Usage:
+    python doe.py sweeps/doe_gaps.json --out doe.jsonl --plot-dir doe_plots
+    python doe.py sweeps/doe_gaps.json --records doe.jsonl --plot-dir doe_plots   # refit only
+"""
+
+import argparse
+import itertools
+import json
+import os
+
+import numpy as np
+
+# ==============================================================================
+# Designs
+# ==============================================================================
+
+# Joe & Kuo direction numbers (s, a, m) for the Sobol dimensions after the first
+SOBOL_DIRECTIONS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]),
+]
+SOBOL_BITS = 32
+
+# generators of resolution V fractions, as the base factors multiplied into each added factor
+FRACTION_GENERATORS = {
+    5: [(0, 1, 2, 3)],
+    6: [(0, 1, 2, 3, 4)],
+    7: [(0, 1, 2, 3, 4, 5)],
+    8: [(0, 1, 2, 3), (0, 1, 4, 5)],
+    9: [(0, 2, 3, 5, 6), (1, 2, 4, 5, 6)],
+}
+
+
+def latin_hypercube(n, k, seed=None):
+    """
+    n points in [0, 1)^k, one in each of the n strata of every factor,
+    jittered inside the stratum.
+    """
+    rng = np.random.default_rng(seed)
+    strata = np.argsort(rng.random((k, n)), axis=1).T
+    return (strata + rng.random((n, k)))/n
+
+
+def sobol_directions(k):
+    # (k, SOBOL_BITS) direction integers, the first dimension is van der Corput
+    if k > len(SOBOL_DIRECTIONS) + 1:
+        raise ValueError(f"Sobol design supports up to {len(SOBOL_DIRECTIONS) + 1} factors")
+    shifts = SOBOL_BITS - 1 - np.arange(SOBOL_BITS)
+    directions = np.zeros((k, SOBOL_BITS), dtype=np.uint64)
+    directions[0] = 1 << shifts.astype(np.uint64)
+    for d, (s, a, m) in enumerate(SOBOL_DIRECTIONS[:k - 1], start=1):
+        v = [mi << (SOBOL_BITS - 1 - i) for i, mi in enumerate(m)]
+        for i in range(s, SOBOL_BITS):
+            value = v[i - s] ^ (v[i - s] >> s)
+            for j in range(1, s):
+                if (a >> (s - 1 - j)) & 1:
+                    value ^= v[i - j]
+            v.append(value)
+        directions[d] = v
+    return directions
+
+
+def sobol(n, k, seed=None):
+    """
+    First 2^ceil(log2 n) points of the k-dimensional Sobol sequence (Gray code
+    order). With a seed the points get a random digital shift, which keeps
+    the stratification.
+    """
+    n = 1 << max(int(np.ceil(np.log2(max(n, 1)))), 0)
+    directions = sobol_directions(k)
+    points = np.zeros((n, k), dtype=np.uint64)
+    state = np.zeros(k, dtype=np.uint64)
+    for i in range(1, n):
+        # the lowest zero bit of i - 1 selects the direction number
+        c = (i & -i).bit_length() - 1
+        state ^= directions[:, c]
+        points[i] = state
+    if seed is not None:
+        shift = np.random.default_rng(seed).integers(0, 1 << SOBOL_BITS, size=k, dtype=np.uint64)
+        points ^= shift
+    return points.astype(np.float64)/float(1 << SOBOL_BITS)
+
+
+def two_level_fraction(k):
+    # +-1 matrix of the resolution V fraction (full factorial up to 4 factors)
+    if k <= 4:
+        return np.array(list(itertools.product([-1, 1], repeat=k)), dtype=float)
+    if k not in FRACTION_GENERATORS:
+        raise ValueError(f"No resolution V fraction for {k} factors")
+    generators = FRACTION_GENERATORS[k]
+    base = np.array(list(itertools.product([-1, 1], repeat=k - len(generators))), dtype=float)
+    added = [np.prod(base[:, list(word)], axis=1) for word in generators]
+    return np.column_stack([base] + added)
+
+
+def central_composite(k, n_center=3):
+    """
+    Face-centred composite design in [0, 1]^k: the two-level fraction at the
+    corners, the 2k face centres and n_center centre points. All quadratic and
+    two-factor interaction terms are estimable, and no point leaves the bounds.
+    """
+    corners = two_level_fraction(k)
+    axial = np.vstack([np.eye(k), -np.eye(k)])
+    center = np.zeros((n_center, k))
+    return (np.vstack([corners, axial, center]) + 1)/2
+
+
+def unit_design(method, n, k, seed=None, n_center=3):
+    if method == "lhs":
+        return latin_hypercube(n, k, seed)
+    if method == "sobol":
+        return sobol(n, k, seed)
+    if method == "fractional_factorial":
+        return central_composite(k, n_center)
+    raise ValueError(f"Unknown design method '{method}'")
+
+
+DESIGN_METHODS = ["lhs", "sobol", "fractional_factorial"]
+
+
+def design_rows(design):
+    """
+    Factor assignments of a design axis, one {factor: value} dict per run in
+    spec units. `design` is the "design" entry of the axis.
+    """
+    factors = design["factors"]
+    bounds = np.array([factors[name] for name in factors], dtype=float)
+    unit = unit_design(design.get("method", "lhs"), int(design.get("n", 0)), len(factors),
+                       design.get("seed"), int(design.get("n_center", 3)))
+    values = bounds[:, 0] + unit*(bounds[:, 1] - bounds[:, 0])
+    return [{name: float(v) for name, v in zip(factors, row)} for row in values]
+
+
+# ==============================================================================
+# Response surface
+# ==============================================================================
+
+def quadratic_terms(names):
+    # term labels in column order: 1, linear, squares, interactions
+    return (["1"] + list(names) + [f"{name}^2" for name in names]
+            + [f"{a}*{b}" for a, b in itertools.combinations(names, 2)])
+
+
+def quadratic_features(x):
+    """
+    Design matrix of the full quadratic model for coded factors x (n, k).
+    """
+    x = np.atleast_2d(x)
+    i, j = np.triu_indices(x.shape[1], k=1)
+    return np.hstack([np.ones((x.shape[0], 1)), x, x*x, x[:, i]*x[:, j]])
+
+
+class ResponseSurface:
+    """
+    Least-squares quadratic model of one response over the factors. Factors
+    are coded to [-1, 1] over their bounds before fitting, so the coefficients
+    are comparable between factors (effect of a half-range change).
+    """
+
+    def __init__(self, names, bounds):
+        self.names = list(names)
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.terms = quadratic_terms(self.names)
+        self.coefficients = None
+        self.r2 = None
+        self.q2 = None
+        self.rmse = None
+        self.n = 0
+
+    def code(self, x):
+        low, high = self.bounds[:, 0], self.bounds[:, 1]
+        return (np.asarray(x, dtype=float) - (high + low)/2)/((high - low)/2)
+
+    def fit(self, x, y):
+        """
+        Fits the model to the runs x (n, k) in spec units and responses y (n,).
+        Runs with a missing response are dropped. q2 is the leave-one-out
+        (PRESS) coefficient of determination.
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        valid = np.isfinite(y) & np.all(np.isfinite(x), axis=1)
+        x, y = x[valid], y[valid]
+        features = quadratic_features(self.code(x))
+        if len(y) < features.shape[1]:
+            raise ValueError(f"{len(y)} runs cannot fit the {features.shape[1]} terms of the quadratic model")
+
+        self.coefficients, _, rank, _ = np.linalg.lstsq(features, y, rcond=None)
+        if rank < features.shape[1]:
+            print(f"Warning: quadratic model is rank deficient ({rank}/{features.shape[1]}), "
+                  f"some terms are aliased by the design")
+        residuals = y - features @ self.coefficients
+        total = np.sum((y - y.mean())**2)
+
+        # leave-one-out residuals from the hat matrix diagonal
+        q, _ = np.linalg.qr(features)
+        leverage = np.sum(q*q, axis=1)
+        press = np.sum((residuals/np.maximum(1 - leverage, 1e-12))**2)
+
+        self.n = len(y)
+        self.rmse = float(np.sqrt(np.mean(residuals**2)))
+        self.r2 = float(1 - np.sum(residuals**2)/total) if total > 0 else None
+        self.q2 = float(1 - press/total) if total > 0 else None
+        return self
+
+    def predict(self, x):
+        return quadratic_features(self.code(x)) @ self.coefficients
+
+    def effects(self):
+        # {term: coefficient}, largest magnitude first, constant excluded
+        order = np.argsort(-np.abs(self.coefficients[1:])) + 1
+        return {self.terms[i]: float(self.coefficients[i]) for i in order}
+
+    def pair_grid(self, a, b, num=41, nominal=None):
+        """
+        Model response over factors a and b on a num x num grid, the other
+        factors held at `nominal` ({factor: value}, default 0, i.e. the
+        baseline lens). Returns (A, B, P) like np.meshgrid.
+        """
+        i, j = self.names.index(a), self.names.index(b)
+        A, B = np.meshgrid(np.linspace(*self.bounds[i], num), np.linspace(*self.bounds[j], num))
+        base = np.array([(nominal or {}).get(name, 0.0) for name in self.names])
+        x = np.tile(base, (A.size, 1))
+        x[:, i] = A.ravel()
+        x[:, j] = B.ravel()
+        return A, B, self.predict(x).reshape(A.shape)
+
+    def save(self, path):
+        np.savez(path, names=np.array(self.names), bounds=self.bounds, terms=np.array(self.terms),
+                 coefficients=self.coefficients, r2=self.r2, q2=self.q2, rmse=self.rmse, n=self.n)
+
+
+def design_axis(spec):
+    return next(axis for axis in spec["axes"] if "design" in axis)
+
+
+def fit_records(spec, records, response="power", group_key=None):
+    """
+    Fits one ResponseSurface per value of `group_key` (the first non-design
+    axis, normally the distance) from sweep records. Returns {group: model}.
+    """
+    factors = design_axis(spec)["design"]["factors"]
+    names = list(factors)
+    bounds = [factors[name] for name in names]
+    if group_key is None:
+        group_key = next((axis["name"] for axis in spec["axes"] if "design" not in axis), None)
+
+    groups = {}
+    for record in records:
+        groups.setdefault(record.get(group_key), []).append(record)
+
+    models = {}
+    for group, group_records in groups.items():
+        x = [[record[name] for name in names] for record in group_records]
+        y = [np.nan if record.get(response) is None else record[response] for record in group_records]
+        models[group] = ResponseSurface(names, bounds).fit(x, y)
+    return models
+
+
+def plot_pairs(plotter, models, directory, response="power", scale=1e3, unit="mm", num=41, n_levels=30):
+    # one contour per (group, factor pair), like sensitivity_analysis_e1_e2.png
+    for group, model in models.items():
+        for a, b in itertools.combinations(model.names, 2):
+            A, B, P = model.pair_grid(a, b, num)
+            name = f"{group}_{a}_{b}"
+            plotter.figure(name, figsize=(8, 6))
+            plotter.contourf(name, A*scale, B*scale, P, levels=n_levels, cmap='viridis',
+                             colorbar_label='Optical Power (Diopters)')
+            plotter.set_labels(name, title=f"{response}: {a} x {b} (model, dist = {group})",
+                               xlabel=f"{a} ({unit})", ylabel=f"{b} ({unit})")
+            plotter.save(name, os.path.join(directory, f"doe_{group}_{a}_{b}.png"))
+            plotter.close(name)
+
+
+def print_models(models, top=8):
+    for group, model in models.items():
+        r2 = "--" if model.r2 is None else f"{model.r2:.4f}"
+        q2 = "--" if model.q2 is None else f"{model.q2:.4f}"
+        print(f"dist = {group}: {model.n} runs, R2 {r2}, Q2 {q2}, RMSE {model.rmse:.3e} D")
+        for term, value in list(model.effects().items())[:top]:
+            print(f"    {term:>16s}  {value:+.4e}")
+
+
+if __name__ == '__main__':
+    import sweep_engine as se
+
+    parser = argparse.ArgumentParser(description="Run a DOE sweep and fit quadratic response surfaces")
+    parser.add_argument("spec", help="sweep spec with a design axis")
+    parser.add_argument("--out", help="JSONL file the records are streamed to")
+    parser.add_argument("--records", help="fit existing records instead of running the sweep")
+    parser.add_argument("--response", default="power")
+    parser.add_argument("--plot-dir", help="directory for the pairwise contour plots")
+    parser.add_argument("--session", choices=se.SESSION_TYPES, help="overrides the spec's session type")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    spec = se.load_spec(args.spec)
+    if args.session:
+        spec["session"] = args.session
+    if args.records:
+        with open(args.records, "r") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    else:
+        print(f"Running {len(se.expand_points(spec))} points")
+        sinks = [se.JsonlSink(args.out)] if args.out else []
+        try:
+            records = list(se.run_sweep(spec, sink=sinks, debug=args.debug))
+        finally:
+            for sink in sinks:
+                sink.close()
+
+    models = fit_records(spec, records, response=args.response)
+    print_models(models)
+
+    if args.plot_dir:
+        from plot_worker import PlotWorker
+
+        os.makedirs(args.plot_dir, exist_ok=True)
+        for group, model in models.items():
+            model.save(os.path.join(args.plot_dir, f"doe_model_{group}.npz"))
+        with PlotWorker() as plotter:
+            plot_pairs(plotter, models, args.plot_dir, response=args.response)
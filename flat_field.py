@@ -0,0 +1,114 @@
+"""
+Streaming flat-field correction of the star calibration frames.
+
+star_color_correction.py produces a d_{dist}_slm_{power}_white.bmp and
+_black.bmp frame for every star frame. This stage pairs each star frame with
+its white/black frames and applies
+
+    corrected = (image - black)/(white - black)
+
+vectorised over chunks of frames. Only one chunk is held in memory at a time;
+the corrected frames are written into a single memory-mapped .npy array
+(float16 by default) with an index of distances, powers and source files
+saved next to it.
+
+    index = flat_field_directory("calibration_star", "calibration_star/flat_field")
+    frames = np.load("calibration_star/flat_field/corrected.npy", mmap_mode="r")
+
+Usage:
+    python flat_field.py calibration_star calibration_star/flat_field
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from image_io import parse_frame_name, read_bmp, to_gray
+
+
+def find_triplets(directory):
+    """
+    Groups the frames of a directory by (distance, power). Returns the sorted
+    list of (distance, power, star, white, black) paths with all three present
+    and the list of star frames that have no complete pair.
+    """
+    groups = {}
+    for filename in os.listdir(directory):
+        parsed = parse_frame_name(filename)
+        if parsed is None:
+            continue
+        distance, power, kind = parsed
+        groups.setdefault((distance, power), {})[kind or "star"] = os.path.join(directory, filename)
+
+    triplets, missing = [], []
+    for (distance, power), files in sorted(groups.items()):
+        if all(kind in files for kind in ("star", "white", "black")):
+            triplets.append((distance, power, files["star"], files["white"], files["black"]))
+        elif "star" in files:
+            missing.append(files["star"])
+    return triplets, missing
+
+
+def correct_stack(images, whites, blacks, min_range=1.0):
+    """
+    (image - black)/(white - black) for stacks of frames, in float32 and in
+    place where possible. Pixels where white - black < min_range are set to 0.
+    """
+    images = np.asarray(images, dtype=np.float32)
+    blacks = np.asarray(blacks, dtype=np.float32)
+    scale = np.asarray(whites, dtype=np.float32) - blacks
+    images -= blacks
+    valid = scale >= min_range
+    np.divide(images, scale, out=images, where=valid)
+    images[~valid] = 0
+    return images
+
+
+def flat_field_directory(directory, output_dir, chunk_size=8, dtype=np.float16, min_range=1.0):
+    """
+    Corrects every complete (star, white, black) triplet of `directory` in
+    chunks of `chunk_size` and writes output_dir/corrected.npy (frames, H, W)
+    plus output_dir/index.npz. Returns the index.
+    """
+    triplets, missing = find_triplets(directory)
+    if missing:
+        print(f"Skipping {len(missing)} frames without white/black pairs")
+    if not triplets:
+        raise ValueError(f"No complete frame triplets in {directory}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    height, width = to_gray(read_bmp(triplets[0][2])).shape
+    corrected = np.lib.format.open_memmap(os.path.join(output_dir, "corrected.npy"), mode="w+",
+                                          dtype=dtype, shape=(len(triplets), height, width))
+
+    for start in range(0, len(triplets), chunk_size):
+        chunk = triplets[start:start + chunk_size]
+        # one chunk of each kind in memory at a time
+        stacks = [np.stack([to_gray(read_bmp(t[column])) for t in chunk]) for column in (2, 3, 4)]
+        corrected[start:start + len(chunk)] = correct_stack(*stacks, min_range=min_range)
+        print(f"  corrected {start + len(chunk)}/{len(triplets)} frames")
+
+    corrected.flush()
+    del corrected
+
+    index = {
+        "distance": np.array([t[0] for t in triplets]),
+        "power": np.array([t[1] for t in triplets]),
+        "files": np.array([os.path.basename(t[2]) for t in triplets]),
+    }
+    np.savez(os.path.join(output_dir, "index.npz"), **index)
+    return index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Flat-field correct the star calibration frames")
+    parser.add_argument("directory")
+    parser.add_argument("output_dir")
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--float32", action="store_true", help="store float32 instead of float16")
+    args = parser.parse_args()
+
+    index = flat_field_directory(args.directory, args.output_dir, chunk_size=args.chunk_size,
+                                 dtype=np.float32 if args.float32 else np.float16)
+    print(f"Wrote {len(index['files'])} corrected frames to {args.output_dir}")
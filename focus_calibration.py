@@ -0,0 +1,244 @@
+"""
+Best-focus search for the Siemens star calibration.
+
+star_calibration.py runs a full IMS every 0.05 D over +-0.5 D around a hand
+typed power, i.e. 21 image simulations per distance. Here each simulated frame
+is scored in-process with a sharpness metric and a bounded Brent search
+(golden section with parabolic steps) looks for the SLM power with the
+sharpest image. The search is seeded with the power the optimizer finds at
+that distance (AUT + S13 tilt), so it usually converges in 6-8 IMS runs.
+
+The result is a calibrated power table (calibrated_powers.csv and .npz) in the
+results directory, next to the simulated frames.
+
+Usage:
+    python focus_calibration.py
+"""
+
+import csv
+import math
+import os
+import time
+
+import numpy as np
+
+import codev_helper as cvh
+from image_io import format_for_filename, frame_name, read_bmp, to_gray
+from params import Params
+
+params = Params()
+
+
+def sharpness(image):
+    """
+    Normalised gradient energy of a frame: mean squared finite difference
+    divided by the squared mean intensity, so that it does not depend on the
+    overall brightness of the simulation.
+    """
+    gray = to_gray(image)
+    gx = np.diff(gray, axis=1)
+    gy = np.diff(gray, axis=0)
+    energy = float(np.mean(gx*gx) + np.mean(gy*gy))
+    mean = float(gray.mean())
+    return energy/(mean*mean) if mean > 0 else 0.0
+
+
+def brent_maximize(func, lower, upper, x0=None, xatol=0.01, max_evals=10):
+    """
+    Bounded Brent search for the maximum of func on [lower, upper], starting
+    at x0 (default: the golden section point). Returns (best_x, best_value,
+    history) where history lists every (x, value) evaluated.
+    """
+    golden_mean = 0.5*(3 - math.sqrt(5))
+    sqrt_eps = math.sqrt(2.2e-16)
+    history = []
+
+    def f(x):
+        # minimise the negative sharpness
+        value = func(x)
+        history.append((x, value))
+        return -value
+
+    a, b = lower, upper
+    if x0 is None:
+        x0 = a + golden_mean*(b - a)
+    xf = min(max(x0, a), b)
+    nfc = fulc = xf
+    rat = e = 0.0
+    fx = f(xf)
+    ffulc = fnfc = fx
+    xm = 0.5*(a + b)
+    tol1 = sqrt_eps*abs(xf) + xatol/3
+    tol2 = 2*tol1
+
+    while abs(xf - xm) > (tol2 - 0.5*(b - a)) and len(history) < max_evals:
+        golden = True
+        if abs(e) > tol1:
+            # try a parabolic step through the three best points
+            golden = False
+            r = (xf - nfc)*(fx - ffulc)
+            q = (xf - fulc)*(fx - fnfc)
+            p = (xf - fulc)*q - (xf - nfc)*r
+            q = 2*(q - r)
+            if q > 0:
+                p = -p
+            q = abs(q)
+            r = e
+            e = rat
+            if abs(p) < abs(0.5*q*r) and q*(a - xf) < p < q*(b - xf):
+                rat = p/q
+                x = xf + rat
+                if (x - a) < tol2 or (b - x) < tol2:
+                    rat = tol1 if xm >= xf else -tol1
+            else:
+                golden = True
+        if golden:
+            e = (a - xf) if xf >= xm else (b - xf)
+            rat = golden_mean*e
+
+        x = xf + (1 if rat >= 0 else -1)*max(abs(rat), tol1)
+        fu = f(x)
+
+        if fu <= fx:
+            if x >= xf:
+                a = xf
+            else:
+                b = xf
+            fulc, ffulc = nfc, fnfc
+            nfc, fnfc = xf, fx
+            xf, fx = x, fu
+        else:
+            if x < xf:
+                a = x
+            else:
+                b = x
+            if fu <= fnfc or nfc == xf:
+                fulc, ffulc = nfc, fnfc
+                nfc, fnfc = x, fu
+            elif fu <= ffulc or fulc == xf or fulc == nfc:
+                fulc, ffulc = x, fu
+
+        xm = 0.5*(a + b)
+        tol1 = sqrt_eps*abs(xf) + xatol/3
+        tol2 = 2*tol1
+
+    return xf, -fx, history
+
+
+def optimizer_seed_power(helper, working_dir):
+    """
+    Power the optimizer picks at the current object distance (vignetting +
+    AUT, then the S13 tilt). The lens is saved before and restored after, so
+    AUT does not leave its changes behind.
+    """
+    with helper.snapshot(os.path.join(working_dir, "focus_seed_snapshot")):
+        helper.apply_vignetting()
+        helper.optimize()
+        tilt = helper.query_xypolynomial_coeff("S13", "C2")
+    return None if tilt is None else params.tilt2power(tilt)
+
+
+def calibrate_distance(helper, distance, image_file, results_dir, seed_power, half_width=0.5,
+                       xatol=0.01, max_evals=8, ims_settings=None):
+    """
+    Searches the sharpest SLM power within seed_power +- half_width at one
+    object distance. Every evaluation is one IMS run whose frame is kept.
+    """
+    helper.set_object_distance(distance)
+    evaluated = {}
+
+    def evaluate(power):
+        # the frame names only keep two decimals, so powers with the same name share
+        # the frame and its sharpness
+        key = format_for_filename(power)
+        if key in evaluated:
+            return evaluated[key]
+        helper.set_slm_tilt(params.calculate_tilt(power))
+        output_file = os.path.join(results_dir, frame_name(distance, power))
+        t0 = time.time()
+        helper.run_ims(image_file, output_file, **(ims_settings or {}))
+        value = sharpness(read_bmp(output_file + ".bmp"))
+        print(f"  power {power:.3f} D: sharpness {value:.5f} ({time.time() - t0:.1f} s)")
+        evaluated[key] = value
+        return value
+
+    best_power, best_value, history = brent_maximize(evaluate, seed_power - half_width, seed_power + half_width,
+                                                     x0=seed_power, xatol=xatol, max_evals=max_evals)
+    return {
+        "distance": distance,
+        "seed_power": seed_power,
+        "best_power": best_power,
+        "sharpness": best_value,
+        "n_ims": len(evaluated),
+        "history": history,
+    }
+
+
+def write_power_table(results, results_dir):
+    # calibrated power table as CSV and NPZ
+    csv_path = os.path.join(results_dir, "calibrated_powers.csv")
+    with open(csv_path, mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Distance", "SeedPower", "BestPower", "Sharpness", "IMSRuns"])
+        for r in results:
+            writer.writerow([r["distance"], r["seed_power"], r["best_power"], r["sharpness"], r["n_ims"]])
+
+    np.savez(os.path.join(results_dir, "calibrated_powers.npz"),
+             distance=np.array([r["distance"] for r in results]),
+             seed_power=np.array([r["seed_power"] for r in results]),
+             best_power=np.array([r["best_power"] for r in results]),
+             sharpness=np.array([r["sharpness"] for r in results]))
+    return csv_path
+
+
+if __name__ == '__main__':
+    # --- 1. Define Input Data and Configuration ---
+
+    # p_t is only used when the optimizer seed cannot be read
+    tasks = [
+        {'d': 0.5, 'p_t': 1.32},
+        {'d': 0.6, 'p_t': 1.07},
+        {'d': 0.7, 'p_t': 0.9},
+        {'d': 0.8, 'p_t': 0.78},
+        {'d': 2, 'p_t': 0.29},
+        {'d': 3.75, 'p_t': 0.15},
+    ]
+
+    WORKING_DIR = os.getcwd() + "\\"
+    LENS_FILE = WORKING_DIR + "system_with_camera"
+    RESULTS_DIR = WORKING_DIR + "calibration_star_search\\"
+    IMAGE_FILE = WORKING_DIR + "star_60_spokes.bmp"
+
+    cv_session = None
+    try:
+        cv_session = cvh.start_session(WORKING_DIR, LENS_FILE, ["MPP 8"], debug=True)
+        cvHelper = cvh.CodeVHelper(cv_session)
+
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+            print(f"Created results directory: {RESULTS_DIR}")
+
+        results = []
+        for task in tasks:
+            distance = task['d']
+            print(f"\n--- Calibrating distance: {distance} ---")
+
+            cvHelper.set_object_distance(distance)
+            seed = optimizer_seed_power(cvHelper, WORKING_DIR)
+            if seed is None:
+                seed = task['p_t']
+            print(f"  Seed power: {seed:.3f} D")
+
+            result = calibrate_distance(cvHelper, distance, IMAGE_FILE, RESULTS_DIR, seed)
+            print(f"  Best focus at {result['best_power']:.3f} D after {result['n_ims']} IMS runs")
+            results.append(result)
+
+        table = write_power_table(results, RESULTS_DIR)
+        print(f"\nCalibrated power table written to {table}")
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+    finally:
+        cvh.stop_session(cv_session)
+        print("\nCODE V session stopped.")
@@ -0,0 +1,121 @@
+"""
+Image helpers for the IMS calibration frames.
+
+CODE V's IMS writes uncompressed BMP files named d_{distance}_slm_{power}.bmp
+(plus _white / _black for the colour-correction frames). This module reads and
+writes those BMPs with NumPy only and handles the file naming, so the analysis
+scripts do not need an imaging library.
+"""
+
+import os
+import re
+
+import numpy as np
+
+FRAME_PATTERN = re.compile(r"d_(?P<dist>-?\d+p\d+)_slm_(?P<power>-?\d+p\d+)(?:_(?P<kind>white|black))?\.bmp$",
+                           re.IGNORECASE)
+
+
+def format_for_filename(value: float) -> str:
+    """
+    Formats a float into the '{integer}p{decimal}' file name format, rounded
+    to two decimals. Example: 12.34 -> "12p34", 1.996 -> "2p00"
+    """
+    # + 0.0 turns a rounded -0.0 into 0.0, so -0.004 gives "0p00"
+    return f"{round(value, 2) + 0.0:.2f}".replace(".", "p")
+
+
+def parse_filename_value(text: str) -> float:
+    # inverse of format_for_filename: "-1p05" -> -1.05
+    return float(text.replace("p", "."))
+
+
+def frame_name(distance, power, kind=None):
+    name = f"d_{format_for_filename(distance)}_slm_{format_for_filename(power)}"
+    return f"{name}_{kind}" if kind else name
+
+
+def parse_frame_name(filename):
+    """
+    Returns (distance, power, kind) for a calibration frame file name, kind
+    being None, "white" or "black". Returns None for other files.
+    """
+    match = FRAME_PATTERN.search(os.path.basename(filename))
+    if not match:
+        return None
+    return parse_filename_value(match.group("dist")), parse_filename_value(match.group("power")), match.group("kind")
+
+
+def read_bmp(path):
+    """
+    Reads an uncompressed 8, 24 or 32 bit BMP. Returns a uint8 array of shape
+    (height, width) for greyscale palettes and (height, width, 3) for colour,
+    top row first.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if data[:2] != b"BM":
+        raise ValueError(f"{path} is not a BMP file")
+    offset = int.from_bytes(data[10:14], "little")
+    dib_size = int.from_bytes(data[14:18], "little")
+    width = int.from_bytes(data[18:22], "little", signed=True)
+    height = int.from_bytes(data[22:26], "little", signed=True)
+    bpp = int.from_bytes(data[28:30], "little")
+    compression = int.from_bytes(data[30:34], "little")
+    if compression not in (0, 3):
+        raise ValueError(f"{path} uses unsupported BMP compression {compression}")
+
+    bytes_per_pixel = bpp//8
+    stride = (width*bytes_per_pixel + 3) & ~3
+    rows = np.frombuffer(data, dtype=np.uint8, count=stride*abs(height), offset=offset)
+    rows = rows.reshape(abs(height), stride)[:, :width*bytes_per_pixel]
+
+    if bpp == 8:
+        n_colors = int.from_bytes(data[46:50], "little") or 256
+        palette = np.frombuffer(data, dtype=np.uint8, count=4*n_colors, offset=14 + dib_size).reshape(-1, 4)
+        rgb = palette[:, 2::-1]
+        if np.all(rgb[:, 0] == rgb[:, 1]) and np.all(rgb[:, 1] == rgb[:, 2]):
+            image = rgb[:, 0][rows]
+        else:
+            image = rgb[rows]
+    elif bpp in (24, 32):
+        image = rows.reshape(abs(height), width, bytes_per_pixel)[:, :, 2::-1]
+    else:
+        raise ValueError(f"{path} has unsupported bit depth {bpp}")
+
+    # BMP rows are stored bottom-up unless the height is negative
+    if height > 0:
+        image = image[::-1]
+    return np.ascontiguousarray(image)
+
+
+def write_bmp(path, image):
+    """
+    Writes a 2D uint8 array as an 8 bit greyscale BMP.
+    """
+    image = np.asarray(image, dtype=np.uint8)
+    height, width = image.shape
+    stride = (width + 3) & ~3
+    palette = np.repeat(np.arange(256, dtype=np.uint8), 4).reshape(256, 4)
+    palette[:, 3] = 0
+    offset = 14 + 40 + palette.nbytes
+    size = offset + stride*height
+
+    header = b"BM" + size.to_bytes(4, "little") + bytes(4) + offset.to_bytes(4, "little")
+    dib = (40).to_bytes(4, "little") + width.to_bytes(4, "little", signed=True) \
+        + height.to_bytes(4, "little", signed=True) + (1).to_bytes(2, "little") + (8).to_bytes(2, "little") \
+        + bytes(4) + (stride*height).to_bytes(4, "little") + bytes(8) + (256).to_bytes(4, "little") + bytes(4)
+
+    rows = np.zeros((height, stride), dtype=np.uint8)
+    rows[:, :width] = image[::-1]
+    with open(path, "wb") as f:
+        f.write(header + dib + palette.tobytes() + rows.tobytes())
+
+
+def to_gray(image):
+    # luminance as float32
+    image = np.asarray(image, dtype=np.float32)
+    if image.ndim == 2:
+        return image
+    return image[..., 0]*0.299 + image[..., 1]*0.587 + image[..., 2]*0.114
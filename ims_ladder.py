@@ -0,0 +1,152 @@
+"""
+Coarse-to-fine IMS fidelity ladder for power sweeps.
+
+Every IMS in the calibration scripts runs at TGR 1024; PMX 15; PMY 15, even for
+powers far from focus that are thrown away afterwards. Here the whole power
+range is first screened at a cheap grid / PSF sampling, the frames are scored
+with the in-process sharpness metric, and only the best candidates are re-run
+at the next level. The last level uses the full calibration settings.
+
+For every distance the runner reports the time spent per level, the time
+saved against running every power at full fidelity (estimated from the
+measured full-fidelity runs) and the rank agreement (Spearman) between
+consecutive levels on the candidates they share.
+
+Usage:
+    python ims_ladder.py
+"""
+
+import os
+import time
+
+import numpy as np
+
+import codev_helper as cvh
+from focus_calibration import sharpness
+from image_io import frame_name, read_bmp
+from params import Params
+
+params = Params()
+
+# "keep" is the number of candidates passed on to the next level
+DEFAULT_LADDER = [
+    {"tgr": 256, "pmx": 5, "pmy": 5, "keep": 6},
+    {"tgr": 512, "pmx": 9, "pmy": 9, "keep": 3},
+    {"tgr": 1024, "pmx": 15, "pmy": 15},
+]
+
+
+def rank_agreement(scores_a, scores_b):
+    """
+    Spearman rank correlation of two {power: score} dicts over the powers
+    they share. None when fewer than 3 are shared.
+    """
+    common = sorted(set(scores_a) & set(scores_b))
+    if len(common) < 3:
+        return None
+    a = np.argsort(np.argsort([scores_a[p] for p in common]))
+    b = np.argsort(np.argsort([scores_b[p] for p in common]))
+    if a.std() == 0 or b.std() == 0:
+        return None
+    return float(np.corrcoef(a, b)[0, 1])
+
+
+def run_ladder(helper, distance, powers, image_file, results_dir, ladder=DEFAULT_LADDER):
+    """
+    Runs the fidelity ladder for one object distance over the candidate
+    powers. Frames of the lower levels get an _L{level} suffix so they are not
+    mistaken for calibration frames; the last level writes the usual names.
+    """
+    helper.set_object_distance(distance)
+    candidates = [float(p) for p in powers]
+    levels = []
+
+    for level, settings in enumerate(ladder):
+        last = level == len(ladder) - 1
+        ims_settings = {key: value for key, value in settings.items() if key != "keep"}
+        scores, durations = {}, []
+
+        for power in candidates:
+            helper.set_slm_tilt(params.calculate_tilt(power))
+            output_file = os.path.join(results_dir, frame_name(distance, power))
+            if not last:
+                output_file += f"_L{level}"
+            t0 = time.time()
+            helper.run_ims(image_file, output_file, **ims_settings)
+            durations.append(time.time() - t0)
+            scores[power] = sharpness(read_bmp(output_file + ".bmp"))
+
+        levels.append({"settings": ims_settings, "scores": scores, "time": float(sum(durations)),
+                       "time_per_run": float(np.mean(durations))})
+        print(f"  level {level} ({ims_settings}): {len(candidates)} runs in {sum(durations):.1f} s")
+
+        if not last:
+            keep = settings.get("keep", max(1, len(candidates)//2))
+            candidates = sorted(scores, key=scores.get, reverse=True)[:keep]
+
+    final_scores = levels[-1]["scores"]
+    best_power = max(final_scores, key=final_scores.get)
+
+    # cost of running every power at full fidelity, from the measured full runs
+    full_cost = len(powers)*levels[-1]["time_per_run"]
+    spent = sum(level["time"] for level in levels)
+    agreement = [rank_agreement(levels[i]["scores"], levels[i + 1]["scores"]) for i in range(len(levels) - 1)]
+    top_agreement = [max(levels[i]["scores"], key=levels[i]["scores"].get) == best_power
+                     for i in range(len(levels) - 1)]
+
+    return {
+        "distance": distance,
+        "best_power": best_power,
+        "levels": levels,
+        "time_spent": spent,
+        "time_saved": full_cost - spent,
+        "rank_agreement": agreement,
+        "top_agreement": top_agreement,
+    }
+
+
+def print_report(result):
+    print(f"  Best power: {result['best_power']:.2f} D")
+    print(f"  Time spent: {result['time_spent']/60:.2f} min, saved vs full fidelity: {result['time_saved']/60:.2f} min")
+    for i, (rho, top) in enumerate(zip(result["rank_agreement"], result["top_agreement"])):
+        rho_text = "n/a" if rho is None else f"{rho:.2f}"
+        print(f"  Level {i} -> {i + 1}: rank agreement {rho_text}, same best power: {top}")
+
+
+if __name__ == '__main__':
+    tasks = [
+        {'d': 0.5, 'p_t': 1.32},
+        {'d': 0.6, 'p_t': 1.07},
+        {'d': 0.7, 'p_t': 0.9},
+        {'d': 0.8, 'p_t': 0.78},
+        {'d': 2, 'p_t': 0.29},
+        {'d': 3.75, 'p_t': 0.15},
+    ]
+
+    WORKING_DIR = os.getcwd() + "\\"
+    LENS_FILE = WORKING_DIR + "system_with_camera"
+    RESULTS_DIR = WORKING_DIR + "calibration_star\\"
+    IMAGE_FILE = WORKING_DIR + "star_60_spokes.bmp"
+
+    cv_session = None
+    try:
+        cv_session = cvh.start_session(WORKING_DIR, LENS_FILE, ["MPP 8"], debug=True)
+        cvHelper = cvh.CodeVHelper(cv_session)
+
+        if not os.path.exists(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+            print(f"Created results directory: {RESULTS_DIR}")
+
+        for task in tasks:
+            print(f"\n--- Starting task for distance: {task['d']} ---")
+            step = 0.05
+            powers = np.arange(task['p_t'] - 0.5, task['p_t'] + 0.5 + step, step)
+            result = run_ladder(cvHelper, task['d'], powers, IMAGE_FILE, RESULTS_DIR)
+            print_report(result)
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+    finally:
+        cvh.stop_session(cv_session)
+        print("\nCODE V session stopped.")
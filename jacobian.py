@@ -0,0 +1,167 @@
+"""
+Central-difference Jacobian of the power over all parameters and distances.
+
+For small epsilons the curves in sensitivity_analysis/ are close to straight
+lines, yet each one costs 15 optimizations per surface and distance. Here
+only the points needed for central differences are run, for every parameter
+at once:
+
+    dP/dx = (P(+h) - P(-h)) / 2h
+
+and, for the linearity check, the same at +-2h. The two estimates give a
+Richardson-extrapolated slope (4 D_h - D_2h)/3, their relative disagreement
+and the curvature (P(+h) - 2 P(0) + P(-h))/h^2. The nonlinearity is the
+larger of the quadratic term at 2h relative to the linear one and the slope
+disagreement; a parameter over the tolerance is flagged, and its full curve
+is worth sweeping.
+
+The points are ordinary sweep points, so they run on any executor of the
+spec: "zoom" (one AUT per perturbation covers every distance), "macro"
+(chunk_size >= number of points for a single macro), or "pool" / "resilient"
+for parallel sessions. The spec has one distance axis and a "jacobian"
+block:
+
+    "jacobian": {"parameters": ["S3", "S9", "lohmann", "lohmann_rot"],
+                 "step": 2e-4, "steps": {"lohmann_rot": 0.5},
+                 "richardson": true, "linearity_tolerance": 0.05}
+
+Usage:
+    python jacobian.py sweeps/jacobian.json --out jacobian.npz
+"""
+
+import argparse
+
+import numpy as np
+
+import sweep_engine as se
+
+DEFAULT_STEP = 2e-4
+DEFAULT_LINEARITY_TOLERANCE = 0.05
+
+
+def jacobian_options(spec):
+    options = dict(spec.get("jacobian", {}))
+    axis = spec["axes"][0]
+    names = options.get("parameters") or [name for name, definition in spec["parameters"].items()
+                                          if not definition.get("absolute")]
+    steps = {name: options.get("steps", {}).get(name, options.get("step", DEFAULT_STEP)) for name in names}
+    multiples = [1, 2] if options.get("richardson", True) else [1]
+    return axis, names, steps, multiples, options.get("linearity_tolerance", DEFAULT_LINEARITY_TOLERANCE)
+
+
+def validate_jacobian_spec(spec):
+    se.validate_spec(spec)
+    if len(spec["axes"]) != 1 or "parameter" not in spec["axes"][0]:
+        raise ValueError("Jacobian spec needs exactly one (distance) axis")
+    for name in spec.get("jacobian", {}).get("parameters", []):
+        if name not in spec["parameters"]:
+            raise ValueError(f"Jacobian of unknown parameter '{name}'")
+
+
+def jacobian_points(spec):
+    """
+    The nominal point and the +-h (and +-2h) points of every parameter, each
+    at every distance, distance innermost so the zoom executor groups them.
+    """
+    axis, names, steps, multiples, _ = jacobian_options(spec)
+    perturbations = [("nominal", 0, None)]
+    for name in names:
+        for multiple in multiples:
+            perturbations.extend([(name, -multiple, -multiple*steps[name]), (name, multiple, multiple*steps[name])])
+
+    points = []
+    for name, step, value in perturbations:
+        for distance in se.axis_values(axis):
+            assignments = {axis["parameter"]: distance}
+            if value is not None:
+                assignments[name] = value
+            points.append({"index": len(points), "coords": {"parameter": name, "step": step, axis["name"]: distance},
+                           "assignments": assignments})
+    return points
+
+
+def jacobian_from_records(spec, records, response="power"):
+    """
+    Assembles the (distance, parameter) matrices from the records of the
+    jacobian points. Missing readouts give NaN entries.
+    """
+    axis, names, steps, multiples, linearity_tolerance = jacobian_options(spec)
+    distances = se.axis_values(axis)
+    row = {distance: i for i, distance in enumerate(distances)}
+    values = {}
+    for record in records:
+        value = record.get(response)
+        values[(record["parameter"], record["step"], row[record[axis["name"]]])] = np.nan if value is None else value
+
+    def column(name, step):
+        return np.array([values.get((name, step, i), np.nan) for i in range(len(distances))])
+
+    nominal = column("nominal", 0)
+    shape = (len(distances), len(names))
+    slope, curvature = np.full(shape, np.nan), np.full(shape, np.nan)
+    richardson, nonlinearity = np.full(shape, np.nan), np.full(shape, np.nan)
+    for j, name in enumerate(names):
+        h = steps[name]
+        plus, minus = column(name, 1), column(name, -1)
+        slope[:, j] = (plus - minus)/(2*h)
+        curvature[:, j] = (plus - 2*nominal + minus)/h**2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # quadratic term at the widest step against the linear term
+            span = max(multiples)*h
+            nonlinearity[:, j] = np.abs(curvature[:, j]*span)/np.abs(2*slope[:, j])
+            if 2 in multiples:
+                # higher orders show up as a slope that depends on the step
+                slope_2h = (column(name, 2) - column(name, -2))/(4*h)
+                richardson[:, j] = (4*slope[:, j] - slope_2h)/3
+                nonlinearity[:, j] = np.fmax(nonlinearity[:, j], np.abs(slope_2h - slope[:, j])/np.abs(slope[:, j]))
+
+    # a parameter with no effect at all is linear too
+    nonlinearity[(slope == 0) & (curvature == 0)] = 0
+
+    return {
+        "distances": np.array(distances),
+        "parameters": np.array(names),
+        "steps": np.array([steps[name] for name in names]),
+        "nominal": nominal,
+        "jacobian": slope,
+        "richardson": richardson,
+        "curvature": curvature,
+        "nonlinearity": nonlinearity,
+        "linear": nonlinearity <= linearity_tolerance,
+    }
+
+
+def run_jacobian(spec, debug=False):
+    validate_jacobian_spec(spec)
+    points = jacobian_points(spec)
+    print(f"Jacobian: {len(points)} points")
+    records = list(se.run_sweep(spec, debug=debug, points=points))
+    return jacobian_from_records(spec, records)
+
+
+def print_jacobian(result):
+    names = list(result["parameters"])
+    print("dP/dx (D per spec unit), * = nonlinear over +-2h")
+    print(f"{'dist':>6s} " + " ".join(f"{name:>11s}" for name in names))
+    for i, distance in enumerate(result["distances"]):
+        cells = [f"{result['jacobian'][i, j]:+10.3f}{' ' if result['linear'][i, j] else '*'}"
+                 for j in range(len(names))]
+        print(f"{distance:6.2f} " + " ".join(cells))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Central-difference Jacobian of the power")
+    parser.add_argument("spec", help="sweep spec with a distance axis and a 'jacobian' block")
+    parser.add_argument("--out", default=None, help="NPZ file for the matrices")
+    parser.add_argument("--session", choices=se.SESSION_TYPES, help="overrides the spec's session type")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    spec = se.load_spec(args.spec)
+    if args.session:
+        spec["session"] = args.session
+    result = run_jacobian(spec, debug=args.debug)
+    print_jacobian(result)
+    if args.out:
+        np.savez(args.out, **result)
+        print(f"Jacobian saved to {args.out}")
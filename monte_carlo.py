@@ -0,0 +1,340 @@
+"""
+Monte Carlo tolerance run: all gaps perturbed together.
+
+The sensitivity sweeps move one or two gaps at a time; in production S3, S9,
+S12, S19, S22, S26, S29 and the Lohmann decenter are all off at once. Here
+every trial draws one joint perturbation of all the toleranced parameters,
+the sweep executor computes the power at every distance of the spec, and the
+power error statistics are accumulated in streaming form: count, mean and
+variance (Welford), min / max and P^2 quantile estimates per distance. The
+perturbations are drawn vectorised in batches and the points are generated
+lazily, so memory stays constant however many trials are run.
+
+The spec is a normal sweep spec (parameters, a distance axis, readouts, a
+serial or zoom executor) plus:
+
+    "tolerances": {
+        "S3": {"distribution": "normal", "sigma": 0.5e-3, "truncate": 3},
+        "lohmann": {"distribution": "uniform", "half_width": 1e-3}
+    },
+    "monte_carlo": {"trials": 2000, "batch": 256, "seed": 1,
+                    "quantiles": [0.01, 0.05, 0.5, 0.95, 0.99]}
+
+Distributions (spec units, added to the baseline like the sweep offsets):
+normal (mean, sigma, optional truncate in sigmas), uniform (low / high or
+half_width), triangular (half_width) and fixed (value).
+
+Usage:
+    python monte_carlo.py sweeps/tolerance_mc.json --trials 5000 --summary mc_summary.json
+"""
+
+import argparse
+import itertools
+import json
+import math
+
+import numpy as np
+
+import sweep_engine as se
+
+DEFAULT_QUANTILES = [0.01, 0.05, 0.5, 0.95, 0.99]
+DISTRIBUTIONS = ["normal", "uniform", "triangular", "fixed"]
+
+
+# ==============================================================================
+# Sampling
+# ==============================================================================
+
+def draw(definition, n, rng):
+    """
+    n samples of one tolerance definition.
+    """
+    kind = definition.get("distribution", "normal")
+    if kind == "normal":
+        mean = definition.get("mean", 0.0)
+        sigma = definition["sigma"]
+        samples = rng.normal(mean, sigma, n)
+        truncate = definition.get("truncate")
+        if truncate:
+            # redraw the tails until every sample is inside +-truncate sigma
+            outside = np.abs(samples - mean) > truncate*sigma
+            while outside.any():
+                samples[outside] = rng.normal(mean, sigma, outside.sum())
+                outside = np.abs(samples - mean) > truncate*sigma
+        return samples
+    if kind == "uniform":
+        if "half_width" in definition:
+            low, high = -definition["half_width"], definition["half_width"]
+        else:
+            low, high = definition["low"], definition["high"]
+        return rng.uniform(low, high, n)
+    if kind == "triangular":
+        half_width = definition["half_width"]
+        return rng.triangular(-half_width, 0.0, half_width, n)
+    if kind == "fixed":
+        return np.full(n, float(definition["value"]))
+    raise ValueError(f"Unknown distribution '{kind}'")
+
+
+def draw_batch(tolerances, n, rng):
+    # (n, k) joint perturbations, columns in the order of `tolerances`
+    return np.column_stack([draw(definition, n, rng) for definition in tolerances.values()])
+
+
+def trial_points(spec, trials, batch=256, seed=None):
+    """
+    Lazily generates the sweep points of the Monte Carlo run: for every trial
+    one point per value of the distance axis, with the trial's perturbations
+    in the assignments and the coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    tolerances = spec["tolerances"]
+    names = list(tolerances)
+    axis = spec["axes"][0]
+    distances = se.axis_values(axis)
+
+    index = 0
+    for start in range(0, trials, batch):
+        samples = draw_batch(tolerances, min(batch, trials - start), rng)
+        for offset, row in enumerate(samples):
+            perturbation = {name: float(value) for name, value in zip(names, row)}
+            for distance in distances:
+                coords = {"trial": start + offset, axis["name"]: distance}
+                coords.update(perturbation)
+                assignments = dict(perturbation)
+                assignments[axis["parameter"]] = distance
+                yield {"index": index, "coords": coords, "assignments": assignments}
+                index += 1
+
+
+def validate_monte_carlo_spec(spec):
+    se.validate_spec(spec)
+    if "tolerances" not in spec:
+        raise ValueError("Monte Carlo spec is missing 'tolerances'")
+    for name, definition in spec["tolerances"].items():
+        if name not in spec["parameters"]:
+            raise ValueError(f"Tolerance on unknown parameter '{name}'")
+        if definition.get("distribution", "normal") not in DISTRIBUTIONS:
+            raise ValueError(f"Tolerance '{name}' has unknown distribution '{definition.get('distribution')}'")
+    if len(spec["axes"]) != 1 or "parameter" not in spec["axes"][0]:
+        raise ValueError("Monte Carlo spec needs exactly one (distance) axis")
+    executor = spec.get("executor", {}).get("type", "serial")
+    if executor not in se.STREAMING_EXECUTORS:
+        raise ValueError(f"Monte Carlo runs need a streaming executor ({', '.join(se.STREAMING_EXECUTORS)}), "
+                         f"got '{executor}'")
+
+
+# ==============================================================================
+# Streaming statistics
+# ==============================================================================
+
+class P2Quantile:
+    """
+    P^2 estimate of one quantile (Jain & Chlamtac, 1985): five markers whose
+    heights are adjusted with a parabolic interpolation as observations
+    arrive, in constant memory.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2*p, 4*p, 2 + 2*p, 4]
+        self.increments = [0, p/2, p, (1 + p)/2, 1]
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d*(q[i + d] - q[i])/(n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d/(n[i + 1] - n[i - 1])*((n[i] - n[i - 1] + d)*(q[i + 1] - q[i])/(n[i + 1] - n[i])
+                                               + (n[i + 1] - n[i] - d)*(q[i] - q[i - 1])/(n[i] - n[i - 1]))
+
+    def value(self):
+        if not self.heights:
+            return None
+        if len(self.heights) < 5:
+            return float(np.quantile(self.heights, self.p))
+        return float(self.heights[2])
+
+
+class StreamingStats:
+    """
+    Count, mean, variance, min / max and quantiles of a stream of values.
+    None values (failed readouts) are counted separately.
+    """
+
+    def __init__(self, quantiles=DEFAULT_QUANTILES):
+        self.count = 0
+        self.missing = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.quantiles = [P2Quantile(p) for p in quantiles]
+
+    def add(self, x):
+        if x is None or not math.isfinite(x):
+            self.missing += 1
+            return
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        for quantile in self.quantiles:
+            quantile.add(x)
+
+    @property
+    def variance(self):
+        return self.m2/(self.count - 1) if self.count > 1 else None
+
+    @property
+    def std(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "missing": self.missing,
+            "mean": self.mean if self.count else None,
+            "std": self.std,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "quantiles": {str(q.p): q.value() for q in self.quantiles},
+        }
+
+
+class ToleranceSink:
+    """
+    Sweep sink accumulating the statistics of a readout per distance. The
+    records of the nominal lens (trial -1) set the reference, so the
+    statistics are of the error against it.
+    """
+
+    def __init__(self, response="power", group_key="dist", quantiles=DEFAULT_QUANTILES):
+        self.response = response
+        self.group_key = group_key
+        self.quantiles = quantiles
+        self.nominal = {}
+        self.stats = {}
+
+    def write(self, record):
+        group = record.get(self.group_key)
+        value = record.get(self.response)
+        if record.get("trial") == -1:
+            self.nominal[group] = value
+            return
+        if group not in self.stats:
+            self.stats[group] = StreamingStats(self.quantiles)
+        if value is not None and self.nominal.get(group) is not None:
+            value -= self.nominal[group]
+        self.stats[group].add(value)
+
+    def close(self):
+        pass
+
+    def summary(self):
+        return {str(group): stats.summary() for group, stats in self.stats.items()}
+
+
+def nominal_points(spec):
+    # one unperturbed point per distance, run before the trials
+    axis = spec["axes"][0]
+    for distance in se.axis_values(axis):
+        yield {"index": -1, "coords": {"trial": -1, axis["name"]: distance},
+               "assignments": {axis["parameter"]: distance}}
+
+
+def run_monte_carlo(spec, trials=None, sink=None, debug=False):
+    """
+    Runs the nominal lens and then the Monte Carlo trials of the spec through
+    the sweep executor, in one session. Returns the ToleranceSink with the
+    per-distance power error statistics. `sink` adds sinks for the records
+    (e.g. a JsonlSink).
+    """
+    validate_monte_carlo_spec(spec)
+    options = spec.get("monte_carlo", {})
+    trials = trials or options.get("trials", 1000)
+    stats = ToleranceSink(options.get("response", "power"), spec["axes"][0]["name"],
+                          options.get("quantiles", DEFAULT_QUANTILES))
+
+    sinks = [stats] + (list(sink) if isinstance(sink, (list, tuple)) else [sink] if sink is not None else [])
+    points = itertools.chain(nominal_points(spec),
+                             trial_points(spec, trials, options.get("batch", 256), options.get("seed")))
+    every, last = max(trials//10, 1), -1
+    for record in se.run_sweep(spec, sink=sinks, debug=debug, points=points):
+        if record["trial"] != last and record["trial"] % every == 0:
+            print(f"  trial {record['trial']}/{trials}")
+        last = record["trial"]
+    return stats
+
+
+def print_summary(stats):
+    print(f"{'dist':>8s} {'n':>6s} {'mean':>11s} {'std':>11s} {'min':>11s} {'max':>11s}  quantiles")
+    for group, summary in stats.summary().items():
+        if not summary["count"]:
+            print(f"{group:>8s} {0:6d}  (no values, {summary['missing']} missing)")
+            continue
+        quantiles = ", ".join(f"{p}: {value:+.4f}" for p, value in summary["quantiles"].items())
+        print(f"{group:>8s} {summary['count']:6d} {summary['mean']:+11.5f} {summary['std'] or 0:11.5f} "
+              f"{summary['min']:+11.5f} {summary['max']:+11.5f}  {quantiles}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Monte Carlo tolerance run with streaming statistics")
+    parser.add_argument("spec", help="sweep spec with 'tolerances'")
+    parser.add_argument("--trials", type=int, default=None)
+    parser.add_argument("--out", help="JSONL file for the trial records")
+    parser.add_argument("--summary", help="JSON file for the per-distance statistics")
+    parser.add_argument("--session", choices=se.SESSION_TYPES, help="overrides the spec's session type")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    spec = se.load_spec(args.spec)
+    if args.session:
+        spec["session"] = args.session
+    sinks = [se.JsonlSink(args.out)] if args.out else []
+    try:
+        stats = run_monte_carlo(spec, trials=args.trials, sink=sinks, debug=args.debug)
+    finally:
+        for sink in sinks:
+            sink.close()
+
+    print_summary(stats)
+    if args.summary:
+        with open(args.summary, "w") as f:
+            json.dump({"nominal": {str(k): v for k, v in stats.nominal.items()},
+                       "error": stats.summary()}, f, indent=2)
+        print(f"Summary saved to {args.summary}")
@@ -23,4 +23,16 @@ class Params:
 
     def set_slmSize(self, width, height):
         self.slmWidth = width
-        self.slmHeight = height
\ No newline at end of file
+        self.slmHeight = height
+
+    def tilt2power(self, tilt):
+        # convert the S13 tilt coefficient into SLM optical power (D)
+        delta = -tilt*self.f0
+        optical_power = delta*12*(self.eta - self.eta_air)/self.C0
+        return optical_power
+
+    def calculate_tilt(self, optical_power):
+        # inverse of tilt2power
+        delta = self.C0/(12*(self.eta - self.eta_air))*optical_power
+        tilt_value = -delta/self.f0
+        return tilt_value
@@ -0,0 +1,211 @@
+"""
+Background plotting worker.
+
+The sweep scripts used to build their matplotlib figures inside the main loop,
+which blocks the CODE V session between distances, and plt.show() stalls
+unattended runs. PlotWorker moves all of that into a separate process that
+renders with the Agg backend. The driver only sends result arrays through a
+queue and never imports matplotlib itself.
+
+    plotter = PlotWorker()
+    plotter.start()
+    plotter.figure("S3", autosave="sensitivity_S3.png")
+    plotter.plot("S3", epsilon*1e3, powers, marker='o', label="d = 400 mm")
+    plotter.set_labels("S3", title="Lens S3", xlabel="Epsilon (mm)", legend=True)
+    plotter.save("S3", "sensitivity_S3.pdf", dpi=300, bbox_inches='tight')
+    plotter.stop()
+
+A figure with `autosave` is re-rendered to that file after every update, so a
+long sweep can be followed by opening the image.
+"""
+
+import multiprocessing
+import os
+
+
+def _plot_loop(queue, default_dpi):
+    # everything matplotlib related stays in this process
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figures = {}
+
+    def get_figure(name, figsize=None, autosave=None):
+        if name not in figures:
+            fig, ax = plt.subplots(figsize=figsize)
+            figures[name] = {"fig": fig, "ax": ax, "autosave": autosave}
+        return figures[name]
+
+    while True:
+        message = queue.get()
+        if message is None:
+            break
+        action, name, args, kwargs = message
+
+        try:
+            if action == "close":
+                names = list(figures) if name is None else [name]
+                for n in names:
+                    if n in figures:
+                        plt.close(figures.pop(n)["fig"])
+                continue
+
+            if action == "figure":
+                get_figure(name, **kwargs)
+                continue
+
+            entry = get_figure(name)
+            fig, ax = entry["fig"], entry["ax"]
+
+            if action == "plot":
+                ax.plot(*args, **kwargs)
+            elif action == "scatter":
+                ax.scatter(*args, **kwargs)
+            elif action == "contourf":
+                colorbar_label = kwargs.pop("colorbar_label", None)
+                cp = ax.contourf(*args, **kwargs)
+                fig.colorbar(cp, ax=ax, label=colorbar_label)
+            elif action == "labels":
+                if kwargs.get("title") is not None:
+                    ax.set_title(kwargs["title"])
+                if kwargs.get("xlabel") is not None:
+                    ax.set_xlabel(kwargs["xlabel"])
+                if kwargs.get("ylabel") is not None:
+                    ax.set_ylabel(kwargs["ylabel"])
+                if kwargs.get("grid"):
+                    ax.grid(True)
+                if kwargs.get("legend"):
+                    ax.legend()
+            elif action == "save":
+                kwargs.setdefault("dpi", default_dpi)
+                fig.savefig(args[0], **kwargs)
+                continue
+
+            # incremental update of the live image
+            if entry["autosave"]:
+                fig.savefig(entry["autosave"])
+        except Exception as e:
+            print(f"Plot worker could not {action} '{name}': {e}")
+
+    for entry in figures.values():
+        plt.close(entry["fig"])
+
+
+class PlotWorker:
+    """
+    Sends plotting commands to a background process rendering with Agg.
+    """
+
+    def __init__(self, dpi=300):
+        self.dpi = dpi
+        self.queue = None
+        self.process = None
+
+    def start(self):
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_plot_loop, args=(self.queue, self.dpi), daemon=True)
+        self.process.start()
+        return self
+
+    def stop(self, timeout=60):
+        # wait for the queued figures to be written before leaving
+        if self.process is None:
+            return
+        self.queue.put(None)
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _send(self, action, name, *args, **kwargs):
+        self.queue.put((action, name, args, kwargs))
+
+    def figure(self, name, figsize=None, autosave=None):
+        self._send("figure", name, figsize=figsize, autosave=autosave)
+
+    def plot(self, name, *args, **kwargs):
+        self._send("plot", name, *args, **kwargs)
+
+    def scatter(self, name, *args, **kwargs):
+        self._send("scatter", name, *args, **kwargs)
+
+    def contourf(self, name, *args, colorbar_label=None, **kwargs):
+        self._send("contourf", name, *args, colorbar_label=colorbar_label, **kwargs)
+
+    def set_labels(self, name, title=None, xlabel=None, ylabel=None, grid=False, legend=False):
+        self._send("labels", name, title=title, xlabel=xlabel, ylabel=ylabel, grid=grid, legend=legend)
+
+    def save(self, name, filename, **kwargs):
+        self._send("save", name, filename, **kwargs)
+
+    def close(self, name=None):
+        self._send("close", name)
+
+
+class PlotSink:
+    """
+    Sink for sweep_engine.run_sweep that draws one curve per `series_key`
+    value on one figure per `figure_key` value. Each curve is sent as soon as
+    its series is complete, and the live image is autosaved in `directory`.
+    `filename` names the files of a figure ("{figure}" is replaced by the
+    figure key), `titles` maps figure keys to titles and `series_label`
+    turns a series value into its legend label.
+    """
+
+    def __init__(self, plotter, directory, x_key="epsilon", y_key="power", figure_key="surface",
+                 series_key="dist", x_scale=1e3, xlabel="Epsilon (mm)", ylabel="Optical Power (Diopters)",
+                 filename="sweep_{figure}", titles=None, series_label=None):
+        self.plotter = plotter
+        self.directory = directory
+        self.x_key = x_key
+        self.y_key = y_key
+        self.figure_key = figure_key
+        self.series_key = series_key
+        self.x_scale = x_scale
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.filename = filename
+        self.titles = titles or {}
+        self.series_label = series_label or (lambda series: f"{self.series_key} = {series}")
+        self.figures = []
+        self.current = None
+        self.x = []
+        self.y = []
+
+    def _path(self, name, extension):
+        return os.path.join(self.directory, self.filename.format(figure=name) + extension)
+
+    def _flush_series(self):
+        if self.current is None or not self.x:
+            return
+        name, series = self.current
+        self.plotter.plot(name, self.x, self.y, marker='o', label=self.series_label(series))
+        self.x, self.y = [], []
+
+    def write(self, record):
+        name = str(record.get(self.figure_key, "sweep"))
+        key = (name, record.get(self.series_key))
+        if key != self.current:
+            self._flush_series()
+            self.current = key
+        if name not in self.figures:
+            self.figures.append(name)
+            self.plotter.figure(name, autosave=self._path(name, ".png"))
+            self.plotter.set_labels(name, title=self.titles.get(name, name), xlabel=self.xlabel,
+                                    ylabel=self.ylabel, grid=True)
+        self.x.append(record[self.x_key]*self.x_scale)
+        self.y.append(record[self.y_key])
+
+    def close(self):
+        self._flush_series()
+        for name in self.figures:
+            self.plotter.set_labels(name, legend=True)
+            self.plotter.save(name, self._path(name, ".pdf"), bbox_inches='tight')
+            self.plotter.close(name)
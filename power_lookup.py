@@ -0,0 +1,336 @@
+"""
+Power-vs-distance lookup for driving the SLM.
+
+Compiles the stored sweep results (results_store) into a table of optical
+power over object distance and, optionally, one gap perturbation (epsilon),
+and answers vectorised queries with monotone piecewise cubic Hermite
+interpolation (Fritsch-Carlson / PCHIP, NumPy only). The distance axis is
+interpolated in 1/d, where the power is close to linear (cf. the thin lens
+curve 9/(16*(d - 0.075))).
+
+Every answer comes with an error bound estimated from leave-one-out
+interpolation of the table nodes: the error made when a node is dropped and
+interpolated from its neighbours bounds the error between neighbouring
+nodes. Queries outside the calibrated range return NaN.
+
+    table = PowerTable.from_store(ResultsStore("results_store"), surface="S3")
+    table.save("power_table.npz")
+
+    service = PowerLookupService("power_table.npz")   # reloads when the file changes
+    power, bound = service.lookup([0.45, 1.2])         # nominal lens
+    power, bound = service.lookup(0.45, epsilon=1e-3)  # with a 1 mm S3 error
+
+Usage:
+    python power_lookup.py build results_store --surface S3 --out power_table.npz
+    python power_lookup.py query power_table.npz 0.45 1.2
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+
+
+# ==============================================================================
+# Monotone cubic Hermite interpolation
+# ==============================================================================
+
+def _edge_slope(h0, h1, m0, m1):
+    # shape-preserving three-point end slope
+    d = ((2*h0 + h1)*m0 - h0*m1)/(h0 + h1)
+    d = np.where(np.sign(d) != np.sign(m0), 0.0, d)
+    return np.where((np.sign(m0) != np.sign(m1)) & (np.abs(d) > np.abs(3*m0)), 3*m0, d)
+
+
+def pchip_slopes(x, y):
+    """
+    Fritsch-Carlson node slopes for the strictly increasing nodes x (n,) and
+    values y (..., n). The interpolant is monotone wherever the data is.
+    """
+    y = np.asarray(y, dtype=float)
+    h = np.diff(x)
+    delta = np.diff(y, axis=-1)/h
+    if len(x) == 2:
+        return np.repeat(delta, 2, axis=-1)
+
+    slopes = np.zeros_like(y)
+    w1 = 2*h[1:] + h[:-1]
+    w2 = h[1:] + 2*h[:-1]
+    same_sign = delta[..., :-1]*delta[..., 1:] > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        harmonic = (w1 + w2)/(w1/delta[..., :-1] + w2/delta[..., 1:])
+    slopes[..., 1:-1] = np.where(same_sign, harmonic, 0.0)
+    slopes[..., 0] = _edge_slope(h[0], h[1], delta[..., 0], delta[..., 1])
+    slopes[..., -1] = _edge_slope(h[-1], h[-2], delta[..., -1], delta[..., -2])
+    return slopes
+
+
+def interval_index(x, xq):
+    # index of the node interval of every query, end intervals extended outwards
+    # (np.minimum / np.maximum: np.clip costs more than the lookup itself)
+    return np.minimum(np.maximum(np.searchsorted(x, xq, side="right") - 1, 0), len(x) - 2)
+
+
+def _hermite_weights(x, xq):
+    # interval index and the four cubic Hermite basis weights
+    i = interval_index(x, xq)
+    h = x[i + 1] - x[i]
+    t = (xq - x[i])/h
+    t2 = t*t
+    t3 = t2*t
+    return i, h, (2*t3 - 3*t2 + 1, t3 - 2*t2 + t, -2*t3 + 3*t2, t3 - t2)
+
+
+def pchip_rows(x, y, xq, slopes=None, rows=None):
+    """
+    Interpolates row k of y (m, n) at xq[k] (m,). Returns (m,). With `rows`
+    (m,) query k uses row rows[k] of y and of the precomputed slopes instead.
+    """
+    if slopes is None:
+        slopes = pchip_slopes(x, y)
+    i, h, (h00, h10, h01, h11) = _hermite_weights(x, xq)
+    if rows is None:
+        rows = np.arange(len(xq))
+    return h00*y[rows, i] + h10*h*slopes[rows, i] + h01*y[rows, i + 1] + h11*h*slopes[rows, i + 1]
+
+
+def pchip_columns(x, y, xq, slopes):
+    """
+    Interpolates every column of y (n, m) at each of xq (q,). Returns (q, m).
+    """
+    i, h, (h00, h10, h01, h11) = _hermite_weights(x, xq)
+    return (h00[:, None]*y[i] + (h10*h)[:, None]*slopes[i]
+            + h01[:, None]*y[i + 1] + (h11*h)[:, None]*slopes[i + 1])
+
+
+def leave_one_out_errors(x, y):
+    """
+    |y_j - interpolation of y_j from the other nodes| for every interior node
+    j, along the last axis; the end nodes copy their neighbour. y (..., n).
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    errors = np.zeros_like(y)
+    if n < 3:
+        return errors
+    for j in range(1, n - 1):
+        keep = np.arange(n) != j
+        rows = y[..., keep].reshape(-1, n - 1)
+        estimate = pchip_rows(x[keep], rows, np.full(len(rows), x[j]))
+        errors[..., j] = np.abs(y[..., j] - estimate.reshape(y.shape[:-1]))
+    errors[..., 0] = errors[..., 1]
+    errors[..., -1] = errors[..., -2]
+    return errors
+
+
+# ==============================================================================
+# Compiled table
+# ==============================================================================
+
+class PowerTable:
+    """
+    Power on an (epsilon, distance) grid with the PCHIP slopes and the node
+    error bounds precomputed. Distances in m, epsilon in the unit of the
+    stored sweep (m for the gap sweeps), power in D.
+    """
+
+    def __init__(self, distance, power, epsilon=None, source=None):
+        distance = np.asarray(distance, dtype=float)
+        power = np.atleast_2d(np.asarray(power, dtype=float))
+        epsilon = np.zeros(1) if epsilon is None else np.atleast_1d(np.asarray(epsilon, dtype=float))
+        if power.shape != (len(epsilon), len(distance)):
+            raise ValueError(f"power must have shape (epsilon, distance), got {power.shape}")
+        if len(distance) < 2:
+            raise ValueError("A power table needs at least two distances")
+
+        # interpolate in inverse distance, increasing
+        order = np.argsort(1/distance)
+        self.distance = distance[order]
+        self.u = 1/self.distance
+        self.epsilon = np.sort(epsilon)
+        self.power = power[np.argsort(epsilon)][:, order]
+        self.source = source or {}
+
+        # distance-axis slopes of every epsilon row, for the nominal lookups
+        self.distance_slopes = pchip_slopes(self.u, self.power)
+
+        # node error bounds along both axes
+        self.node_error = leave_one_out_errors(self.u, self.power)
+        if len(self.epsilon) > 1:
+            self.epsilon_slopes = pchip_slopes(self.epsilon, self.power.T).T
+            self.node_error = self.node_error + leave_one_out_errors(self.epsilon, self.power.T).T
+        else:
+            self.epsilon_slopes = None
+
+    @classmethod
+    def from_store(cls, store, surface=None, run_id=None, lens_file=None):
+        """
+        Builds the table from a ResultsStore. With `surface` the epsilon axis
+        is the perturbation of that surface; without it only the nominal
+        (epsilon == 0) points are used. Repeated points are averaged.
+        """
+        data = store.query(run_id=run_id, lens_file=lens_file, surface=surface)
+        keep = np.isfinite(data["power"])
+        if surface is None:
+            keep &= np.isclose(data["epsilon"], 0) | np.isnan(data["epsilon"])
+        distance = np.round(data["distance"][keep], 9)
+        epsilon = np.nan_to_num(np.round(data["epsilon"][keep], 12)) if surface else np.zeros(keep.sum())
+        power = data["power"][keep]
+
+        distances = np.unique(distance)
+        epsilons = np.unique(epsilon)
+        grid_sum = np.zeros((len(epsilons), len(distances)))
+        grid_count = np.zeros_like(grid_sum)
+        rows = np.searchsorted(epsilons, epsilon)
+        columns = np.searchsorted(distances, distance)
+        np.add.at(grid_sum, (rows, columns), power)
+        np.add.at(grid_count, (rows, columns), 1)
+        if np.any(grid_count == 0):
+            raise ValueError("The stored points do not fill a complete (epsilon, distance) grid")
+
+        source = {"surface": surface or "", "run_id": run_id or "", "lens_file": lens_file or "",
+                  "built": time.time(), "n_points": int(keep.sum())}
+        return cls(distances, grid_sum/grid_count, epsilons, source)
+
+    def save(self, path):
+        # written to a temporary file first so a running service never reads half a table
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, distance=self.distance, epsilon=self.epsilon, power=self.power,
+                 **{f"source_{key}": value for key, value in self.source.items()})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            source = {key[len("source_"):]: data[key].item() for key in data.files if key.startswith("source_")}
+            return cls(data["distance"], data["power"], data["epsilon"], source)
+
+    def lookup(self, distance, epsilon=0.0):
+        """
+        Power (D) and error bound for object distances (m) and perturbations,
+        both broadcast together. NaN / inf outside the calibrated range.
+        """
+        distance, epsilon = np.broadcast_arrays(np.asarray(distance, dtype=float),
+                                                np.asarray(epsilon, dtype=float))
+        shape = distance.shape
+        u = 1/distance.ravel()
+        epsilon = epsilon.ravel()
+
+        j = interval_index(self.u, u)
+        if self.epsilon_slopes is None:
+            # every query reads the single table row and its precomputed slopes
+            row = np.zeros(len(u), dtype=np.intp)
+            power = pchip_rows(self.u, self.power, u, self.distance_slopes, rows=row)
+            bound = np.maximum(self.node_error[0, j], self.node_error[0, j + 1])
+            # np.isclose with its default tolerances, which costs more than the interpolation
+            outside = np.abs(epsilon - self.epsilon[0]) > 1e-8 + 1e-5*abs(self.epsilon[0])
+        else:
+            # one interpolated row per query, whose distance slopes depend on epsilon
+            rows = pchip_columns(self.epsilon, self.power, epsilon, self.epsilon_slopes)
+            i = interval_index(self.epsilon, epsilon)
+            errors = np.maximum(self.node_error[i], self.node_error[i + 1])
+            power = pchip_rows(self.u, rows, u)
+            index = np.arange(len(u))
+            bound = np.maximum(errors[index, j], errors[index, j + 1])
+            outside = (epsilon < self.epsilon[0]) | (epsilon > self.epsilon[-1])
+
+        outside |= (u < self.u[0]) | (u > self.u[-1])
+        power[outside] = np.nan
+        bound[outside] = np.inf
+        return power.reshape(shape), bound.reshape(shape)
+
+
+# ==============================================================================
+# Service
+# ==============================================================================
+
+class PowerLookupService:
+    """
+    Serves lookups from a saved PowerTable and swaps in a new table when the
+    file changes. The new table is compiled next to the old one and replaced
+    with a single reference assignment, so queries never wait for a reload.
+    """
+
+    def __init__(self, path, poll=2.0):
+        self.path = path
+        self.poll = poll
+        self.table = PowerTable.load(path)
+        self.mtime = os.path.getmtime(path)
+        self.reloads = 0
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def lookup(self, distance, epsilon=0.0):
+        return self.table.lookup(distance, epsilon)
+
+    def reload_if_changed(self):
+        mtime = os.path.getmtime(self.path)
+        if mtime == self.mtime:
+            return False
+        try:
+            table = PowerTable.load(self.path)
+        except Exception as e:
+            # keep serving the previous calibration
+            print(f"Could not reload {self.path}: {e}")
+            return False
+        self.table = table
+        self.mtime = mtime
+        self.reloads += 1
+        return True
+
+    def start(self):
+        # background thread polling the table file
+        def watch():
+            while not self._stop.wait(self.poll):
+                if os.path.exists(self.path):
+                    self.reload_if_changed()
+
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Power-vs-distance lookup table")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="compile a table from a results store")
+    build_parser.add_argument("store")
+    build_parser.add_argument("--surface", default=None, help="perturbed surface for the epsilon axis")
+    build_parser.add_argument("--run", default=None)
+    build_parser.add_argument("--out", default="power_table.npz")
+
+    query_parser = subparsers.add_parser("query", help="look up powers for distances (m)")
+    query_parser.add_argument("table")
+    query_parser.add_argument("distances", type=float, nargs="+")
+    query_parser.add_argument("--epsilon", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from results_store import ResultsStore
+
+        table = PowerTable.from_store(ResultsStore(args.store), surface=args.surface, run_id=args.run)
+        table.save(args.out)
+        print(f"Table with {len(table.epsilon)} x {len(table.distance)} nodes written to {args.out}")
+        print(f"Largest node error bound: {table.node_error.max():.4f} D")
+    else:
+        table = PowerTable.load(args.table)
+        t0 = time.perf_counter()
+        power, bound = table.lookup(args.distances, args.epsilon)
+        elapsed = time.perf_counter() - t0
+        for d, p, b in zip(args.distances, power, bound):
+            print(f"  d = {d} m: {p:.4f} D +- {b:.4f}")
+        print(f"Lookup took {elapsed*1e6:.0f} us")
@@ -0,0 +1,304 @@
+"""
+Pre-flight check of a sweep before the expensive run.
+
+The .rec logs show runs dying hours in on mistakes that were in the plan from
+the start (a FOR loop sent as a plain command, an unassigned ^variable, a
+surface that does not exist). The pre-flight:
+
+    1. expands the whole command stream of the sweep by running the spec's
+       executor on a session that records the commands instead of sending
+       them (parameter commands, vignetting, AUT and readouts of every point,
+       the zoom system of the zoom executor, the macro files of the macro
+       executor),
+    2. validates it statically: command names, macro-only keywords outside a
+       macro, ^variables used before assignment, surface references (S0..S30
+       or the surface count of the loaded lens), XY polynomial coefficient
+       names and balanced quotes,
+    3. opens a session, checks the baselines and readouts against the loaded
+       lens and runs a sample through the spec's executor with CODE V errors
+       aborting (whole zoom groups for the zoom executor, whole chunks for the
+       macro executor) and projects the run time from them,
+
+and only then lets the full run start. validate_commands can also be used on
+the command lists of the calibration scripts.
+
+Usage:
+    python preflight.py sweeps/each_lens.json --sample 3
+"""
+
+import argparse
+import os
+import re
+
+import sweep_engine as se
+import xy_polynomial as xyp
+
+MAX_SURFACE = 30
+MAX_COEFF = xyp.n_terms(10) + 1  # C2..C66, C1 is the conic constant
+
+KNOWN_COMMANDS = {"AUT", "DAR", "DEL", "DLT", "DLX", "DLY", "GCV", "GO", "GRA", "IMS", "INS", "MPP", "PIK", "RES",
+                  "RUN", "SAV", "SCC", "SCO", "THC", "THI", "TOR", "VIE", "WRI", "ZDE", "ZOO"}
+# sub-commands of these are checked by CODE V itself
+MODE_COMMANDS = {"AUT", "IMS", "TOR", "VIE"}
+# only valid inside a .seq macro, sent as a plain command they give "Invalid command"
+MACRO_KEYWORDS = {"FOR", "END", "IF", "ELS", "ELSE", "GTO", "GOTO", "LBL", "WHI", "WHILE"}
+
+SURFACE_PATTERN = re.compile(r"\bS(\d+)(?:\.\.(\d+))?\b", re.IGNORECASE)
+COEFF_PATTERN = re.compile(r"\bC(\d+)\b", re.IGNORECASE)
+VARIABLE_PATTERN = re.compile(r"\^(\w+)")
+ASSIGNMENT_PATTERN = re.compile(r"^\s*(?:FOR\s+\^(\w+)|\^(\w+)\s*==)", re.IGNORECASE)
+QUOTED_PATTERN = re.compile(r'"[^"]*"|\'[^\']*\'')
+
+
+def split_segments(command):
+    # split on ";" outside quotes
+    segments, current, quote = [], "", None
+    for char in command:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == ";":
+            segments.append(current)
+            current = ""
+            continue
+        current += char
+    segments.append(current)
+    return [segment.strip() for segment in segments if segment.strip()]
+
+
+def validate_commands(commands, max_surface=MAX_SURFACE, macro=False):
+    """
+    Static checks of a list of command strings (each one a Command() call, or
+    one line of a .seq file when macro=True). Returns (errors, warnings) as
+    lists of "command: problem" strings.
+    """
+    errors, warnings = [], []
+    assigned = set()
+
+    for command in commands:
+        label = command.strip()[:120]
+        if command.count('"') % 2:
+            errors.append(f"{label}: unbalanced quotes")
+            continue
+
+        segments = split_segments(command)
+        for k, segment in enumerate(segments):
+            head = segment.split()[0].lstrip("?").upper()
+            if k > 0 and segments[0].split()[0].upper() in MODE_COMMANDS:
+                pass
+            elif head.startswith("^") or head.startswith("!"):
+                pass
+            elif head in MACRO_KEYWORDS:
+                if not macro:
+                    errors.append(f"{label}: {head} only works inside a .seq macro")
+            elif head not in KNOWN_COMMANDS:
+                warnings.append(f"{label}: unknown command '{head}'")
+
+            bare = QUOTED_PATTERN.sub("", segment)
+            assignment = ASSIGNMENT_PATTERN.match(bare)
+            # a FOR sent as a plain command fails, so it assigns nothing
+            if assignment and (macro or head not in MACRO_KEYWORDS):
+                assigned.add((assignment.group(1) or assignment.group(2)).lower())
+            for match in VARIABLE_PATTERN.finditer(bare):
+                if match.group(1).lower() not in assigned:
+                    errors.append(f"{label}: ^{match.group(1)} is used before it is assigned")
+
+            for match in SURFACE_PATTERN.finditer(bare):
+                for number in match.groups():
+                    if number is not None and int(number) > max_surface:
+                        errors.append(f"{label}: surface S{number} does not exist (last is S{max_surface})")
+            if head == "SCO":
+                for match in COEFF_PATTERN.finditer(bare):
+                    if not 1 <= int(match.group(1)) <= MAX_COEFF:
+                        errors.append(f"{label}: C{match.group(1)} is not an XY polynomial coefficient")
+
+    return errors, warnings
+
+
+class DryRunSession:
+    """
+    Stands in for the CODE V session and records what an executor sends
+    instead of running it: (command, macro) pairs, with the lines of the
+    macro executor's .seq files recorded as macro lines. Queries read 0 and
+    readouts give no value.
+    """
+
+    def __init__(self, spec):
+        self.macro_prefix = f"sweep_{spec['run_id']}_"
+        self.commands = []
+
+    def Command(self, command):
+        self.commands.append((command, False))
+        match = re.match(r'\s*run\s+"([^"]+)"', command, re.IGNORECASE)
+        if match and os.path.basename(match.group(1)).startswith(self.macro_prefix):
+            with open(match.group(1), "r") as f:
+                self.commands.extend((line.rstrip("\n"), True) for line in f if line.strip())
+        if command.lstrip().startswith("?"):
+            return f"{command.strip()} = 0\r"
+        return ""
+
+    def EvaluateExpression(self, expression):
+        return None
+
+    def StopCodeV(self):
+        pass
+
+
+def executor_type(spec):
+    # the pool and resilient workers run the serial path, one session each
+    executor = spec.get("executor", {}).get("type", "serial")
+    return "serial" if executor in ("pool", "resilient") else executor
+
+
+def expand_command_stream(spec, points=None):
+    """
+    Every command the spec's executor would send, as (command, macro) pairs,
+    macro being True for the lines of a .seq file. Baselines are 0 (only the
+    shape of the commands matters for the static checks).
+    """
+    session = DryRunSession(spec)
+    dry_spec = dict(spec, session=session)
+    for _ in se.EXECUTORS[executor_type(spec)](dry_spec, se.expand_points(spec) if points is None else points):
+        pass
+    return session.commands
+
+
+def parallel_workers(spec):
+    # sessions running points at the same time
+    options = spec.get("executor", {})
+    if options.get("type") == "pool":
+        return options.get("workers", 2)
+    if options.get("type") == "resilient":
+        return options.get("workers", 1)
+    return 1
+
+
+def run_units(spec, points):
+    """
+    The points grouped as the executor runs them: zoom groups for the zoom
+    executor, chunks for the macro executor, single points otherwise.
+    """
+    executor = executor_type(spec)
+    if executor == "zoom":
+        return se.zoom_groups(points, spec["executor"]["axis"])
+    if executor == "macro":
+        chunk_size = spec["executor"].get("chunk_size", 10)
+        return [points[start:start + chunk_size] for start in range(0, len(points), chunk_size)]
+    return [[point] for point in points]
+
+
+def sample_points(points, n):
+    # first, last and evenly spread points in between
+    if n >= len(points):
+        return list(points)
+    step = (len(points) - 1)/max(n - 1, 1)
+    return [points[round(i*step)] for i in range(n)]
+
+
+def preflight(spec, sample=3, debug=False):
+    """
+    Runs the static checks and, if they pass, the live checks and a sample of
+    `sample` run units (points, zoom groups or macro chunks). Returns a report
+    dict; report["ok"] tells whether the full run can start.
+    """
+    spec = dict(spec)
+    spec.setdefault("run_id", "preflight")
+    se.validate_spec(spec)
+    points = se.expand_points(spec)
+    stream = expand_command_stream(spec, points)
+    commands = [command for command, macro in stream if not macro]
+    macro_lines = [command for command, macro in stream if macro]
+
+    def static_errors(max_surface=MAX_SURFACE):
+        errors, warnings = validate_commands(commands, max_surface=max_surface)
+        macro_errors, macro_warnings = validate_commands(macro_lines, max_surface=max_surface, macro=True)
+        return errors + macro_errors, warnings + macro_warnings
+
+    errors, warnings = static_errors()
+    units = run_units(spec, points)
+    report = {"n_points": len(points), "n_units": len(units), "n_commands": len(stream), "errors": errors,
+              "warnings": warnings, "sample": [], "projected_seconds": None}
+    if errors or sample == 0:
+        report["ok"] = not errors
+        return report
+
+    # CODE V errors abort the sampled points whatever the spec says
+    spec["events"] = dict(spec.get("events") or {}, error="abort", license="abort")
+    cv_session = None
+    try:
+        cv_session = se.open_spec_session(spec, debug=debug)
+        helper = se.make_helper(spec, cv_session, debug)
+
+        n_surfaces = helper.evaluate("(NUM S)")
+        if n_surfaces is not None:
+            errors.extend(error for error in static_errors(int(n_surfaces))[0] if error not in errors)
+
+        runner = se.SweepRunner(spec, helper)
+        runner.query_baselines()
+        runner.close()
+        for name, parameter in runner.parameters.items():
+            if parameter.baseline is None:
+                errors.append(f"parameter '{name}': baseline could not be read from the lens")
+        for name, definition in spec["readouts"].items():
+            if definition["type"] != "spot" and se.read_readout(helper, definition) is None:
+                errors.append(f"readout '{name}': no value for the loaded lens")
+
+        if not errors:
+            # the sample runs through the spec's own executor on this session
+            sampled = sample_points(units, sample)
+            unit_of = {point["index"]: k for k, unit in enumerate(sampled) for point in unit}
+            seconds = [0.0]*len(sampled)
+            live_spec = dict(spec, session=cv_session,
+                             executor=dict(spec.get("executor", {}), type=executor_type(spec)))
+            try:
+                for record in se.run_sweep(live_spec, points=[point for unit in sampled for point in unit]):
+                    seconds[unit_of[record["index"]]] += sum(record["timing"].values())
+                    missing = [name for name in spec["readouts"] if record[name] is None]
+                    if missing:
+                        errors.append(f"point {record['index']}: no value for {', '.join(missing)}")
+                    if record.get("flags"):
+                        warnings.extend(f"point {record['index']}: {flag['kind']}: {flag['message']}"
+                                        for flag in record["flags"])
+                    report["sample"].append(record)
+            except Exception as e:
+                errors.append(f"sample run: {e}")
+            else:
+                report["projected_seconds"] = sum(seconds)/len(seconds)*len(units)/parallel_workers(spec)
+    except Exception as e:
+        errors.append(f"session: {e}")
+    finally:
+        se.close_spec_session(spec, cv_session)
+
+    report["ok"] = not errors
+    return report
+
+
+def print_report(report):
+    print(f"Pre-flight: {report['n_points']} points in {report['n_units']} runs, {report['n_commands']} commands")
+    for warning in report["warnings"][:20]:
+        print(f"  warning: {warning}")
+    for error in report["errors"][:50]:
+        print(f"  ERROR: {error}")
+    if report["projected_seconds"] is not None:
+        print(f"  {len(report['sample'])} sample points ran, projected full run: "
+              f"{report['projected_seconds']/3600:.2f} h")
+    print("Pre-flight passed" if report["ok"] else f"Pre-flight failed with {len(report['errors'])} errors")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Validate a sweep spec before running it")
+    parser.add_argument("spec")
+    parser.add_argument("--sample", type=int, default=3,
+                        help="points, zoom groups or macro chunks to run (0 for static checks only)")
+    parser.add_argument("--session", choices=se.SESSION_TYPES, help="overrides the spec's session type")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    spec = se.load_spec(args.spec)
+    if args.session:
+        spec["session"] = args.session
+    report = preflight(spec, sample=args.sample, debug=args.debug)
+    print_report(report)
+    raise SystemExit(0 if report["ok"] else 1)
@@ -0,0 +1,280 @@
+"""
+Vectorised sequential real-ray tracer for the exported prescription.
+
+export_lens_data.py writes one row per surface (Surface, Radius, Thickness,
+Glass, Index). This module loads that CSV and traces large ray bundles through
+the spherical surfaces with NumPy only, so epsilon perturbations of the gaps
+can be screened for spot size and focus shift offline, before spending
+licensed CODE V time on them.
+
+Only the spherical base of each surface is traced: decenters and the XY
+polynomial terms of the Lohmann lenses and the SLM are not part of the export,
+so the screening is meant for the gaps between the spherical lenses.
+
+Refractive indices come from a local Sellmeier table covering the glasses the
+optimizer is allowed to use (NFK5, NSK16, NLAF2, SF4) plus the achromat and
+fused silica glasses of the system; any other glass falls back to the index
+written in the CSV.
+
+    lens = SequentialLens.from_csv("lens_data_export.csv", wavelength=0.53)
+    origins, directions = point_source_rays(500, 0, 2.0, 1_000_000)
+    result = lens.trace(origins, directions)
+    spot_rms(result), best_focus(result)
+
+Usage:
+    python ray_tracer.py lens_data_export.csv --rays 1000000
+"""
+
+import argparse
+import copy
+import csv
+import time
+
+import numpy as np
+
+# Sellmeier coefficients (B1, B2, B3, C1, C2, C3), wavelength in um, C in um^2
+GLASS_CATALOG = {
+    "NFK5": (0.844309338, 0.344147824, 0.910790213, 0.00475111955, 0.0149814849, 97.8600293),
+    "NSK16": (1.34317774, 0.241144399, 0.994317969, 0.00704687339, 0.0229005, 92.7508526),
+    "NLAF2": (1.80984227, 0.15729555, 1.0930037, 0.0101711622, 0.0442431765, 100.687748),
+    "SF4": (1.61957826, 0.339493189, 1.02566931, 0.0125502104, 0.0544559822, 117.652222),
+    "NBAF10": (1.5851495, 0.143559385, 1.08521269, 0.00926681282, 0.0424489805, 105.613573),
+    "NSF6HT": (1.77931763, 0.338149866, 2.08734474, 0.0133714182, 0.0617533621, 174.01759),
+    "SILICA": (0.6961663, 0.4079426, 0.8974794, 0.00467914826, 0.0135120631, 97.9340025),
+}
+
+# CODE V writes flat surfaces and infinite object distances as huge numbers
+INFINITY = 1e12
+
+
+def normalize_glass_name(name):
+    # "N-FK5", "NFK5_SCHOTT" and "nfk5" all map to "NFK5"
+    name = (name or "").strip().strip("'\"").upper()
+    name = name.split("_")[0]
+    return name.replace("-", "")
+
+
+def glass_index(name, wavelength):
+    """
+    Refractive index of a catalog glass at `wavelength` (um), None if the
+    glass is not in the local table.
+    """
+    coefficients = GLASS_CATALOG.get(normalize_glass_name(name))
+    if coefficients is None:
+        return None
+    b1, b2, b3, c1, c2, c3 = coefficients
+    w2 = wavelength**2
+    return float(np.sqrt(1 + b1*w2/(w2 - c1) + b2*w2/(w2 - c2) + b3*w2/(w2 - c3)))
+
+
+class SequentialLens:
+    """
+    Surfaces 0 (object) to N (image) with curvature, thickness after the
+    surface and refractive index after the surface. Lengths in mm.
+    """
+
+    def __init__(self, curvatures, thicknesses, indices, glasses=None, semi_diameters=None):
+        self.curvatures = np.asarray(curvatures, dtype=float)
+        self.thicknesses = np.asarray(thicknesses, dtype=float)
+        self.indices = np.asarray(indices, dtype=float)
+        self.glasses = list(glasses) if glasses is not None else [""]*len(self.curvatures)
+        self.semi_diameters = None if semi_diameters is None else np.asarray(semi_diameters, dtype=float)
+
+    @classmethod
+    def from_csv(cls, path, wavelength=0.53):
+        """
+        Loads the CSV written by export_lens_data.py. Catalog glasses are
+        re-evaluated at `wavelength` (um); others keep the exported index.
+        """
+        curvatures, thicknesses, indices, glasses = [], [], [], []
+        with open(path, "r", newline="") as f:
+            for row in csv.DictReader(f):
+                radius = float(row["Radius"])
+                curvatures.append(0.0 if abs(radius) >= INFINITY or radius == 0 else 1/radius)
+                thicknesses.append(float(row["Thickness"]))
+                glass = row.get("Glass", "")
+                index = glass_index(glass, wavelength) if glass else None
+                indices.append(index if index is not None else float(row["Index"] or 1))
+                glasses.append(glass)
+
+        if len(curvatures) < 3:
+            raise ValueError(f"{path} holds {len(curvatures)} surfaces, re-run export_lens_data.py")
+        return cls(curvatures, thicknesses, indices, glasses)
+
+    @property
+    def num_surfaces(self):
+        return len(self.curvatures)
+
+    def perturbed(self, thickness_deltas):
+        """
+        Copy of the lens with {surface number: delta (mm)} added to the
+        thicknesses, e.g. perturbed({3: 0.002}).
+        """
+        lens = copy.deepcopy(self)
+        for surface, delta in thickness_deltas.items():
+            lens.thicknesses[int(str(surface).lstrip("Ss"))] += delta
+        return lens
+
+    def trace(self, origins, directions, chunk_size=1_000_000, image_shift=0.0):
+        """
+        Traces rays given in the frame of surface 1 (vertex at z = 0) through
+        to the image surface, `image_shift` mm past its nominal position. The
+        rays are processed in chunks so memory stays bounded for any bundle.
+
+        Returns a dict with the image positions and directions (N x 3) and a
+        boolean `valid` mask; rays that miss a surface, are clipped by a
+        semi-diameter or undergo total internal reflection are invalid.
+        """
+        origins = np.asarray(origins, dtype=float)
+        directions = np.asarray(directions, dtype=float)
+        n = origins.shape[0]
+        positions = np.empty((n, 3))
+        out_directions = np.empty((n, 3))
+        valid = np.empty(n, dtype=bool)
+
+        for start in range(0, n, chunk_size):
+            stop = min(start + chunk_size, n)
+            p, k, ok = self._trace_chunk(origins[start:stop].copy(), directions[start:stop].copy(), image_shift)
+            positions[start:stop] = p
+            out_directions[start:stop] = k
+            valid[start:stop] = ok
+
+        return {"positions": positions, "directions": out_directions, "valid": valid}
+
+    def _trace_chunk(self, p, k, image_shift):
+        k /= np.linalg.norm(k, axis=1, keepdims=True)
+        valid = np.ones(p.shape[0], dtype=bool)
+        last = self.num_surfaces - 1
+
+        for s in range(1, last + 1):
+            c = self.curvatures[s] if s < last else 0.0
+            if s == last:
+                p[:, 2] -= image_shift
+
+            # intersection with the sphere (Spencer & Murty), c = 0 is the plane
+            F = c*np.einsum("ij,ij->i", p, p) - 2*p[:, 2]
+            G = k[:, 2] - c*np.einsum("ij,ij->i", p, k)
+            disc = G*G - c*F
+            valid &= disc >= 0
+            with np.errstate(invalid="ignore", divide="ignore"):
+                t = F/(G + np.sqrt(np.maximum(disc, 0)))
+            p += t[:, None]*k
+
+            if self.semi_diameters is not None and s < last:
+                valid &= p[:, 0]**2 + p[:, 1]**2 <= self.semi_diameters[s]**2
+
+            if s == last:
+                break
+
+            n1, n2 = self.indices[s - 1], self.indices[s]
+            if n1 != n2:
+                # unit surface normal pointing along +z at the vertex
+                normal = np.empty_like(p)
+                normal[:, 0] = -c*p[:, 0]
+                normal[:, 1] = -c*p[:, 1]
+                normal[:, 2] = 1 - c*p[:, 2]
+                mu = n1/n2
+                cos_i = np.einsum("ij,ij->i", k, normal)
+                root = 1 - mu*mu*(1 - cos_i*cos_i)
+                valid &= root >= 0
+                gamma = np.sign(cos_i)*np.sqrt(np.maximum(root, 0)) - mu*cos_i
+                k *= mu
+                k += gamma[:, None]*normal
+
+            # move to the frame of the next surface
+            p[:, 2] -= self.thicknesses[s]
+
+        return p, k, valid
+
+
+# ==============================================================================
+# Ray bundles and metrics
+# ==============================================================================
+
+def point_source_rays(object_distance, field_height, pupil_semi_diameter, n_rays, seed=None):
+    """
+    Rays from an object point `object_distance` mm in front of surface 1 at
+    height `field_height` (mm, along y) filling a circular aperture of
+    `pupil_semi_diameter` on surface 1. Pass object_distance=None for a
+    collimated on-axis bundle.
+    """
+    rng = np.random.default_rng(seed)
+    radius = pupil_semi_diameter*np.sqrt(rng.random(n_rays))
+    angle = 2*np.pi*rng.random(n_rays)
+    target = np.column_stack([radius*np.cos(angle), radius*np.sin(angle), np.zeros(n_rays)])
+
+    if object_distance is None or object_distance >= INFINITY:
+        directions = np.zeros((n_rays, 3))
+        directions[:, 2] = 1
+        origins = target.copy()
+        origins[:, 2] = -1.0
+        return origins, directions
+
+    origin = np.array([0.0, field_height, -object_distance])
+    origins = np.broadcast_to(origin, (n_rays, 3)).copy()
+    directions = target - origins
+    return origins, directions
+
+
+def spot_rms(result):
+    # RMS radius of the valid rays on the image plane
+    p = result["positions"][result["valid"]]
+    if p.shape[0] == 0:
+        return np.nan
+    d = p[:, :2] - p[:, :2].mean(axis=0)
+    return float(np.sqrt((d**2).sum(axis=1).mean()))
+
+
+def best_focus(result):
+    """
+    Axial shift (mm) of the image plane that minimises the RMS spot radius,
+    in closed form from the ray slopes at the image. Returns (shift, rms).
+    """
+    p = result["positions"][result["valid"]][:, :2]
+    k = result["directions"][result["valid"]]
+    if p.shape[0] == 0:
+        return np.nan, np.nan
+    slopes = k[:, :2]/k[:, 2:3]
+    dp = p - p.mean(axis=0)
+    ds = slopes - slopes.mean(axis=0)
+    shift = -float((dp*ds).sum()/(ds*ds).sum())
+    rms = float(np.sqrt(((dp + shift*ds)**2).sum(axis=1).mean()))
+    return shift, rms
+
+
+def screen_thickness(lens, surface, epsilons, origins, directions):
+    """
+    Traces the same ray bundle for each thickness perturbation (mm) of
+    `surface` and returns arrays of image RMS, best-focus shift and RMS at
+    best focus.
+    """
+    rms = np.empty(len(epsilons))
+    shift = np.empty(len(epsilons))
+    focus_rms = np.empty(len(epsilons))
+    for i, epsilon in enumerate(epsilons):
+        result = lens.perturbed({surface: epsilon}).trace(origins, directions)
+        rms[i] = spot_rms(result)
+        shift[i], focus_rms[i] = best_focus(result)
+    return {"rms": rms, "focus_shift": shift, "focus_rms": focus_rms}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trace a ray bundle through an exported prescription")
+    parser.add_argument("csv_file")
+    parser.add_argument("--rays", type=int, default=1_000_000)
+    parser.add_argument("--distance", type=float, default=500, help="object distance (mm)")
+    parser.add_argument("--pupil", type=float, default=2.0, help="aperture semi-diameter on surface 1 (mm)")
+    parser.add_argument("--wavelength", type=float, default=0.53, help="wavelength (um)")
+    args = parser.parse_args()
+
+    lens = SequentialLens.from_csv(args.csv_file, wavelength=args.wavelength)
+    origins, directions = point_source_rays(args.distance, 0, args.pupil, args.rays, seed=0)
+
+    t0 = time.perf_counter()
+    result = lens.trace(origins, directions)
+    elapsed = time.perf_counter() - t0
+
+    shift, rms = best_focus(result)
+    print(f"Traced {args.rays} rays through {lens.num_surfaces} surfaces in {elapsed:.2f} s")
+    print(f"Valid rays: {result['valid'].sum()}")
+    print(f"RMS spot radius: {spot_rms(result)*1e3:.3f} um, best focus shift {shift:.4f} mm (RMS {rms*1e3:.3f} um)")
@@ -0,0 +1,354 @@
+"""
+Appendable, indexed store for sweep results.
+
+Instead of one sensitivity_{surface}_dist_{mm}mm.npz per (surface, distance),
+every sweep point is appended as one fixed-size record to a single binary file
+(results.bin). The columns are read back through np.memmap, so filtering on
+surface, distance or run only touches the pages that are needed. Strings (run
+id, lens file, surface) are dictionary-encoded; the dictionaries, the record
+count and the row range of each run are kept in index.json next to the data.
+
+    store = ResultsStore("results_store")
+    store.append_columns("run1", "system_with_camera", "S3", 0.4, epsilon, powers)
+    data = store.query(surface="S3", distance=0.4)
+    curves = store.curves()    # same layout the curves notebook builds by hand
+
+Existing NPZ files can be imported once with:
+    python results_store.py import sensitivity_analysis results_store
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+from sweep_schema import TIMING_PHASES, distance_axis
+
+RECORD_DTYPE = np.dtype([
+    ("run", "<u2"),          # index into index["runs"]
+    ("lens", "<u2"),         # index into index["lens_files"]
+    ("surface", "<u2"),      # index into index["surfaces"]
+    ("distance", "<f8"),     # object distance (m)
+    ("epsilon", "<f8"),      # perturbation (m, or the parameter's own unit)
+    ("power", "<f8"),        # optical power (D)
+    ("elapsed", "<f4"),      # time spent on the point (s)
+    ("timestamp", "<f8"),    # unix time the record was written
+])
+
+CATEGORIES = {"run": "runs", "lens": "lens_files", "surface": "surfaces"}
+
+NPZ_PATTERN = re.compile(r"sensitivity_(?P<surface>.+)_dist_(?P<mm>\d+)mm\.npz$")
+
+
+class ResultsStore:
+    """
+    Single-file columnar results store with a JSON index.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.data_path = os.path.join(directory, "results.bin")
+        self.index_path = os.path.join(directory, "index.json")
+        os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"count": 0, "runs": [], "lens_files": [], "surfaces": [], "run_rows": {}}
+
+        # a crash between writing data and index leaves extra bytes: ignore them
+        self._truncate_to_index()
+
+    def __len__(self):
+        return self.index["count"]
+
+    # --------------------------------------------------------------------------
+    # writing
+    # --------------------------------------------------------------------------
+
+    def _code(self, category, value):
+        values = self.index[CATEGORIES[category]]
+        if value not in values:
+            values.append(value)
+        return values.index(value)
+
+    def _truncate_to_index(self):
+        if not os.path.exists(self.data_path):
+            return
+        expected = self.index["count"]*RECORD_DTYPE.itemsize
+        if os.path.getsize(self.data_path) > expected:
+            with open(self.data_path, "r+b") as f:
+                f.truncate(expected)
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def append_columns(self, run_id, lens_file, surface, distance, epsilon, power, elapsed=0.0):
+        """
+        Appends a block of points. Scalars are broadcast against the array
+        arguments, so a whole epsilon curve is one call.
+        """
+        epsilon, power, distance, elapsed = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(epsilon, dtype=float)),
+            np.atleast_1d(np.asarray(power, dtype=float)),
+            np.atleast_1d(np.asarray(distance, dtype=float)),
+            np.atleast_1d(np.asarray(elapsed, dtype=float)),
+        )
+        n = epsilon.shape[0]
+
+        block = np.empty(n, dtype=RECORD_DTYPE)
+        block["run"] = self._code("run", run_id)
+        block["lens"] = self._code("lens", lens_file)
+        block["surface"] = self._code("surface", surface)
+        block["distance"] = distance
+        block["epsilon"] = epsilon
+        block["power"] = power
+        block["elapsed"] = elapsed
+        block["timestamp"] = time.time()
+
+        start = self.index["count"]
+        with open(self.data_path, "ab") as f:
+            f.write(block.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.index["count"] = start + n
+        run_rows = self.index["run_rows"]
+        if run_id not in run_rows:
+            run_rows[run_id] = [start, start + n]
+        elif run_rows[run_id] is not None and run_rows[run_id][1] == start:
+            run_rows[run_id][1] = start + n
+        else:
+            # the run is no longer contiguous, fall back to scanning the run column
+            run_rows[run_id] = None
+        self._write_index()
+        return n
+
+    def append_records(self, records, parameter_key="surface", distance_key="dist"):
+        """
+        Appends sweep_engine records. The perturbed parameter is read from
+        `parameter_key`, the perturbation from "epsilon" and the distance from
+        `distance_key` (see StoreSink.for_spec). The elapsed time is the sum
+        of the phase timings, so extra entries in "timing" are not counted.
+        """
+        groups = {}
+        for record in records:
+            key = (record["run_id"], record["lens_file"], record.get(parameter_key, ""))
+            groups.setdefault(key, []).append(record)
+
+        for (run_id, lens_file, surface), group in groups.items():
+            self.append_columns(
+                run_id, lens_file, surface,
+                [r.get(distance_key, np.nan) for r in group],
+                [r.get("epsilon", np.nan) for r in group],
+                [np.nan if r.get("power") is None else r["power"] for r in group],
+                [sum(seconds for phase, seconds in r.get("timing", {}).items() if phase in TIMING_PHASES)
+                 for r in group],
+            )
+
+    # --------------------------------------------------------------------------
+    # reading
+    # --------------------------------------------------------------------------
+
+    def records(self):
+        # memory-mapped view of all the records, nothing is read until used
+        if self.index["count"] == 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.memmap(self.data_path, dtype=RECORD_DTYPE, mode="r", shape=(self.index["count"],))
+
+    def mask(self, run_id=None, lens_file=None, surface=None, distance=None, atol=1e-9):
+        """
+        Boolean mask over the stored records. Each filter accepts a single
+        value or a list of values.
+        """
+        records = self.records()
+        if isinstance(run_id, str) and self.index["run_rows"].get(run_id) is not None:
+            # contiguous runs only need their own rows to be mapped
+            rows = self.index["run_rows"][run_id]
+            mask = np.zeros(len(records), dtype=bool)
+            mask[rows[0]:rows[1]] = True
+        else:
+            mask = np.ones(len(records), dtype=bool)
+            if run_id is not None:
+                mask &= self._category_mask(records, "run", run_id)
+
+        if lens_file is not None:
+            mask &= self._category_mask(records, "lens", lens_file)
+        if surface is not None:
+            mask &= self._category_mask(records, "surface", surface)
+        if distance is not None:
+            distances = np.atleast_1d(np.asarray(distance, dtype=float))
+            mask &= np.isclose(records["distance"][:, None], distances[None, :], atol=atol).any(axis=1)
+        return mask
+
+    def _category_mask(self, records, category, values):
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        known = self.index[CATEGORIES[category]]
+        codes = [known.index(v) for v in values if v in known]
+        return np.isin(records[category], codes)
+
+    def query(self, **filters):
+        """
+        Returns the matching records as a dict of column arrays, with the
+        categorical columns decoded to strings.
+        """
+        selected = np.asarray(self.records()[self.mask(**filters)])
+        columns = {name: selected[name] for name in RECORD_DTYPE.names}
+        for category, key in CATEGORIES.items():
+            lookup = np.asarray(self.index[key] or [""], dtype=object)
+            columns[category] = lookup[selected[category]]
+        return columns
+
+    def curves(self, **filters):
+        """
+        Groups the records as [{'s': surface, 'distances': [{'d': mm, 'epsilon':
+        ..., 'powers': ...}]}], sorted by epsilon, like the curves notebook.
+        """
+        data = self.query(**filters)
+        curves = []
+        for surface in dict.fromkeys(data["surface"]):
+            in_surface = data["surface"] == surface
+            entries = []
+            for dist in np.unique(data["distance"][in_surface]):
+                selected = in_surface & (data["distance"] == dist)
+                order = np.argsort(data["epsilon"][selected])
+                entries.append({
+                    "d": int(round(dist*1000)),
+                    "epsilon": data["epsilon"][selected][order],
+                    "powers": data["power"][selected][order],
+                })
+            curves.append({"s": surface, "distances": entries})
+        return curves
+
+
+class StoreSink:
+    """
+    Sink for sweep_engine.run_sweep that appends the records to a ResultsStore
+    in blocks of `buffer_size`.
+    """
+
+    def __init__(self, store, parameter_key="surface", distance_key="dist", buffer_size=15):
+        self.store = store
+        self.parameter_key = parameter_key
+        self.distance_key = distance_key
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    @classmethod
+    def for_spec(cls, store, spec, parameter_key="surface", buffer_size=15):
+        # the distance is the spec's S0 axis, whatever it is called
+        return cls(store, parameter_key, distance_axis(spec) or "dist", buffer_size)
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.store.append_records(self.buffer, self.parameter_key, self.distance_key)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+
+
+def npz_filename(surface, distance):
+    # file name of one sensitivity curve, distance in m
+    return f"sensitivity_{surface}_dist_{int(round(distance*1000))}mm.npz"
+
+
+class NpzSink:
+    """
+    Sink for sweep_engine.run_sweep writing one sensitivity NPZ (epsilon,
+    powers, dist) per perturbed parameter and distance, as the sensitivity
+    scripts always have. A curve is written when the records move on to
+    another parameter or distance.
+    """
+
+    def __init__(self, directory, parameter_key="surface", distance_key="dist", epsilon_key="epsilon",
+                 power_key="power"):
+        self.directory = directory
+        self.parameter_key = parameter_key
+        self.distance_key = distance_key
+        self.epsilon_key = epsilon_key
+        self.power_key = power_key
+        self.current = None
+        self.epsilon = []
+        self.powers = []
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record):
+        key = (record[self.parameter_key], record[self.distance_key])
+        if key != self.current:
+            self.flush()
+            self.current = key
+        self.epsilon.append(record[self.epsilon_key])
+        power = record.get(self.power_key)
+        self.powers.append(np.nan if power is None else power)
+
+    def flush(self):
+        if self.current is None or not self.epsilon:
+            return
+        surface, distance = self.current
+        np.savez(os.path.join(self.directory, npz_filename(surface, distance)),
+                 epsilon=np.array(self.epsilon), powers=np.array(self.powers), dist=distance)
+        self.epsilon, self.powers = [], []
+
+    def close(self):
+        self.flush()
+
+
+def import_npz(store, directory, lens_file="system_with_camera", run_id="npz_import"):
+    """
+    One-shot import of the sensitivity_{surface}_dist_{mm}mm.npz files.
+    Returns the number of imported files.
+    """
+    if run_id in store.index["run_rows"]:
+        print(f"Run '{run_id}' already in the store, skipping import")
+        return 0
+
+    imported = 0
+    for filename in sorted(os.listdir(directory)):
+        match = NPZ_PATTERN.match(filename)
+        if not match:
+            continue
+        data = np.load(os.path.join(directory, filename))
+        distance = float(data["dist"]) if "dist" in data.files else int(match.group("mm"))/1000
+        store.append_columns(run_id, lens_file, match.group("surface"), distance,
+                             data["epsilon"], data["powers"], np.nan)
+        imported += 1
+    return imported
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep results store")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    import_parser = subparsers.add_parser("import", help="import sensitivity NPZ files")
+    import_parser.add_argument("npz_dir")
+    import_parser.add_argument("store_dir")
+    import_parser.add_argument("--lens-file", default="system_with_camera")
+
+    info_parser = subparsers.add_parser("info", help="summarise a store")
+    info_parser.add_argument("store_dir")
+
+    args = parser.parse_args()
+    if args.action == "import":
+        store = ResultsStore(args.store_dir)
+        n = import_npz(store, args.npz_dir, lens_file=args.lens_file)
+        print(f"Imported {n} files, {len(store)} records in {args.store_dir}")
+    else:
+        store = ResultsStore(args.store_dir)
+        print(f"{len(store)} records")
+        print(f"Runs: {store.index['runs']}")
+        print(f"Lens files: {store.index['lens_files']}")
+        print(f"Surfaces: {store.index['surfaces']}")
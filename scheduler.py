@@ -0,0 +1,347 @@
+"""
+Scheduler for mixed CODE V jobs on a few licensed sessions.
+
+The jobs we queue mix cheap queries (~0.1 s), AUT runs (seconds) and IMS at
+TGR 1024 (minutes). Run FIFO on two sessions, a quick query can sit behind
+two image simulations. Here every job gets a predicted cost from a cost
+model learned from recorded timings, and the jobs are packed across the
+sessions by list scheduling: higher priority first, then earliest deadline,
+then longest predicted time first (LPT), each job on the session that
+becomes free first. The plan gives the predicted start / finish of every job
+and the predicted makespan; running it records the actual times, reports
+predicted vs actual and feeds the timings back to the model.
+
+Cost model: per job kind, log(seconds) is fitted by least squares on the log
+of the numeric job features (e.g. tgr, pmx, pmy for IMS), so a TGR 512 run is
+predicted from TGR 1024 runs; kinds with too few observations use their
+geometric mean, unseen kinds a default. Observations come from the
+scheduler's own history file, telemetry files (telemetry.py) and sweep
+records (their "timing": optimize -> aut, readout -> query). Points of
+zoom sweeps are left out: their AUT covers the whole zoom group and its time
+is split across the group's points.
+
+Jobs file (JSON list):
+
+    [
+        {"name": "tilt", "kind": "query", "commands": ["?SCO S13 C2"], "priority": 2},
+        {"name": "aut_0.5", "kind": "aut", "commands": ["THI S0 500", "AUT; ...; GO"]},
+        {"name": "ims_0.5", "kind": "ims", "commands": ["THI S0 500"],
+         "ims": {"image_file": "star.bmp", "output_file": "star_0p5", "tgr": 1024}, "deadline": 3600}
+    ]
+
+"deadline" is in seconds from the start of the schedule; "rollback": true
+restores the lens after the job. Sessions are leases from session_daemon.
+
+Usage:
+    python scheduler.py jobs.json --sessions 2 --history scheduler_history.jsonl
+    python scheduler.py jobs.json --sessions 3 --plan-only --telemetry run.telemetry.jsonl
+"""
+
+import argparse
+import heapq
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import codev_helper as cvh
+
+# seconds, for kinds the model has never seen
+DEFAULT_COSTS = {"query": 0.1, "aut": 5.0, "ims": 120.0}
+DEFAULT_COST = 10.0
+# minimum observations before the features are used
+MIN_FIT_OBSERVATIONS = 4
+# sweep record timing keys -> job kind
+TIMING_KINDS = {"optimize": "aut", "readout": "query", "ims": "ims"}
+
+
+# ==============================================================================
+# Cost model
+# ==============================================================================
+
+def job_features(job):
+    # numeric features of a job, IMS settings included
+    features = {}
+    if "ims" in job:
+        settings = dict(cvh.IMS_SETTINGS)
+        settings.update({key: value for key, value in job["ims"].items() if key in settings})
+        features.update(settings)
+    features.update(job.get("features", {}))
+    return {key: float(value) for key, value in features.items() if isinstance(value, (int, float)) and value > 0}
+
+
+class CostModel:
+    """
+    Per-kind log-linear model of the job duration.
+    """
+
+    def __init__(self, defaults=None):
+        self.defaults = dict(DEFAULT_COSTS if defaults is None else defaults)
+        self.observations = {}
+        self.fits = {}
+
+    def observe(self, kind, seconds, features=None):
+        if seconds is None or not seconds > 0:
+            return
+        self.observations.setdefault(kind, []).append((dict(features or {}), float(seconds)))
+        self.fits.pop(kind, None)
+
+    def _fit(self, kind):
+        observations = self.observations.get(kind, [])
+        names = sorted({name for features, _ in observations for name in features})
+        # only features that vary and are known for every observation
+        names = [name for name in names
+                 if all(name in features for features, _ in observations)
+                 and len({features[name] for features, _ in observations}) > 1]
+        y = np.log([seconds for _, seconds in observations])
+        if len(observations) < MIN_FIT_OBSERVATIONS or not names:
+            fit = {"names": [], "means": [], "coefficients": np.array([y.mean()]), "sigma": float(y.std())}
+        else:
+            logs = [np.log([features[name] for features, _ in observations]) for name in names]
+            x = np.column_stack([np.ones(len(y))] + logs)
+            # a little ridge keeps exponents sane with few observations
+            ridge = 1e-3*np.eye(x.shape[1])
+            ridge[0, 0] = 0
+            coefficients = np.linalg.solve(x.T @ x + ridge, x.T @ y)
+            fit = {"names": names, "means": [float(np.mean(log)) for log in logs], "coefficients": coefficients,
+                   "sigma": float(np.std(y - x @ coefficients))}
+        self.fits[kind] = fit
+        return fit
+
+    def predict(self, kind, features=None):
+        if not self.observations.get(kind):
+            return self.defaults.get(kind, DEFAULT_COST)
+        fit = self.fits.get(kind) or self._fit(kind)
+        features = features or {}
+        # a feature the job does not give is taken at its typical value
+        x = [1.0] + [math.log(features[name]) if features.get(name) else mean
+                     for name, mean in zip(fit["names"], fit["means"])]
+        return float(math.exp(np.dot(fit["coefficients"], x)))
+
+    def predict_job(self, job):
+        return self.predict(job.get("kind", "default"), job_features(job))
+
+    def summary(self):
+        lines = []
+        for kind, observations in sorted(self.observations.items()):
+            fit = self.fits.get(kind) or self._fit(kind)
+            terms = ", ".join(f"{name}^{c:.2f}" for name, c in zip(fit["names"], fit["coefficients"][1:]))
+            lines.append(f"{kind}: {len(observations)} observations, "
+                         f"median {np.median([s for _, s in observations]):.3g} s"
+                         + (f", cost ~ {terms}" if terms else "") + f", log sigma {fit['sigma']:.2f}")
+        return lines
+
+    # --------------------------------------------------------------------------
+    # sources of observations
+    # --------------------------------------------------------------------------
+
+    def load_history(self, path):
+        # scheduler history: one {"kind", "seconds", "features"} per line
+        if not os.path.exists(path):
+            return 0
+        n = 0
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.observe(entry["kind"], entry["seconds"], entry.get("features"))
+                    n += 1
+        return n
+
+    def load_timings(self, path):
+        """
+        Phase timings of telemetry "point" events or sweep records ("timing"),
+        mapped to job kinds with TIMING_KINDS. Entries with a zoom group size
+        ("zoom_positions") hold a share of a multi-position AUT and are
+        skipped.
+        """
+        n = 0
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("zoom_positions"):
+                    continue
+                timing = entry.get("phases") or entry.get("timing") or {}
+                for phase, seconds in timing.items():
+                    if phase in TIMING_KINDS:
+                        self.observe(TIMING_KINDS[phase], seconds)
+                        n += 1
+        return n
+
+
+def append_history(path, kind, seconds, features):
+    with open(path, "a") as f:
+        f.write(json.dumps({"kind": kind, "seconds": seconds, "features": features, "t": time.time()}) + "\n")
+
+
+# ==============================================================================
+# Planning
+# ==============================================================================
+
+def dispatch_order(jobs, costs):
+    # priority, then deadline, then longest first (LPT)
+    def key(k):
+        deadline = jobs[k].get("deadline")
+        return (-jobs[k].get("priority", 0), deadline if deadline is not None else math.inf, -costs[k])
+    return sorted(range(len(jobs)), key=key)
+
+
+def plan(jobs, n_sessions, model):
+    """
+    List schedule of the jobs on n_sessions with the predicted costs.
+    Returns a dict with the dispatch order, per-job session / start /
+    finish, the deadline misses and the predicted makespan.
+    """
+    costs = [model.predict_job(job) for job in jobs]
+    order = dispatch_order(jobs, costs)
+    free = [(0.0, session) for session in range(n_sessions)]
+    heapq.heapify(free)
+    entries = [None]*len(jobs)
+    for k in order:
+        start, session = heapq.heappop(free)
+        finish = start + costs[k]
+        entries[k] = {"name": jobs[k].get("name", str(k)), "kind": jobs[k].get("kind"), "session": session,
+                      "start": start, "finish": finish, "cost": costs[k]}
+        heapq.heappush(free, (finish, session))
+
+    misses = [entries[k]["name"] for k in order
+              if jobs[k].get("deadline") is not None and entries[k]["finish"] > jobs[k]["deadline"]]
+    return {"order": order, "jobs": entries, "misses": misses,
+            "makespan": max((entry["finish"] for entry in entries), default=0.0),
+            "serial": sum(costs)}
+
+
+def fifo_makespan(jobs, n_sessions, model):
+    # same packing in submission order, for comparison
+    free = [0.0]*n_sessions
+    for job in jobs:
+        k = int(np.argmin(free))
+        free[k] += model.predict_job(job)
+    return max(free, default=0.0)
+
+
+# ==============================================================================
+# Execution
+# ==============================================================================
+
+def run_job(helper, job):
+    for command in job.get("commands", []):
+        helper.command(command)
+    if "ims" in job:
+        helper.run_ims(**job["ims"])
+
+
+def execute(jobs, n_sessions, model, session_factory=None, history=None, debug=False):
+    """
+    Runs the jobs on n_sessions leases in the planned dispatch order, each
+    session taking the next job when it becomes free. Returns the plan with
+    the actual start / finish of every job and the actual makespan; the
+    measured durations are added to the model (and the history file).
+    """
+    if session_factory is None:
+        import session_daemon
+
+        session_factory = session_daemon.connect
+
+    schedule = plan(jobs, n_sessions, model)
+    pending = list(schedule["order"])
+    lock = threading.Lock()
+    t_start = time.perf_counter()
+
+    def worker(session):
+        cv_session = None
+        try:
+            cv_session = session_factory()
+            helper = cvh.CodeVHelper(cv_session, debug=debug)
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    k = pending.pop(0)
+                job, entry = jobs[k], schedule["jobs"][k]
+                entry["actual_session"] = session
+                entry["actual_start"] = time.perf_counter() - t_start
+                try:
+                    if job.get("rollback"):
+                        with helper.snapshot():
+                            run_job(helper, job)
+                    else:
+                        run_job(helper, job)
+                    entry["status"] = "ok"
+                except Exception as e:
+                    entry["status"] = f"error: {e}"
+                entry["actual_finish"] = time.perf_counter() - t_start
+                seconds = entry["actual_finish"] - entry["actual_start"]
+                with lock:
+                    if entry["status"] == "ok":
+                        features = job_features(job)
+                        model.observe(job.get("kind", "default"), seconds, features)
+                        if history:
+                            append_history(history, job.get("kind", "default"), seconds, features)
+                    print(f"  [{session}] {entry['name']}: {seconds:.2f} s (predicted {entry['cost']:.2f} s) "
+                          f"{entry['status']}")
+        finally:
+            cvh.stop_session(cv_session)
+
+    threads = [threading.Thread(target=worker, args=(session,), daemon=True) for session in range(n_sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    finished = [entry for entry in schedule["jobs"] if "actual_finish" in entry]
+    schedule["actual_makespan"] = max((entry["actual_finish"] for entry in finished), default=0.0)
+    schedule["actual_misses"] = [jobs[k].get("name", str(k)) for k in schedule["order"]
+                                 if jobs[k].get("deadline") is not None
+                                 and schedule["jobs"][k].get("actual_finish", math.inf) > jobs[k]["deadline"]]
+    return schedule
+
+
+def print_plan(schedule, fifo=None):
+    print(f"{'job':>20s} {'kind':>8s} {'session':>7s} {'start':>9s} {'finish':>9s} {'actual':>9s}")
+    for k in schedule["order"]:
+        entry = schedule["jobs"][k]
+        actual = f"{entry['actual_finish']:9.1f}" if "actual_finish" in entry else f"{'--':>9s}"
+        print(f"{entry['name']:>20s} {str(entry['kind']):>8s} {entry['session']:7d} "
+              f"{entry['start']:9.1f} {entry['finish']:9.1f} {actual}")
+    print(f"Predicted makespan {schedule['makespan']:.1f} s (serial {schedule['serial']:.1f} s"
+          + (f", FIFO {fifo:.1f} s)" if fifo is not None else ")"))
+    if "actual_makespan" in schedule:
+        print(f"Actual makespan {schedule['actual_makespan']:.1f} s")
+    if schedule["misses"]:
+        print(f"Predicted deadline misses: {', '.join(schedule['misses'])}")
+    if schedule.get("actual_misses"):
+        print(f"Missed deadlines: {', '.join(schedule['actual_misses'])}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Schedule CODE V jobs across warm sessions")
+    parser.add_argument("jobs", help="JSON list of jobs")
+    parser.add_argument("--sessions", type=int, default=2)
+    parser.add_argument("--history", default="scheduler_history.jsonl", help="recorded job timings (read and appended)")
+    parser.add_argument("--telemetry", nargs="*", default=[], help="telemetry / sweep JSONL files to learn from")
+    parser.add_argument("--plan-only", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.jobs, "r") as f:
+        jobs = json.load(f)
+
+    model = CostModel()
+    n = model.load_history(args.history)
+    for path in args.telemetry:
+        n += model.load_timings(path)
+    print(f"Cost model from {n} observations")
+    for line in model.summary():
+        print(f"  {line}")
+
+    if args.plan_only:
+        print_plan(plan(jobs, args.sessions, model), fifo_makespan(jobs, args.sessions, model))
+    else:
+        fifo = fifo_makespan(jobs, args.sessions, model)
+        print_plan(execute(jobs, args.sessions, model, history=args.history, debug=args.debug), fifo)
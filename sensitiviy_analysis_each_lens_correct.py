@@ -1,195 +1,38 @@
-import win32com.client
-import os
-import numpy as np
-import time
-from params import Params
-import matplotlib.pyplot as plt
-import codev_helper as cvh
-import os
-
-# ==============================================================================
-# Helper Functions
-# ==============================================================================
-    
-def tilt2power(tilt):
-    delta = -tilt*params.f0
-    optical_power = delta*12*(params.eta - params.eta_air)/params.C0
-    return optical_power
+"""
+Sensitivity of the optical power to each gap and to the Lohmann translation,
+with the gaps of the corrected lens model (sweeps/each_lens.json).
 
-def translate_lohmann(cv_session, delta):
-    # lohmann surfaces
-    ["S8", "S9", "S17", "S18"]
+Usage:
+    python sensitiviy_analysis_each_lens_correct.py [--session daemon]
+"""
 
-    for surface in ["S8", "S9", "S17", "S18"]:
-        # set return and decenter
-        dar_command = f"DAR {surface}"
-        cv_session.Command(dar_command)
-
-        # translate
-        zde_command = f"ZDE {surface} {delta}"
-        cv_session.Command(zde_command)
+import argparse
+import os
 
+import sweep_engine as se
+from sensitiviy_analysis_each_lens import run_each_lens
 
-params = Params()
+NAME_MAPS = {
+    "S3": r"$L_1$ to $L_2$",
+    "S9": r"$L_2$ to $L_3$",
+    "S12": r"$L_3$ to SLM",
+    "S19": r"$L_3$ to $L_4$",
+    "S22": r"$L_4$ to $L_e$",
+    "S26": r"$L_e$ to Camera's lens",
+    "S29": r"$L_c$ to camera's sensor",
+    "lohmann": "Lohmann translation",
+}
 
 
 if __name__ == '__main__':
-    # --- Configuration for CodeV session ---
+    parser = argparse.ArgumentParser(description="Sensitivity of the power to each gap of the corrected lens")
+    parser.add_argument("--session", choices=se.SESSION_TYPES, help="overrides the spec's session type")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
     WORKING_DIR = os.getcwd() + "\\"
-    LENS_FILE = WORKING_DIR + "system_with_camera" 
     RESULTS_DIR = WORKING_DIR + "sensitivity_analysis\\"
 
-    # --- initialise variables ---
-    distances = [0.4, 0.5, 0.6, 0.7, 0.8, 2, 3.75]
-    e_min = -3e-3
-    e_max = 3e-3
-    num_steps = 15
-    epsilon = np.linspace(e_min, e_max, num_steps)
-
-    # surfaces for each epsilon
-    e1_surface = "S3"           # Lens 1 to Lens 2
-    e2_surface = "S9"           # Lens 2 to lens 3 must be applied to the thickness of the lohmann
-    e3_surface = "S12"          # Lens 3 to SLM 
-    e4_surface = "S19"          # Lens 3 (L4 in code V) to  lens 4 (L5 in Code V) measured from the BS to the next lens
-    e5_surface = "S22"          # Lens 4 to lens 5 (5 to 6 in Code V)
-    e6_surface = "S26"          # Lens 5 to lens 6 (6 to 7 in Code V)
-    e7_surface = "S29"          # Lens 6 to camera sensor
-
-    name_maps = {
-        e1_surface: r"$L_1$ to $L_2$",
-        e2_surface: r"$L_2$ to $L_3$",
-        e3_surface: r"$L_3$ to SLM",
-        e4_surface: r"$L_3$ to $L_4$",
-        e5_surface: r"$L_4$ to $L_e$",
-        e6_surface: r"$L_e$ to Camera's lens",
-        e7_surface: r"$L_c$ to camera's sensor",
-    }
-    
-
-    n_levels = 30
-    cmap = 'viridis'
-
-    # --- 2. Initialize and Start CODE V Session ---
-    cv_session = None
-
-    try: 
-        # create the COM object to interact with CODE V
-        cv_session = win32com.client.Dispatch("CodeV.Application")
-        print("Successfully created CODE V session object.")
-
-        # set the working directory and start the background process
-        cv_session.StartingDirectory = WORKING_DIR
-        cv_session.StartCodeV()
-        print(f"CODE V background process started. Version: {cv_session.CodeVVersion}")
-
-        # open the specified lens file
-        print(f"Opening lens: {LENS_FILE}...")
-        output = cv_session.Command(f"RES {LENS_FILE}")
-        print(f"Lens opened. CODE V response: {output}")
-
-        # Ensure the results directory exists
-        if not os.path.exists(RESULTS_DIR):
-            os.makedirs(RESULTS_DIR)
-            print(f"Created results directory: {RESULTS_DIR}")
-
-        # Initialize CodeVHelper
-        cvHelper = cvh.CodeVHelper(cv_session)
-
-        # get initial thickness of the surfaces
-        s1_t = cvHelper.query_surf_thickness(e1_surface)
-        s2_t = cvHelper.query_surf_thickness(e2_surface)
-        s3_t = cvHelper.query_surf_thickness(e3_surface)
-        s4_t = cvHelper.query_surf_thickness(e4_surface)
-        s5_t = cvHelper.query_surf_thickness(e5_surface)
-        s6_t = cvHelper.query_surf_thickness(e6_surface)
-        s7_t = cvHelper.query_surf_thickness(e7_surface)
-        
-
-        surfaces_thickness = [s1_t, s2_t, s3_t, s4_t, s5_t, s6_t, s7_t]
-
-        print(f"Initial thicknesses - {e1_surface}: {s1_t} mm, {e2_surface}: {s2_t} mm, {e3_surface}: {s3_t} mm, {e4_surface}: {s4_t} mm, {e5_surface}: {s5_t} mm, {e6_surface}: {s6_t} mm, {e7_surface}: {s7_t} mm")
-
-        # print lens 
-        cvHelper.plot_lens("initial_lens")
-        epsilon = np.linspace(e_min, e_max, num_steps)
-
-        # --- Main Processing Loop ---
-        i = 0
-        for e_surface in [e1_surface, e2_surface, e3_surface, e4_surface, e5_surface, e6_surface, e7_surface, 'lohmann']:
-            
-            # reset thicknesses
-            cvHelper.set_surf_thickness(e1_surface, s1_t)
-            cvHelper.set_surf_thickness(e2_surface, s2_t)
-            cvHelper.set_surf_thickness(e3_surface, s3_t)
-            cvHelper.set_surf_thickness(e4_surface, s4_t)
-            cvHelper.set_surf_thickness(e5_surface, s5_t)
-            cvHelper.set_surf_thickness(e6_surface, s6_t)
-            cvHelper.set_surf_thickness(e7_surface, s7_t)
-            translate_lohmann(cv_session, 0)
-            #cvHelper.set_surf_thickness(e8_surface, s8_t)
-            
-            plt.figure()
-            
-            for dist in distances:
-                # set the object distance 
-                print(f"Setting object distance to {dist*1000} mm...")
-                cvHelper.set_surf_thickness("S0", dist*1000)  # convert to mm
-
-                powers = [] 
-                for e in epsilon:
-                    if e_surface == 'lohmann':
-                        # translate lohmann
-                        translate_lohmann(cv_session, e*1e3)  # convert to mm
-                    else:
-                        # set the thickness for surface 
-                        cvHelper.set_surf_thickness(e_surface, surfaces_thickness[i] + e*1e3)  # convert to mm
-
-                    # apply vignetting
-                    cvHelper.apply_vignetting()
-
-                    # perform automatic optimization
-                    optimization_command = "AUT; P YES; ERR CDV; MNC 5; DRA S1..30  NO; EFP ALL Y; EFT TA; GLA SO..I  NFK5 NSK16 NLAF2 SF4; GO"
-                    #print(f"  Performing optimization: {optimization_command}")
-                    cv_session.Command(optimization_command)
-
-                    # get the value of the tilt
-                    tilt = cvHelper.query_xypolynomial_coeff("S13", "C2")
-                    power = tilt2power(tilt)
-
-                    # store
-                    powers.append(power)
-
-                # save matrices
-                np.savez(os.path.join(RESULTS_DIR, f"sensitivity_{e_surface}_dist_{int(dist*1000)}mm.npz"), epsilon=epsilon, powers=powers, dist=dist)
-
-
-                plt.plot(epsilon*1e3, powers, marker='o', label=r'$d_O$' + f'= {dist*1000} mm')
-                plt.title(f"Lens {name_maps[e_surface]}")
-                plt.xlabel('Epsilon (mm)')
-                plt.ylabel('Optical Power (Diopters)')
-                plt.grid(True)
-
-                
-            plt.legend()
-            plot_filename = os.path.join(RESULTS_DIR, f"sensitivity_{e_surface}.pdf")
-            plt.savefig(plot_filename, dpi=300, bbox_inches='tight')
-            i += 1
-
-            # print percentage complete
-            progress = (i) / 7 * 100
-            print(f"Sensitivity Analysis Progress: {progress:.2f} %")
-
-
-                
-
-
-
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-    finally:
-        # --- Crlan Up and Close session ---
-        if cv_session:
-            cv_session.StopCodeV()
-            print("\nCODE V session stopped.")
-            cv_session = None
+    run_each_lens(os.path.join("sweeps", "each_lens.json"), RESULTS_DIR,
+                  titles={surface: f"Lens {name}" for surface, name in NAME_MAPS.items()},
+                  session=args.session, debug=args.debug)
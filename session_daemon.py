@@ -0,0 +1,302 @@
+"""
+Long-lived local server keeping warm CODE V sessions.
+
+Every script pays Dispatch + StartCodeV + RES + MPP 8 before doing any work.
+The daemon does that once per session and keeps the sessions alive; scripts
+and notebooks lease a session over a local socket, send commands through it
+and give it back. A lease behaves like the COM session object, so it can be
+handed to CodeVHelper unchanged:
+
+    import session_daemon
+
+    cv_session = session_daemon.connect()
+    cvHelper = cvh.CodeVHelper(cv_session)
+    ...
+    cvh.stop_session(cv_session)    # releases the lease, CODE V keeps running
+
+When a lease is released the lens is restored from the snapshot saved right
+after start-up, so every job starts from the same clean lens. connect() can
+name the lens file the caller expects; the daemon refuses the lease when its
+sessions hold another lens. The CODE V error / warning events raised by a
+command come back with its reply and are appended to the lease's event_log,
+so CodeVHelper applies its event policy as with a local session.
+
+Sweep specs lease through the daemon with "session": "daemon" (or --session
+daemon on the command line of the sweep scripts).
+
+Usage:
+    python session_daemon.py system_with_camera --sessions 2 --setup "MPP 8"
+"""
+
+import argparse
+import os
+import queue
+import threading
+from multiprocessing.connection import Client, Listener
+
+import codev_helper as cvh
+
+DEFAULT_ADDRESS = ("localhost", 6010)
+DEFAULT_AUTHKEY = b"codev-session-daemon"
+
+
+class WarmSession:
+    """
+    One CODE V session owned by its own thread. COM objects must be used from
+    the thread that created them, so every call is queued to that thread.
+    """
+
+    def __init__(self, index, working_dir, lens_file, setup_commands=(), debug=False):
+        self.index = index
+        self.working_dir = working_dir
+        self.lens_file = lens_file
+        self.setup_commands = list(setup_commands)
+        self.debug = debug
+        self.snapshot = os.path.join(working_dir, f"daemon_snapshot_{index}")
+        self.event_log = []
+        self.jobs = queue.Queue()
+        self.ready = threading.Event()
+        self.error = None
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.ready.wait()
+        if self.error:
+            raise RuntimeError(f"Session {self.index} could not start: {self.error}")
+        return self
+
+    def _loop(self):
+        import pythoncom
+
+        # events are delivered on COM threads while Command() blocks
+        pythoncom.CoInitializeEx(pythoncom.COINIT_MULTITHREADED)
+        cv_session = None
+        try:
+            cv_session = cvh.start_session(self.working_dir, self.working_dir + self.lens_file,
+                                           self.setup_commands, debug=self.debug, events=True)
+            self.event_log = cv_session.event_log
+            cv_session.Command(f"SAV {self.snapshot}")
+        except Exception as e:
+            self.error = str(e)
+        self.ready.set()
+
+        while cv_session is not None:
+            job = self.jobs.get()
+            if job is None:
+                break
+            method, argument, reply = job
+            # replies carry the events raised while the job ran
+            start = len(self.event_log)
+            try:
+                if method == "command":
+                    result = ("ok", cv_session.Command(argument))
+                elif method == "evaluate":
+                    result = ("ok", cv_session.EvaluateExpression(argument))
+                elif method == "restore":
+                    cv_session.Command(f"RES {self.snapshot}")
+                    for command in self.setup_commands:
+                        cv_session.Command(command)
+                    result = ("ok", None)
+                else:
+                    result = ("error", f"Unknown method '{method}'")
+            except Exception as e:
+                result = ("error", str(e))
+            reply.put(result + (self.event_log[start:],))
+
+        cvh.stop_session(cv_session)
+        if os.path.exists(self.snapshot + ".len"):
+            os.remove(self.snapshot + ".len")
+        pythoncom.CoUninitialize()
+
+    def call(self, method, argument=None):
+        reply = queue.Queue()
+        self.jobs.put((method, argument, reply))
+        return reply.get()
+
+    def stop(self):
+        self.jobs.put(None)
+        self.thread.join(timeout=30)
+
+
+class SessionServer:
+    """
+    Accepts client connections and leases the warm sessions to them, one
+    client per session at a time. Clients wait until a session is free.
+    """
+
+    def __init__(self, working_dir, lens_file, setup_commands=(), n_sessions=1,
+                 address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, debug=False):
+        self.sessions = [WarmSession(i, working_dir, lens_file, setup_commands, debug) for i in range(n_sessions)]
+        self.lens_file = lens_file
+        self.idle = queue.Queue()
+        self.address = address
+        self.authkey = authkey
+        self.listener = None
+        self.stopping = threading.Event()
+
+    def serve_forever(self):
+        for session in self.sessions:
+            session.start()
+            self.idle.put(session)
+            print(f"Session {session.index} ready")
+
+        self.listener = Listener(self.address, authkey=self.authkey)
+        print(f"Listening on {self.address[0]}:{self.address[1]}")
+        try:
+            while not self.stopping.is_set():
+                try:
+                    connection = self.listener.accept()
+                except OSError:
+                    break
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            self.listener.close()
+            self.shutdown()
+
+    def _handle(self, connection):
+        # one thread per client; the lease lasts until "release" or disconnect
+        session = None
+        try:
+            while True:
+                try:
+                    method, argument = connection.recv()
+                except (EOFError, OSError):
+                    break
+                if method == "acquire":
+                    # the argument is the lens file the client expects, if any
+                    if argument and not same_lens_file(argument, self.lens_file):
+                        connection.send(("error", f"Sessions hold lens '{self.lens_file}', not '{argument}'"))
+                    else:
+                        if session is None:
+                            session = self.idle.get()
+                        connection.send(("ok", session.index))
+                elif method == "release":
+                    if session is not None:
+                        connection.send(self._release(session))
+                        session = None
+                    else:
+                        connection.send(("ok", None))
+                elif method == "status":
+                    connection.send(("ok", {"sessions": len(self.sessions), "idle": self.idle.qsize(),
+                                            "lens_file": self.lens_file}))
+                elif method == "shutdown":
+                    connection.send(("ok", None))
+                    self.stopping.set()
+                    # wake up the accept() of the main loop
+                    Client(self.address, authkey=self.authkey).close()
+                    break
+                elif session is None:
+                    connection.send(("error", "No session acquired"))
+                else:
+                    connection.send(session.call(method, argument))
+        finally:
+            if session is not None:
+                self._release(session)
+            connection.close()
+
+    def _release(self, session):
+        # back to the clean lens before the next client gets the session
+        result = session.call("restore")
+        self.idle.put(session)
+        return result
+
+    def shutdown(self):
+        for session in self.sessions:
+            session.stop()
+
+
+def same_lens_file(a, b):
+    # lens files named with or without directory, extension or case (Windows paths)
+    def name(path):
+        return os.path.splitext(os.path.basename(path.replace("\\", "/")))[0].lower()
+
+    return name(a) == name(b)
+
+
+class RemoteSession:
+    """
+    Client side of a lease. Implements the part of the CODE V COM interface
+    used by the scripts (Command, EvaluateExpression, StopCodeV) and, with
+    events=True, the event_log of a session started with events.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, lens_file=None, events=True):
+        # CodeVHelper only applies its event policy to sessions with a log
+        self.event_log = [] if events else None
+        self.connection = Client(address, authkey=authkey)
+        try:
+            self.session_index = self._request("acquire", lens_file)
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+
+    def _request(self, method, argument=None):
+        self.connection.send((method, argument))
+        status, payload, *events = self.connection.recv()
+        if events and self.event_log is not None:
+            self.event_log.extend(events[0])
+        if status != "ok":
+            raise RuntimeError(f"CODE V daemon: {payload}")
+        return payload
+
+    def Command(self, command):
+        return self._request("command", command)
+
+    def EvaluateExpression(self, expression):
+        return self._request("evaluate", expression)
+
+    def StopCodeV(self):
+        # releases the lease; the daemon keeps CODE V running
+        if self.connection is None:
+            return
+        try:
+            self._request("release")
+        finally:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.StopCodeV()
+
+
+def connect(address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY, lens_file=None, events=True):
+    # lease a warm session from a running daemon, checking its lens when lens_file is given
+    return RemoteSession(address, authkey, lens_file, events)
+
+
+def shutdown(address=DEFAULT_ADDRESS, authkey=DEFAULT_AUTHKEY):
+    connection = Client(address, authkey=authkey)
+    try:
+        connection.send(("shutdown", None))
+        connection.recv()
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keep warm CODE V sessions for scripts and notebooks")
+    parser.add_argument("lens_file", nargs="?", default="system_with_camera")
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--setup", action="append", default=None, help="command run after RES (repeatable)")
+    parser.add_argument("--port", type=int, default=DEFAULT_ADDRESS[1])
+    parser.add_argument("--stop", action="store_true", help="shut down a running daemon")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    address = (DEFAULT_ADDRESS[0], args.port)
+    if args.stop:
+        shutdown(address)
+        print("CODE V daemon stopped.")
+    else:
+        WORKING_DIR = os.getcwd() + "\\"
+        server = SessionServer(WORKING_DIR, args.lens_file, args.setup if args.setup is not None else ["MPP 8"],
+                               n_sessions=args.sessions, address=address, debug=args.debug)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nStopping CODE V sessions...")
@@ -0,0 +1,140 @@
+"""
+Phase patterns for the SLM.
+
+The SLM adds a linear phase (tilt) whose slope the Lohmann lens turns into
+optical power: Params.calculate_tilt gives the tilt for a power, i.e. the
+optical path difference per unit length, so the displayed phase in cycles is
+tilt*x/lambda. Optionally the ramp is rotated (as SLMRotationParameter does in
+the sweeps) and a quadratic lens term is added.
+
+The centred pixel coordinates of a geometry (width, height, pitch) are
+computed once and cached; every frame is then a few in-place float32 passes
+over one preallocated buffer, wrapped to [0, 1) cycle and quantised to uint8
+grey levels (`levels` grey levels per 2 pi).
+
+    generator = PhaseMaskGenerator()
+    frame = generator.generate(power=1.07)           # (1080, 1920) uint8
+    frame = generator.generate(power=0.9, theta=np.deg2rad(2), out=frame)
+
+Usage:
+    python slm_pattern.py 1.07 --out slm_1p07.bmp --benchmark
+"""
+
+import argparse
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from image_io import write_bmp
+from params import Params
+
+
+@lru_cache(maxsize=8)
+def coordinate_bases(width, height, pitch):
+    """
+    Centred x and y coordinates (m) of the SLM pixels as float32 (height,
+    width) arrays and r^2, cached per geometry. The arrays are read-only.
+    """
+    x = ((np.arange(width, dtype=np.float32) - (width - 1)/2)*np.float32(pitch))[None, :]
+    y = ((np.arange(height, dtype=np.float32) - (height - 1)/2)*np.float32(pitch))[:, None]
+    x, y = np.broadcast_arrays(x, y)
+    x = np.ascontiguousarray(x)
+    y = np.ascontiguousarray(y)
+    r2 = x*x + y*y
+    for basis in (x, y, r2):
+        basis.setflags(write=False)
+    return x, y, r2
+
+
+class PhaseMaskGenerator:
+    """
+    Wrapped, quantised phase patterns for the SLM geometry of `params`.
+    """
+
+    def __init__(self, params=None, wavelength=None, levels=256):
+        self.params = params or Params()
+        self.wavelength = wavelength or self.params.lbda
+        self.levels = levels
+        self._buffer = None
+        self._scratch = None
+
+    def bases(self):
+        return coordinate_bases(self.params.slmWidth, self.params.slmHeight, self.params.SLMpitch)
+
+    def _work_buffer(self, shape):
+        if self._buffer is None or self._buffer.shape != shape:
+            self._buffer = np.empty(shape, dtype=np.float32)
+            self._scratch = np.empty(shape, dtype=np.float32)
+        return self._buffer
+
+    def phase_cycles(self, tilt=0.0, theta=0.0, lens_power=0.0, offset=0.0):
+        """
+        Unwrapped phase in cycles (float32, in the internal buffer; copy it to
+        keep it): tilt along the direction theta (rad), a thin lens of
+        lens_power (D) and a constant offset (cycles).
+        """
+        x, y, r2 = self.bases()
+        phase = self._work_buffer(x.shape)
+        kx = np.float32(tilt*np.cos(theta)/self.wavelength)
+        ky = np.float32(tilt*np.sin(theta)/self.wavelength)
+
+        np.multiply(x, kx, out=phase)
+        if ky != 0:
+            phase += y*ky
+        if lens_power:
+            # thin lens: -r^2 P/(2 lambda) cycles
+            phase += r2*np.float32(-lens_power/(2*self.wavelength))
+        if offset:
+            phase += np.float32(offset)
+        return phase
+
+    def quantise(self, phase, out=None):
+        # wrap to [0, 1) cycle and map to grey levels, in place on `phase`
+        # (x - floor(x) is an order of magnitude faster than np.mod)
+        scratch = self._scratch
+        if scratch is None or scratch.shape != phase.shape:
+            scratch = np.empty_like(phase)
+        np.floor(phase, out=scratch)
+        phase -= scratch
+        phase *= np.float32(self.levels)
+        if out is None or out.shape != phase.shape or out.dtype != np.uint8:
+            out = np.empty(phase.shape, dtype=np.uint8)
+        # the cast truncates, so every grey level covers 2 pi/levels of phase
+        np.copyto(out, phase, casting="unsafe")
+        return out
+
+    def generate(self, power=0.0, theta=0.0, lens_power=0.0, offset=0.0, out=None):
+        """
+        uint8 frame for an SLM power (D, converted with Params.calculate_tilt),
+        ramp angle theta (rad) and optional lens term. Pass the previous frame
+        as `out` to reuse its memory.
+        """
+        tilt = self.params.calculate_tilt(power)
+        return self.quantise(self.phase_cycles(tilt, theta, lens_power, offset), out=out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate an SLM phase pattern for an optical power")
+    parser.add_argument("power", type=float, help="SLM optical power (D)")
+    parser.add_argument("--theta", type=float, default=0.0, help="ramp rotation (deg)")
+    parser.add_argument("--levels", type=int, default=256, help="grey levels per 2 pi")
+    parser.add_argument("--out", default=None, help="BMP file for the pattern")
+    parser.add_argument("--benchmark", action="store_true")
+    args = parser.parse_args()
+
+    generator = PhaseMaskGenerator(levels=args.levels)
+    frame = generator.generate(args.power, np.deg2rad(args.theta))
+    print(f"Tilt {generator.params.calculate_tilt(args.power):.3e}, pattern {frame.shape[1]}x{frame.shape[0]}")
+
+    if args.benchmark:
+        n = 50
+        t0 = time.perf_counter()
+        for k in range(n):
+            frame = generator.generate(args.power + 0.01*k, np.deg2rad(args.theta), out=frame)
+        elapsed = (time.perf_counter() - t0)/n
+        print(f"  {elapsed*1000:.1f} ms per frame ({1/elapsed:.0f} fps)")
+
+    if args.out:
+        write_bmp(args.out, frame)
+        print(f"Pattern saved to {args.out}")
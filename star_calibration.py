@@ -2,7 +2,9 @@ import win32com.client
 import os
 import numpy as np
 import time
+from image_io import format_for_filename
 from params import Params
+from telemetry import Telemetry
 
 # ==============================================================================
 # Helper Functions
@@ -10,22 +12,6 @@ from params import Params
 
 params = Params()
 
-def format_for_filename(value: float) -> str:
-    """
-    Formats a float into the specified '{integer}p{decimal}' string format.
-    Example: 12.34 -> "12p34"
-    """
-    if value < 0:
-        sign = "-" # Using 'm' for minus
-        value = abs(value)
-    else:
-        sign = ""
-    
-    integer_part = int(value)
-    # Get the decimal part as a string, remove the "0." part and take the first two digits
-    decimal_part = f"{(value - integer_part):.2f}"[2:]
-    return f"{sign}{integer_part}p{decimal_part}"
-
 def calculate_tilt(optical_power: float) -> float:
     """
     Placeholder function to calculate the tilt value from optical power.
@@ -90,71 +76,73 @@ if __name__ == '__main__':
         print(f"Setting parallel processing {parallel_command}")
         cv_session.Command(parallel_command)
 
-        # --- 3. Main Processing Loop ---
+        # Create the array of optical powers to test for every task
+        step = 0.05
         for task in tasks:
-            distance = task['d']
-            theoretical_power = task['p_t']
+            task['powers'] = np.arange(task['p_t'] - 0.5, task['p_t'] + 0.5 + step, step)
+
+        # progress of the whole job, streamed to a JSONL file
+        with Telemetry(sum(len(task['powers']) for task in tasks),
+                       path=os.path.join(RESULTS_DIR, "telemetry.jsonl"), job="star_calibration") as telemetry:
+            # --- 3. Main Processing Loop ---
+            for task in tasks:
+                distance = task['d']
+                powers = task['powers']
             
-            print(f"\n--- Starting task for distance: {distance} ---")
-
-            # place the object at the specified distance
-            print(f"Setting object distance to {distance*1000} mm...")
-            cv_session.Command(f"THI S0 {distance*1000}") 
-
-            # Create the array of optical powers to test
-            start_power = theoretical_power - 0.5
-            end_power = theoretical_power + 0.5
-            step = 0.05
-            powers = np.arange(start_power, end_power + step, step)
-            for current_power in powers:
-                t0 = time.time()
-                # Calculate the tilt value using the placeholder function
-                tilt = calculate_tilt(current_power)
+                print(f"\n--- Starting task for distance: {distance} ---")
+
+                # place the object at the specified distance
+                print(f"Setting object distance to {distance*1000} mm...")
+                cv_session.Command(f"THI S0 {distance*1000}") 
+
+                for current_power in powers:
+                    t0 = time.time()
+                    # Calculate the tilt value using the placeholder function
+                    tilt = calculate_tilt(current_power)
                 
-                # Format values for the filename
-                dist_str = format_for_filename(distance)
-                current_power_str = format_for_filename(current_power)
+                    # Format values for the filename
+                    dist_str = format_for_filename(distance)
+                    current_power_str = format_for_filename(current_power)
                 
-                # A. Apply the tilt value to the X coefficient of surface S13
-                # Note: This assumes 'X' is a valid coefficient alias for your surface type.
-                sco_command = f"SCO S13 X {tilt:.6f}"
-                print(f"  Setting tilt: {sco_command}")
-                cv_session.Command(sco_command)
-
-                # Apply vignetting
-                vignetting_command = 'run "C:\\CODEV202203_SR1\\macro\\setvig.seq" 1e-07 0.1 100 NO YES ;GO'
-                print(f"  Applying vignetting: {vignetting_command}")
-
-                # B. Construct and run the IMS command block
-                output_file = os.path.join(RESULTS_DIR, f"d_{dist_str}_slm_{current_power_str}")
+                    # A. Apply the tilt value to the X coefficient of surface S13
+                    # Note: This assumes 'X' is a valid coefficient alias for your surface type.
+                    sco_command = f"SCO S13 X {tilt:.6f}"
+                    print(f"  Setting tilt: {sco_command}")
+                    with telemetry.phase("set"):
+                        cv_session.Command(sco_command)
+
+                    # Apply vignetting
+                    vignetting_command = 'run "C:\\CODEV202203_SR1\\macro\\setvig.seq" 1e-07 0.1 100 NO YES ;GO'
+                    print(f"  Applying vignetting: {vignetting_command}")
+
+                    # B. Construct and run the IMS command block
+                    output_file = os.path.join(RESULTS_DIR, f"d_{dist_str}_slm_{current_power_str}")
                 
-                ims_command = f"""
-                IMS;
-                TGR 1024;
-                OBJ "{IMAGE_FILE}";
-                PMX 15;
-                PMY 15;
-                DEX 3.75e-3;
-                DEY 3.75e-3;
-                SVI BMP "{output_file}";
-                GO;
-                """
+                    ims_command = f"""
+                    IMS;
+                    TGR 1024;
+                    OBJ "{IMAGE_FILE}";
+                    PMX 15;
+                    PMY 15;
+                    DEX 3.75e-3;
+                    DEY 3.75e-3;
+                    SVI BMP "{output_file}";
+                    GO;
+                    """
                 
-                print(f"  Running IMS, saving to {output_file}.bmp...")
-                ims_output =cv_session.Command(ims_command)
-
-                       # 2. Print the captured output to your console.
-                print("\n--- CODE V Console Output ---")
-                print(ims_output)
-                print("---------------------------\n")
-
-                elapsed_time = time.time() - t0
-                print(f"  Completed for power {current_power:.2f} in {elapsed_time:.2f} seconds.")
-                remaining_time = elapsed_time * (len(powers) - list(powers).index(current_power) - 1)
-                print(f"  Estimated remaining time for this distance: {remaining_time/60:.2f} minutes.")
-                print("---------------------------\n")
-
-            
+                    print(f"  Running IMS, saving to {output_file}.bmp...")
+                    with telemetry.phase("ims"):
+                        ims_output = cv_session.Command(ims_command)
+
+                           # 2. Print the captured output to your console.
+                    print("\n--- CODE V Console Output ---")
+                    print(ims_output)
+                    print("---------------------------\n")
+
+                    elapsed_time = time.time() - t0
+                    print(f"  Completed for power {current_power:.2f} in {elapsed_time:.2f} seconds.")
+                    telemetry.point_done(distance=distance, power=float(current_power))
+                    print("---------------------------\n")
 
     except Exception as e:
         print(f"An error occurred: {e}")
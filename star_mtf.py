@@ -0,0 +1,170 @@
+"""
+Siemens-star contrast / MTF extraction for the IMS calibration frames.
+
+The star has `n_cycles` black/white periods per revolution, so along a circle
+of radius r (pixels) the intensity is periodic with spatial frequency
+n_cycles/(2*pi*r) cycles/pixel. Each frame is resampled on a polar grid and an
+FFT along the angle gives the modulation of that harmonic at every radius at
+once: contrast = 2|F[n_cycles]|/F[0]. The resampling and the FFT run on whole
+image stacks, and a directory of d_{dist}_slm_{power}.bmp frames is sharded
+across a process pool. The sampled radii depend on the frame size; frames of
+different sizes are resampled onto one common frequency axis.
+
+    result = analyze_directory("calibration_star")
+    result["frequency"]            # cycles/pixel, one per radius
+    result["contrast"]             # (frames, radii)
+    result["distance"], result["power"]
+
+Usage:
+    python star_mtf.py calibration_star --out star_mtf.npz
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from image_io import parse_frame_name, read_bmp, to_gray
+
+
+def polar_grid(shape, n_radii=64, n_angles=1024, r_min=8, r_max=None, center=None):
+    """
+    Sampling radii (pixels) and the (y, x) coordinates of an n_radii x n_angles
+    polar grid centred on the star.
+    """
+    height, width = shape
+    cy, cx = center if center is not None else ((height - 1)/2, (width - 1)/2)
+    if r_max is None:
+        r_max = 0.95*min(cy, cx, height - 1 - cy, width - 1 - cx)
+    radii = np.linspace(r_min, r_max, n_radii)
+    angles = np.arange(n_angles)*2*np.pi/n_angles
+    y = cy + radii[:, None]*np.sin(angles)[None, :]
+    x = cx + radii[:, None]*np.cos(angles)[None, :]
+    return radii, y, x
+
+
+def sample_bilinear(stack, y, x):
+    """
+    Bilinear samples of every image in `stack` (n, H, W) at the coordinates
+    (y, x), returned with shape (n,) + y.shape.
+    """
+    y0 = np.clip(np.floor(y).astype(np.intp), 0, stack.shape[1] - 2)
+    x0 = np.clip(np.floor(x).astype(np.intp), 0, stack.shape[2] - 2)
+    wy = (y - y0).astype(np.float32)
+    wx = (x - x0).astype(np.float32)
+    top = stack[:, y0, x0]*(1 - wx) + stack[:, y0, x0 + 1]*wx
+    bottom = stack[:, y0 + 1, x0]*(1 - wx) + stack[:, y0 + 1, x0 + 1]*wx
+    return top*(1 - wy) + bottom*wy
+
+
+def star_contrast(stack, n_cycles=60, n_radii=64, n_angles=1024, center=None):
+    """
+    Contrast of the star fundamental vs radius for a stack of greyscale frames
+    (n, H, W). Returns (frequency in cycles/pixel, contrast of shape (n, n_radii)).
+    """
+    stack = np.asarray(stack, dtype=np.float32)
+    if stack.ndim == 2:
+        stack = stack[None]
+    # start where the star frequency drops to Nyquist (0.5 cycles/pixel)
+    radii, y, x = polar_grid(stack.shape[1:], n_radii, n_angles, r_min=n_cycles/np.pi, center=center)
+    rings = sample_bilinear(stack, y, x)
+    spectrum = np.abs(np.fft.rfft(rings, axis=-1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        contrast = 2*spectrum[..., n_cycles]/spectrum[..., 0]
+    frequency = n_cycles/(2*np.pi*radii)
+    return frequency, contrast
+
+
+def _analyze_shard(paths, n_cycles, n_radii, n_angles):
+    # worker: load one shard of frames and score it as a single stack; returns
+    # the frequency axis of every frame (n, n_radii) with the contrast
+    frames = [to_gray(read_bmp(path)) for path in paths]
+    shapes = {frame.shape for frame in frames}
+    if len(shapes) == 1:
+        frequency, contrast = star_contrast(np.stack(frames), n_cycles, n_radii, n_angles)
+        return np.tile(frequency, (len(frames), 1)), contrast
+    results = [star_contrast(frame, n_cycles, n_radii, n_angles) for frame in frames]
+    return np.stack([r[0] for r in results]), np.concatenate([r[1] for r in results])
+
+
+def common_frequency_axis(frequency, contrast):
+    """
+    One frequency axis for frames scored on different radii: (frequency,
+    contrast) of shape (n, n_radii) each. Frames that share an axis are
+    returned as they are; otherwise every frame is interpolated onto
+    n_radii frequencies spanning the range all of them cover.
+    """
+    if np.allclose(frequency, frequency[0]):
+        return frequency[0], contrast
+    # the frequency falls with the radius, np.interp needs it rising
+    high, low = frequency[:, 0].min(), frequency[:, -1].max()
+    axis = np.linspace(high, low, frequency.shape[1])
+    resampled = np.array([np.interp(axis, f[::-1], c[::-1]) for f, c in zip(frequency, contrast)])
+    return axis, resampled
+
+
+def analyze_directory(directory, n_cycles=60, n_radii=64, n_angles=1024, workers=None, shard_size=16):
+    """
+    Scores every star frame of a calibration directory (white/black frames are
+    skipped). Frames are sorted by distance and power and sharded across a
+    process pool.
+    """
+    frames = []
+    for filename in os.listdir(directory):
+        parsed = parse_frame_name(filename)
+        if parsed is not None and parsed[2] is None:
+            frames.append((parsed[0], parsed[1], os.path.join(directory, filename)))
+    frames.sort()
+    if not frames:
+        raise ValueError(f"No calibration frames found in {directory}")
+
+    paths = [f[2] for f in frames]
+    shards = [paths[i:i + shard_size] for i in range(0, len(paths), shard_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_analyze_shard, shards, [n_cycles]*len(shards),
+                                [n_radii]*len(shards), [n_angles]*len(shards)))
+
+    frequency, contrast = common_frequency_axis(np.concatenate([r[0] for r in results]),
+                                                np.concatenate([r[1] for r in results]))
+    return {
+        "distance": np.array([f[0] for f in frames]),
+        "power": np.array([f[1] for f in frames]),
+        "frequency": frequency,
+        "contrast": contrast,
+        "files": np.array([os.path.basename(p) for p in paths]),
+    }
+
+
+def best_power_by_contrast(result, max_frequency=None):
+    """
+    For every distance, the power whose mean contrast (up to max_frequency
+    cycles/pixel) is highest. Returns {distance: power}.
+    """
+    keep = np.ones(len(result["frequency"]), dtype=bool)
+    if max_frequency is not None:
+        keep = result["frequency"] <= max_frequency
+    score = np.nanmean(result["contrast"][:, keep], axis=1)
+    best = {}
+    for distance in np.unique(result["distance"]):
+        selected = np.flatnonzero(result["distance"] == distance)
+        best[float(distance)] = float(result["power"][selected[np.nanargmax(score[selected])]])
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Siemens star contrast vs spatial frequency")
+    parser.add_argument("directory")
+    parser.add_argument("--out", default=None, help="NPZ file for the results")
+    parser.add_argument("--cycles", type=int, default=60, help="star periods per revolution")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    result = analyze_directory(args.directory, n_cycles=args.cycles, workers=args.workers)
+    print(f"Scored {len(result['files'])} frames")
+    for distance, power in best_power_by_contrast(result).items():
+        print(f"  d = {distance} m: highest contrast at {power:.2f} D")
+
+    if args.out:
+        np.savez(args.out, **result)
+        print(f"Results saved to {args.out}")
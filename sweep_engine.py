@@ -0,0 +1,1072 @@
+"""
+Declarative sweep engine shared by the sensitivity and power-vs-distance scripts.
+
+All of those scripts repeat the same loop: connect, RES the lens, query the
+baselines, perturb, apply vignetting, AUT, read the tilt, convert it with
+tilt2power and save. Here the loop lives in one place and a sweep is described
+by a JSON or TOML spec instead of code:
+
+    {
+        "name": "each_lens",
+        "lens_file": "system_with_camera",
+        "setup": ["MPP 8"],
+        "parameters": {
+            "distance": {"type": "thi", "surface": "S0", "absolute": true, "scale": 1000},
+            "S3": {"type": "thi", "surface": "S3", "scale": 1000},
+            "lohmann": {"type": "lohmann_translation", "scale": 1000}
+        },
+        "axes": [
+            {"name": "target", "select": ["S3", "lohmann"]},
+            {"name": "distance", "parameter": "distance", "values": [0.5, 0.6]},
+            {"name": "epsilon", "parameter": "@target", "linspace": [-3e-3, 3e-3, 15]}
+        ],
+        "readouts": {
+            "power": {"type": "tilt_power", "surface": "S13", "coeff": "C2"},
+            "rms_spot": {"type": "spot", "field": 1, "metric": "rms_radius", "n": 9}
+        },
+        "executor": {"type": "serial"}
+    }
+
+Axes are expanded as a product, the first axis being the outermost loop. A
+"select" axis chooses which parameter an "@name" axis perturbs; parameters that
+are not assigned by a point go back to their baseline. A "design" axis (see
+doe.py) sets several parameters per run from a Latin hypercube, Sobol or
+fractional factorial design. Relative parameters are
+offsets from the baseline queried when the session opens, absolute ones are set
+directly. Only the parameters that change between two consecutive points are
+sent to CODE V.
+
+With the "zoom" executor ({"type": "zoom", "axis": "distance"}) the distance
+axis becomes the positions of a CODE V multi-configuration system instead of a
+loop, so one vignetting + AUT run covers every distance of a point group.
+
+The "resilient" executor runs the points in supervised worker processes:
+failed points are retried with backoff, hung or crashed sessions are restarted
+after "timeout" seconds, and points that keep failing are written to a
+quarantine report instead of ending the run.
+
+With "events": {"error": "abort", "warning": "flag"} the sessions subscribe to
+the CODE V error / warning events. An aborting event raises for the point
+(the resilient executor then retries or quarantines it), "retry" re-sends the
+command, and flagged events are stored in the record's "flags".
+
+With "session": "daemon" every session is a lease from a running
+session_daemon (on "daemon_port", default 6010) instead of a new CODE V
+process; the daemon must hold the spec's lens file.
+
+With "rollback": true the lens is saved once after the baselines are queried
+and restored (one RES) before every point, so each point starts from the same
+state instead of the one AUT left behind by the previous point.
+
+Results are streamed: run_sweep is a generator that yields one record per point
+as soon as it is produced, and a JsonlSink can write them to disk on the fly.
+
+Usage:
+    python sweep_engine.py sweeps/each_lens.json --out results.jsonl --plot-dir plots
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import re
+import time
+import uuid
+
+import numpy as np
+
+import codev_helper as cvh
+from params import Params
+from spot_analysis import trace_spots
+# re-exported: se.distance_axis / se.TIMING_PHASES
+from sweep_schema import TIMING_PHASES, distance_axis
+
+params = Params()
+
+
+# ==============================================================================
+# Spec loading
+# ==============================================================================
+
+def load_spec(path):
+    """
+    Loads a sweep spec from a .json or .toml file.
+    """
+    if path.endswith(".toml"):
+        import tomllib
+
+        with open(path, "rb") as f:
+            spec = tomllib.load(f)
+    else:
+        with open(path, "r") as f:
+            spec = json.load(f)
+
+    validate_spec(spec)
+    return spec
+
+
+def validate_spec(spec):
+    for key in ["lens_file", "parameters", "axes", "readouts"]:
+        if key not in spec:
+            raise ValueError(f"Sweep spec is missing '{key}'")
+
+    for name, definition in spec["parameters"].items():
+        if definition.get("type") not in PARAMETER_TYPES:
+            raise ValueError(f"Parameter '{name}' has unknown type '{definition.get('type')}'")
+
+    for name, definition in spec["readouts"].items():
+        if definition.get("type") not in READOUT_TYPES:
+            raise ValueError(f"Readout '{name}' has unknown type '{definition.get('type')}'")
+
+    axis_names = [axis["name"] for axis in spec["axes"]]
+    for axis in spec["axes"]:
+        if "design" in axis:
+            from doe import DESIGN_METHODS
+
+            if axis["design"].get("method", "lhs") not in DESIGN_METHODS:
+                raise ValueError(f"Axis '{axis['name']}' has unknown design '{axis['design'].get('method')}'")
+            for name in axis["design"].get("factors", {}):
+                if name not in spec["parameters"]:
+                    raise ValueError(f"Axis '{axis['name']}' varies unknown parameter '{name}'")
+            continue
+        if "select" in axis:
+            for name in axis["select"]:
+                if name not in spec["parameters"]:
+                    raise ValueError(f"Axis '{axis['name']}' selects unknown parameter '{name}'")
+            continue
+        target = axis.get("parameter")
+        if target is None:
+            raise ValueError(f"Axis '{axis['name']}' needs a 'parameter' or 'select'")
+        if target.startswith("@"):
+            if target[1:] not in axis_names:
+                raise ValueError(f"Axis '{axis['name']}' refers to unknown axis '{target}'")
+        elif target not in spec["parameters"]:
+            raise ValueError(f"Axis '{axis['name']}' sets unknown parameter '{target}'")
+
+    for kind, action in (spec.get("events") or {}).items():
+        if kind != "retries" and action not in EVENT_ACTIONS:
+            raise ValueError(f"Unknown action '{action}' for CODE V {kind} events")
+
+    executor = spec.get("executor", {}).get("type", "serial")
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor '{executor}'")
+    session = spec.get("session", "codev")
+    if isinstance(session, str):
+        if session not in SESSION_TYPES:
+            raise ValueError(f"Unknown session type '{session}'")
+        if session == "daemon" and executor == "resilient":
+            # a hung lease cannot be killed without killing the daemon's CODE V
+            raise ValueError("The resilient executor cannot use daemon sessions")
+    elif executor in ("pool", "resilient"):
+        raise ValueError(f"The {executor} executor opens a session per worker and cannot use an open session")
+    if executor in ("macro", "zoom"):
+        for name, definition in spec["readouts"].items():
+            if definition["type"] == "spot":
+                raise ValueError(f"Readout '{name}' cannot run with the {executor} executor")
+    if executor == "zoom":
+        axis_name = spec["executor"].get("axis")
+        axis = next((axis for axis in spec["axes"] if axis["name"] == axis_name), None)
+        if axis is None:
+            raise ValueError(f"Zoom executor needs the name of the distance axis, got '{axis_name}'")
+        definition = spec["parameters"].get(axis.get("parameter"), {})
+        if definition.get("type") != "thi" or definition.get("surface") != "S0" or not definition.get("absolute"):
+            raise ValueError(f"Zoom axis '{axis_name}' must set the absolute S0 thickness")
+
+
+EVENT_ACTIONS = ["abort", "retry", "flag", "ignore"]
+SESSION_TYPES = ["codev", "daemon"]
+
+
+def axis_values(axis):
+    # explicit values, np.linspace or np.arange, always returned as plain floats
+    if "design" in axis:
+        # one {parameter: value} dict per run of the design
+        from doe import design_rows
+
+        return design_rows(axis["design"])
+    if "select" in axis:
+        return list(axis["select"])
+    if "values" in axis:
+        return [float(v) for v in axis["values"]]
+    if "linspace" in axis:
+        start, stop, num = axis["linspace"]
+        return [float(v) for v in np.linspace(start, stop, int(num))]
+    if "arange" in axis:
+        start, stop, step = axis["arange"]
+        return [float(v) for v in np.arange(start, stop, step)]
+    raise ValueError(f"Axis '{axis['name']}' has no values")
+
+
+def expand_points(spec):
+    """
+    Expands the axes into the ordered list of sweep points. Each point is a dict
+    with the axis coordinates and the parameter assignments in spec units.
+    """
+    axes = spec["axes"]
+    points = []
+    values = [axis_values(axis) for axis in axes]
+    # design axes are indexed by run, their rows assign several parameters at once
+    values = [list(enumerate(v)) if "design" in axis else v for axis, v in zip(axes, values)]
+    for index, combination in enumerate(itertools.product(*values)):
+        coords = {axis["name"]: value for axis, value in zip(axes, combination)}
+        assignments = {}
+        for axis, value in zip(axes, combination):
+            if "design" in axis:
+                run, row = value
+                coords[axis["name"]] = run
+                coords.update(row)
+                assignments.update(row)
+                continue
+            if "select" in axis:
+                continue
+            target = axis["parameter"]
+            if target.startswith("@"):
+                target = coords[target[1:]]
+            assignments[target] = value
+        points.append({"index": index, "coords": coords, "assignments": assignments})
+    return points
+
+
+# ==============================================================================
+# Parameters
+# ==============================================================================
+
+class Parameter:
+    """
+    A perturbable lens parameter. Values are stored in CODE V units; the spec
+    value is multiplied by "scale" and, unless "absolute" is set, added to the
+    baseline.
+    """
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.definition = definition
+        self.scale = definition.get("scale", 1)
+        self.absolute = definition.get("absolute", False)
+        self.baseline = 0
+
+    def query_baseline(self, helper):
+        return 0
+
+    def target(self, value):
+        if value is None:
+            return self.baseline
+        if self.absolute:
+            return value*self.scale
+        return self.baseline + value*self.scale
+
+    def commands(self, cv_value):
+        raise NotImplementedError
+
+
+class ThicknessParameter(Parameter):
+
+    def query_baseline(self, helper):
+        if self.definition.get("compensate"):
+            self.compensate_baseline = helper.query_surf_thickness(self.definition["compensate"])
+        return helper.query_surf_thickness(self.definition["surface"])
+
+    def commands(self, cv_value):
+        commands = [f"THI {self.definition['surface']} {cv_value}"]
+        # some gaps must be compensated by the opposite change on another surface
+        compensate = self.definition.get("compensate")
+        if compensate:
+            delta = cv_value - self.baseline
+            commands.append(f"THI {compensate} {self.compensate_baseline - delta}")
+        return commands
+
+
+class CoefficientParameter(Parameter):
+
+    def query_baseline(self, helper):
+        return helper.query_xypolynomial_coeff(self.definition["surface"], self.definition["coeff"])
+
+    def commands(self, cv_value):
+        return [f"SCO {self.definition['surface']} {self.definition['coeff']} {cv_value}"]
+
+
+class LohmannTranslationParameter(Parameter):
+
+    def commands(self, cv_value):
+        return cvh.translate_lohmann_commands(cv_value, self.definition.get("surfaces", cvh.LOHMANN_SURFACES))
+
+
+class LohmannRotationParameter(Parameter):
+    # values in degrees
+
+    def commands(self, cv_value):
+        return cvh.rotate_lohmann_commands(self.definition.get("surface", "S9"), np.deg2rad(cv_value),
+                                           self.definition.get("c0", cvh.LOHMANN_C0))
+
+
+class SLMRotationParameter(Parameter):
+    # values in degrees
+
+    def commands(self, cv_value):
+        return cvh.rotate_SLM_commands(self.definition.get("surface", "S14"), np.deg2rad(cv_value))
+
+
+PARAMETER_TYPES = {
+    "thi": ThicknessParameter,
+    "coefficient": CoefficientParameter,
+    "lohmann_translation": LohmannTranslationParameter,
+    "lohmann_rotation": LohmannRotationParameter,
+    "slm_rotation": SLMRotationParameter,
+}
+
+
+def build_parameters(spec):
+    return {name: PARAMETER_TYPES[definition["type"]](name, definition)
+            for name, definition in spec["parameters"].items()}
+
+
+# ==============================================================================
+# Readouts
+# ==============================================================================
+
+def readout_expression(definition, zoom=None):
+    # the database item behind each readout, also used by the macro and zoom executors
+    kind = definition["type"]
+    if kind in ("tilt_power", "coefficient"):
+        expression = f"(SCO {definition['surface']} {definition['coeff']})"
+    elif kind == "thickness":
+        expression = f"(THI {definition['surface']})"
+    else:
+        expression = None
+    if expression is not None:
+        return expression if zoom is None else cvh.zoom_expression(expression, zoom)
+    if kind == "spot":
+        raise ValueError("Spot readouts need a ray trace and cannot run in a macro")
+    return definition["expression"]
+
+
+def convert_readout(definition, value):
+    if value is None:
+        return None
+    if definition["type"] == "tilt_power":
+        return params.tilt2power(value)
+    return value
+
+
+def read_readout(helper, definition):
+    kind = definition["type"]
+    if kind in ("tilt_power", "coefficient"):
+        value = helper.query_xypolynomial_coeff(definition["surface"], definition["coeff"])
+    elif kind == "thickness":
+        value = helper.query_surf_thickness(definition["surface"])
+    elif kind == "spot":
+        # metric of a pupil grid traced at the current object distance
+        metrics = trace_spots(helper, [definition.get("field", 1)], None, n=definition.get("n", 9))
+        value = float(metrics[definition.get("metric", "rms_radius")][0, 0])
+    else:
+        value = helper.evaluate(definition["expression"])
+    return convert_readout(definition, value)
+
+
+READOUT_TYPES = ["tilt_power", "coefficient", "thickness", "expression", "spot"]
+
+
+# ==============================================================================
+# Point runner
+# ==============================================================================
+
+def spec_working_dir(spec):
+    return spec.get("working_dir") or os.getcwd() + "\\"
+
+
+def open_spec_session(spec, debug=False):
+    """
+    Opens the CODE V session of a spec. "session" may also hold a session
+    that is already open (e.g. the pre-flight's); the executors then use it
+    and leave it open. With "session": "daemon" the session is a lease from
+    session_daemon, which must hold the spec's lens file.
+    """
+    session = spec.get("session", "codev")
+    if not isinstance(session, str):
+        return session
+    if session == "daemon":
+        import session_daemon
+
+        address = (session_daemon.DEFAULT_ADDRESS[0], spec.get("daemon_port", session_daemon.DEFAULT_ADDRESS[1]))
+        return session_daemon.connect(address, lens_file=spec["lens_file"], events="events" in spec)
+    working_dir = spec_working_dir(spec)
+    return cvh.start_session(working_dir, working_dir + spec["lens_file"], spec.get("setup", []), debug=debug,
+                             events="events" in spec)
+
+
+def close_spec_session(spec, cv_session):
+    # stops the sessions open_spec_session started, not the ones passed in
+    if cv_session is not spec.get("session"):
+        cvh.stop_session(cv_session)
+
+
+def make_helper(spec, cv_session, debug=False):
+    # "events" holds the event policy, e.g. {"error": "abort", "warning": "flag"}
+    events = dict(spec.get("events") or {})
+    retries = events.pop("retries", 1)
+    return cvh.CodeVHelper(cv_session, debug=debug, event_policy=events, retries=retries)
+
+
+class SweepRunner:
+    """
+    Runs sweep points on one CODE V session, keeping track of the current value
+    of every parameter so that only the changed ones are sent.
+    """
+
+    def __init__(self, spec, helper):
+        self.spec = spec
+        self.helper = helper
+        self.parameters = build_parameters(spec)
+        self.optimization = spec.get("optimization", cvh.OPTIMIZATION_COMMAND)
+        self.vignetting = spec.get("vignetting", True)
+        self.rollback = spec.get("rollback", False)
+        self.snapshot = None
+        self.current = {}
+
+    def query_baselines(self):
+        for parameter in self.parameters.values():
+            parameter.baseline = parameter.query_baseline(self.helper)
+            self.current[parameter.name] = parameter.baseline
+        if self.rollback:
+            # every point starts from this exact lens, including what AUT changed
+            self.snapshot = self.helper.snapshot()
+
+    def reset_current(self):
+        # after a rollback every parameter is back at its baseline
+        self.current = {name: parameter.baseline for name, parameter in self.parameters.items()}
+
+    def reset_commands(self):
+        # rollback as a command line, for the macro executor
+        if self.snapshot is None:
+            return []
+        self.reset_current()
+        return [f"RES {self.snapshot.path}"]
+
+    def close(self):
+        if self.snapshot is not None:
+            self.snapshot.discard()
+
+    def point_commands(self, point):
+        # commands needed to move from the current state to this point
+        commands = []
+        for name, parameter in self.parameters.items():
+            target = parameter.target(point["assignments"].get(name))
+            if self.current.get(name) != target:
+                commands.extend(parameter.commands(target))
+                self.current[name] = target
+        return commands
+
+    def apply_point(self, point):
+        # set the parameters of the point, vignette and optimize; returns the timing
+        timing = {}
+        # flags raised before this point belong to the previous one
+        self.helper.take_flags()
+
+        if self.snapshot is not None:
+            t0 = time.perf_counter()
+            self.snapshot.restore()
+            self.reset_current()
+            timing["restore"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        commands = self.point_commands(point)
+        if commands:
+            # one round trip for all the parameter changes of the point
+            self.helper.command("; ".join(commands))
+        timing["set"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        if self.vignetting:
+            self.helper.apply_vignetting()
+        timing["vignette"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        if self.optimization:
+            self.helper.optimize(self.optimization)
+        timing["optimize"] = time.perf_counter() - t0
+        return timing
+
+    def run_point(self, point):
+        timing = self.apply_point(point)
+
+        t0 = time.perf_counter()
+        readouts = {name: read_readout(self.helper, definition)
+                    for name, definition in self.spec["readouts"].items()}
+        timing["readout"] = time.perf_counter() - t0
+
+        return make_record(self.spec, point, readouts, timing, self.helper.take_flags())
+
+
+def make_record(spec, point, readouts, timing, flags=None):
+    record = {
+        "run_id": spec["run_id"],
+        "lens_file": spec["lens_file"],
+        "index": point["index"],
+    }
+    record.update(point["coords"])
+    record.update(readouts)
+    record["timing"] = timing
+    if flags:
+        # CODE V warnings (or other flagged events) raised while computing the point
+        record["flags"] = flags
+    return record
+
+
+# ==============================================================================
+# Executors
+# ==============================================================================
+
+def run_serial(spec, points, debug=False):
+    cv_session = runner = None
+    try:
+        cv_session = open_spec_session(spec, debug=debug)
+        runner = SweepRunner(spec, make_helper(spec, cv_session, debug))
+        runner.query_baselines()
+        for point in points:
+            yield runner.run_point(point)
+    finally:
+        if runner is not None:
+            runner.close()
+        close_spec_session(spec, cv_session)
+
+
+def _pool_worker(spec, tasks, results, debug):
+    # each worker owns its own CODE V session (and license)
+    cv_session = runner = None
+    try:
+        cv_session = open_spec_session(spec, debug=debug)
+        runner = SweepRunner(spec, make_helper(spec, cv_session, debug))
+        runner.query_baselines()
+        while True:
+            point = tasks.get()
+            if point is None:
+                break
+            try:
+                results.put(("ok", runner.run_point(point)))
+            except Exception as e:
+                results.put(("error", f"point {point['index']}: {e}"))
+    except Exception as e:
+        results.put(("fatal", str(e)))
+    finally:
+        if runner is not None:
+            runner.close()
+        close_spec_session(spec, cv_session)
+
+
+def run_pool(spec, points, debug=False):
+    n_workers = spec.get("executor", {}).get("workers", 2)
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for point in points:
+        tasks.put(point)
+    for _ in range(n_workers):
+        tasks.put(None)
+
+    workers = [multiprocessing.Process(target=_pool_worker, args=(spec, tasks, results, debug))
+               for _ in range(n_workers)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        received = 0
+        alive = n_workers
+        while received < len(points):
+            status, payload = results.get()
+            if status == "fatal":
+                # a worker could not start; the others keep consuming the queue
+                print(f"Sweep worker failed: {payload}")
+                alive -= 1
+                if alive == 0:
+                    raise RuntimeError("All sweep workers failed")
+                continue
+            if status == "error":
+                raise RuntimeError(payload)
+            received += 1
+            yield payload
+    finally:
+        for worker in workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+
+def _resilient_worker(spec, connection, debug):
+    # one session per worker process; a failed point leaves the lens state unknown
+    cv_session = runner = None
+    try:
+        # workers start one at a time, so the new CODE V processes are this session's
+        before = cvh.codev_process_ids()
+        cv_session = open_spec_session(spec, debug=debug)
+        codev_pids = sorted(cvh.codev_process_ids() - before)
+        runner = SweepRunner(spec, make_helper(spec, cv_session, debug))
+        runner.query_baselines()
+        connection.send(("ready", codev_pids))
+        while True:
+            point = connection.recv()
+            if point is None:
+                break
+            try:
+                connection.send(("ok", runner.run_point(point)))
+            except Exception as e:
+                # resend every parameter with the next point
+                runner.current = {}
+                connection.send(("error", f"{type(e).__name__}: {e}"))
+    except Exception as e:
+        connection.send(("fatal", str(e)))
+    finally:
+        if runner is not None:
+            runner.close()
+        close_spec_session(spec, cv_session)
+
+
+class ResilientWorker:
+    """
+    Worker process of the resilient executor, driven over a pipe so the
+    supervisor can time out and kill it, together with its CODE V process.
+    """
+
+    def __init__(self, spec, debug):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_resilient_worker, args=(spec, child, debug), daemon=True)
+        self.codev_pids = []
+        self.task = None
+        self.deadline = None
+
+    def start(self, timeout):
+        """
+        Starts the worker and waits for its session. Returns None when it is
+        ready, otherwise the reason it is not (the worker is then killed).
+        """
+        before = cvh.codev_process_ids()
+        self.process.start()
+        if not self.connection.poll(timeout):
+            # a session hung in start-up has not reported its process yet
+            self.codev_pids = sorted(cvh.codev_process_ids() - before)
+            return f"no session after {timeout} s"
+        try:
+            status, payload = self.connection.recv()
+        except EOFError:
+            status, payload = "fatal", "worker exited during start-up"
+        if status != "ready":
+            return payload
+        self.codev_pids = payload
+        return None
+
+    def submit(self, task, timeout):
+        self.task = task
+        self.deadline = time.monotonic() + timeout
+        self.connection.send(task["point"])
+
+    def stop(self):
+        # returns the CODE V processes that could not be killed, see kill()
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=10)
+        if self.process.is_alive():
+            return self.kill()
+        return []
+
+    def kill(self):
+        """
+        Terminates the worker and its CODE V process, which would otherwise
+        keep running and hold a license. Returns the ids of the CODE V
+        processes that are still alive.
+        """
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+        self.connection.close()
+        return [pid for pid in self.codev_pids if not cvh.kill_process(pid)]
+
+
+def write_quarantine_report(spec, quarantine):
+    path = spec.get("executor", {}).get("quarantine_file") \
+        or os.path.join(spec_working_dir(spec), f"quarantine_{spec['run_id']}.json")
+    with open(path, "w") as f:
+        json.dump({"run_id": spec["run_id"], "lens_file": spec["lens_file"], "points": quarantine}, f, indent=2)
+    return path
+
+
+def run_resilient(spec, points, debug=False):
+    """
+    Runs every point in a supervised worker process. A point that raises is
+    retried with exponential backoff (capped at "max_backoff" seconds); a point
+    that takes longer than "timeout" seconds or kills its worker gets the
+    worker restarted, i.e. a fresh CODE V session that re-applies the lens
+    state of the next point from the baselines. Points still failing after
+    "max_attempts" are quarantined into a JSON report and the sweep goes on.
+    The CODE V process of a restarted worker is killed with it; if it cannot
+    be killed the run stops instead of taking another license.
+    """
+    options = spec.get("executor", {})
+    n_workers = options.get("workers", 1)
+    timeout = options.get("timeout", 900)
+    startup_timeout = options.get("startup_timeout", 300)
+    max_attempts = options.get("max_attempts", 3)
+    backoff = options.get("backoff", 5)
+    max_backoff = options.get("max_backoff", 120)
+    max_restarts = options.get("max_restarts", 10)
+
+    pending = [{"point": point, "attempt": 1, "not_before": 0, "errors": []} for point in points]
+    pending.reverse()
+    idle, busy = [], []
+    quarantine = []
+    restarts = 0
+
+    def kill(worker):
+        survivors = worker.kill()
+        if survivors:
+            raise RuntimeError(f"Could not kill CODE V process {', '.join(map(str, survivors))} of a failed "
+                               f"worker; stopping instead of starting another session")
+
+    def fail(task, reason):
+        task["errors"].append(reason)
+        print(f"Point {task['point']['index']} failed (attempt {task['attempt']}): {reason}")
+        if task["attempt"] >= max_attempts:
+            quarantine.append({"index": task["point"]["index"], "coords": task["point"]["coords"],
+                               "errors": task["errors"]})
+            return
+        delay = min(backoff*2**(task["attempt"] - 1), max_backoff)
+        task["attempt"] += 1
+        task["not_before"] = time.monotonic() + delay
+        pending.insert(0, task)
+
+    try:
+        while pending or busy:
+            # keep the pool full
+            while len(idle) + len(busy) < n_workers:
+                worker = ResilientWorker(spec, debug)
+                error = worker.start(startup_timeout)
+                if error is None:
+                    idle.append(worker)
+                    continue
+                kill(worker)
+                restarts += 1
+                print(f"Sweep worker could not start: {error}")
+                if restarts > max_restarts:
+                    raise RuntimeError(f"Gave up after {restarts} worker restarts")
+                time.sleep(min(backoff*2**(restarts - 1), max_backoff))
+
+            now = time.monotonic()
+            while idle and pending:
+                ready = [task for task in reversed(pending) if task["not_before"] <= now]
+                if not ready:
+                    break
+                pending.remove(ready[0])
+                worker = idle.pop()
+                worker.submit(ready[0], timeout)
+                busy.append(worker)
+
+            waits = [worker.deadline - now for worker in busy]
+            if idle:
+                waits += [task["not_before"] - now for task in pending]
+            wait = max(min(waits), 0) if waits else 0
+            if not busy:
+                time.sleep(wait)
+                continue
+            ready_connections = multiprocessing.connection.wait([w.connection for w in busy], timeout=wait)
+
+            now = time.monotonic()
+            for worker in list(busy):
+                if worker.connection in ready_connections:
+                    try:
+                        status, payload = worker.connection.recv()
+                    except EOFError:
+                        status, payload = "crash", "worker process died"
+                elif worker.deadline <= now:
+                    status, payload = "crash", f"timed out after {timeout} s"
+                else:
+                    continue
+
+                busy.remove(worker)
+                task, worker.task = worker.task, None
+                if status == "ok":
+                    idle.append(worker)
+                    yield payload
+                elif status == "error":
+                    idle.append(worker)
+                    fail(task, payload)
+                else:
+                    # hung or crashed CODE V: replace the worker and its session
+                    kill(worker)
+                    restarts += 1
+                    if restarts > max_restarts:
+                        raise RuntimeError(f"Gave up after {restarts} worker restarts")
+                    fail(task, payload)
+    finally:
+        survivors = [pid for worker in idle for pid in worker.stop()]
+        survivors += [pid for worker in busy for pid in worker.kill()]
+        if survivors:
+            print(f"CODE V processes still running after the sweep: {', '.join(map(str, survivors))}")
+        if quarantine:
+            path = write_quarantine_report(spec, quarantine)
+            print(f"{len(quarantine)} points quarantined, see {path}")
+
+
+MACRO_TAG = "@@PT"
+
+
+def macro_lines(spec, runner, point):
+    # commands for one point, followed by a tagged WRI per readout
+    lines = runner.reset_commands() + runner.point_commands(point)
+    if runner.vignetting:
+        lines.append(cvh.VIGNETTING_COMMAND)
+    if runner.optimization:
+        lines.append(runner.optimization)
+    for j, definition in enumerate(spec["readouts"].values()):
+        lines.append(f'WRI "{MACRO_TAG} {point["index"]} {j} " {readout_expression(definition)}')
+    return lines
+
+
+def parse_macro_output(output):
+    # returns {(point index, readout index): value}
+    values = {}
+    for match in re.finditer(rf"{MACRO_TAG}\s+(\d+)\s+(\d+)\s+(\S+)", output or ""):
+        try:
+            values[(int(match.group(1)), int(match.group(2)))] = float(match.group(3))
+        except ValueError:
+            values[(int(match.group(1)), int(match.group(2)))] = None
+    return values
+
+
+def run_macro(spec, points, debug=False):
+    """
+    Writes the points as CODE V sequence files of "chunk_size" points each and
+    runs every chunk with a single command, so there is one COM round trip per
+    chunk instead of several per point.
+    """
+    chunk_size = spec.get("executor", {}).get("chunk_size", 10)
+    working_dir = spec_working_dir(spec)
+    readouts = list(spec["readouts"].items())
+
+    cv_session = runner = None
+    try:
+        cv_session = open_spec_session(spec, debug=debug)
+        helper = make_helper(spec, cv_session, debug)
+        runner = SweepRunner(spec, helper)
+        runner.query_baselines()
+
+        for start in range(0, len(points), chunk_size):
+            chunk = points[start:start + chunk_size]
+            lines = []
+            for point in chunk:
+                lines.extend(macro_lines(spec, runner, point))
+
+            macro_file = os.path.join(working_dir, f"sweep_{spec['run_id']}_{start}.seq")
+            with open(macro_file, "w") as f:
+                f.write("\n".join(lines) + "\n")
+
+            t0 = time.perf_counter()
+            output = helper.command(f'run "{macro_file}"')
+            elapsed = (time.perf_counter() - t0)/len(chunk)
+            os.remove(macro_file)
+
+            values = parse_macro_output(output)
+            for point in chunk:
+                point_readouts = {name: convert_readout(definition, values.get((point["index"], j)))
+                                  for j, (name, definition) in enumerate(readouts)}
+                yield make_record(spec, point, point_readouts, {"macro": elapsed})
+    finally:
+        if runner is not None:
+            runner.close()
+        close_spec_session(spec, cv_session)
+
+
+def zoom_key(point, axis_name):
+    return tuple((name, value) for name, value in point["coords"].items() if name != axis_name)
+
+
+def zoom_groups(points, axis_name):
+    # points that only differ in the zoom axis, in order of first appearance
+    groups = {}
+    for point in points:
+        groups.setdefault(zoom_key(point, axis_name), []).append(point)
+    return list(groups.values())
+
+
+def consecutive_zoom_groups(points, axis_name):
+    # same for a stream of points, whose groups must be contiguous
+    group = []
+    for point in points:
+        if group and zoom_key(point, axis_name) != zoom_key(group[0], axis_name):
+            yield group
+            group = []
+        group.append(point)
+    if group:
+        yield group
+
+
+def run_zoom(spec, points, debug=False):
+    """
+    Builds one CODE V zoom position per value of the distance axis, so a single
+    vignetting + AUT run handles the whole distance set. Only S0 and the SLM
+    tilt are zoomed (executor "zoomed" overrides the list); the other parameters
+    are shared by all positions. SCO and THI readouts are read per position in
+    one query, expression readouts once per group.
+    """
+    axis_name = spec["executor"]["axis"]
+    axis = next(axis for axis in spec["axes"] if axis["name"] == axis_name)
+    distances = axis_values(axis)
+    position = {distance: k for k, distance in enumerate(distances)}
+    readouts = list(spec["readouts"].items())
+    zoomed = [(name, definition) for name, definition in readouts if definition["type"] != "expression"]
+
+    cv_session = runner = None
+    try:
+        cv_session = open_spec_session(spec, debug=debug)
+        helper = make_helper(spec, cv_session, debug)
+        runner = SweepRunner(spec, helper)
+        # the distance is set per position by the zoom system, not by the runner
+        del runner.parameters[axis["parameter"]]
+        helper.build_distance_zoom(distances, spec["executor"].get("zoomed", cvh.ZOOM_SLM_PARAMETERS))
+        runner.query_baselines()
+
+        groups = zoom_groups(points, axis_name) if isinstance(points, list) \
+            else consecutive_zoom_groups(points, axis_name)
+        for group in groups:
+            timing = runner.apply_point(group[0])
+
+            t0 = time.perf_counter()
+            values = helper.query_zoom_positions([readout_expression(d) for _, d in zoomed], len(distances))
+            shared = {name: convert_readout(definition, helper.evaluate(definition["expression"]))
+                      for name, definition in readouts if definition["type"] == "expression"}
+            timing["readout"] = time.perf_counter() - t0
+            flags = helper.take_flags()
+
+            # the group cost is shared by its points
+            point_timing = {key: value/len(group) for key, value in timing.items()}
+            for point in group:
+                k = position[point["coords"][axis_name]]
+                point_readouts = dict(shared)
+                for i, (name, definition) in enumerate(zoomed):
+                    value = values[i, k]
+                    point_readouts[name] = None if np.isnan(value) else convert_readout(definition, float(value))
+                point_readouts = {name: point_readouts[name] for name, _ in readouts}
+                record = make_record(spec, point, point_readouts, dict(point_timing), flags)
+                # the timing is in seconds only; the group size scales it back to one AUT
+                record["zoom_positions"] = len(group)
+                yield record
+    finally:
+        if runner is not None:
+            runner.close()
+        close_spec_session(spec, cv_session)
+
+
+EXECUTORS = {
+    "serial": run_serial,
+    "pool": run_pool,
+    "macro": run_macro,
+    "zoom": run_zoom,
+    "resilient": run_resilient,
+}
+
+
+# ==============================================================================
+# Streaming
+# ==============================================================================
+
+class JsonlSink:
+    """
+    Appends each record as one JSON line and flushes immediately, so results
+    can be followed while the sweep runs.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+STREAMING_EXECUTORS = ["serial", "zoom"]
+
+
+def run_sweep(spec, sink=None, debug=False, points=None):
+    """
+    Runs a sweep spec and yields one record per point as it is produced.
+    `sink` can be a single sink or a list of sinks. `points` replaces the
+    expanded axes; the serial and zoom executors also take a generator, which
+    they consume lazily (the zoom executor then needs the points of a group
+    to be consecutive).
+    """
+    validate_spec(spec)
+    spec = dict(spec)
+    spec.setdefault("run_id", uuid.uuid4().hex[:12])
+    executor_type = spec.get("executor", {}).get("type", "serial")
+    if points is None:
+        points = expand_points(spec)
+    elif not isinstance(points, list) and executor_type not in STREAMING_EXECUTORS:
+        points = list(points)
+    executor = EXECUTORS[executor_type]
+
+    sinks = sink if isinstance(sink, (list, tuple)) else [sink] if sink is not None else []
+    for record in executor(spec, points, debug=debug):
+        for s in sinks:
+            s.write(record)
+        yield record
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a declarative CODE V sweep")
+    parser.add_argument("spec", help="sweep spec (.json or .toml)")
+    parser.add_argument("--out", help="JSONL file the records are streamed to")
+    parser.add_argument("--plot-dir", help="directory for live sweep plots (rendered in a worker process)")
+    parser.add_argument("--telemetry", help="JSONL file for live progress / ETA events")
+    parser.add_argument("--preflight", type=int, default=None, metavar="N",
+                        help="validate the plan and run N sample points before the full run")
+    parser.add_argument("--session", choices=SESSION_TYPES, help="overrides the spec's session type")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    if args.session:
+        spec["session"] = args.session
+    if args.preflight is not None:
+        from preflight import preflight, print_report
+
+        report = preflight(spec, sample=args.preflight, debug=args.debug)
+        print_report(report)
+        if not report["ok"]:
+            raise SystemExit(1)
+    sinks = []
+    plotter = telemetry_sink = None
+    if args.out:
+        sinks.append(JsonlSink(args.out))
+    if args.telemetry:
+        from telemetry import Telemetry, TelemetrySink
+
+        telemetry_sink = TelemetrySink(Telemetry(len(expand_points(spec)), args.telemetry,
+                                                 job=spec.get("name"), echo=False))
+        sinks.append(telemetry_sink)
+    if args.plot_dir:
+        from plot_worker import PlotWorker, PlotSink
+
+        os.makedirs(args.plot_dir, exist_ok=True)
+        plotter = PlotWorker().start()
+        sinks.append(PlotSink(plotter, args.plot_dir))
+    error = None
+    try:
+        for record in run_sweep(spec, sink=sinks, debug=args.debug):
+            readouts = {name: record[name] for name in spec["readouts"]}
+            print(f"Point {record['index']}: {readouts}")
+    except BaseException as e:
+        # Ctrl-C included, so the telemetry does not end as a finished sweep
+        error = str(e) or type(e).__name__
+        raise
+    finally:
+        for sink in sinks:
+            if sink is telemetry_sink:
+                sink.close(error)
+            else:
+                sink.close()
+        if plotter:
+            plotter.stop()
@@ -0,0 +1,18 @@
+"""
+Layout of sweep specs and records shared by sweep_engine and the modules that
+only read its records (results_store, power_lookup, tolerance_budget, the
+notebooks), so that reading a store does not import the engine, its CODE V
+helpers and executors.
+"""
+
+# keys of a record's "timing": seconds spent in each phase of the point
+TIMING_PHASES = ("restore", "set", "vignette", "optimize", "readout", "macro")
+
+
+def distance_axis(spec):
+    # name of the axis that sets the object distance (absolute S0), None without one
+    for axis in spec["axes"]:
+        definition = spec["parameters"].get(axis.get("parameter"), {})
+        if definition.get("type") == "thi" and definition.get("surface") == "S0" and definition.get("absolute"):
+            return axis["name"]
+    return None
@@ -0,0 +1,191 @@
+"""
+Live progress / telemetry stream for long CODE V jobs.
+
+Every finished point is written as one JSON line with its phase timings
+(set, vignette, AUT, readback, IMS, ...), the exponentially weighted moving
+average (EWMA) of every phase and of the whole point, and an ETA for the
+whole job. The file is flushed after every line, so a notebook or dashboard
+can follow it while the job runs:
+
+    with Telemetry(total=len(points), path="run.telemetry.jsonl", job="star_calibration") as telemetry:
+        for point in points:
+            with telemetry.phase("set"):
+                ...
+            with telemetry.phase("ims"):
+                ...
+            telemetry.point_done(distance=d, power=p)
+
+    for event in follow("run.telemetry.jsonl"):     # in the notebook
+        print(event["done"], event["eta"])
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+
+class Telemetry:
+    """
+    Tracks the phase timings of the current point and emits one "point" event
+    per finished point. `alpha` is the EWMA weight of the newest point.
+    """
+
+    def __init__(self, total, path=None, job=None, alpha=0.2, echo=True):
+        self.total = total
+        self.job = job
+        self.alpha = alpha
+        self.echo = echo
+        self.file = open(path, "w") if path else None
+        self.done = 0
+        self.ewma = {}
+        self.ewma_point = None
+        self.phases = {}
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        # points of the current group that are done but not yet in ewma_point
+        self.group_pending = 0
+        self.emit({"event": "start", "total": total})
+
+    def emit(self, event):
+        event = dict(event, job=self.job, t=time.time())
+        if self.file:
+            self.file.write(json.dumps(event) + "\n")
+            self.file.flush()
+        return event
+
+    def _update(self, key, value):
+        previous = self.ewma.get(key) if key is not None else self.ewma_point
+        smoothed = value if previous is None else self.alpha*value + (1 - self.alpha)*previous
+        if key is None:
+            self.ewma_point = smoothed
+        else:
+            self.ewma[key] = smoothed
+
+    @contextmanager
+    def phase(self, name):
+        # time one phase of the current point
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - t0
+
+    def eta(self):
+        # remaining points at the smoothed point duration, in seconds
+        if self.ewma_point is None:
+            return None
+        return max(self.total - self.done, 0)*self.ewma_point
+
+    def point_done(self, timing=None, group_size=None, **fields):
+        """
+        Closes the current point. `timing` adds phase timings measured
+        elsewhere (e.g. a sweep record's "timing"); extra keyword fields are
+        stored with the event. Points that finish together, like the
+        `group_size` points of a zoom group, update the smoothed point
+        duration once, with the group's wall-clock time per point, when the
+        last of them is done.
+        """
+        now = time.time()
+        phases = dict(self.phases)
+        phases.update(timing or {})
+        self.phases = {}
+        self.done += 1
+
+        for name, seconds in phases.items():
+            self._update(name, seconds)
+        self.group_pending += 1
+        if not group_size or self.group_pending >= group_size:
+            self._update(None, (now - self.last_time)/self.group_pending)
+            self.last_time = now
+            self.group_pending = 0
+
+        eta = self.eta()
+        event = self.emit({
+            "event": "point",
+            "done": self.done,
+            "total": self.total,
+            "phases": phases,
+            "ewma": dict(self.ewma),
+            "ewma_point": self.ewma_point,
+            "throughput": 1/self.ewma_point if self.ewma_point else None,
+            "elapsed": now - self.start_time,
+            "eta": eta,
+            **fields,
+        })
+        if self.echo:
+            print(f"  [{self.done}/{self.total}] {100*self.done/self.total:.1f} %, "
+                  f"ETA {format_duration(eta)}")
+        return event
+
+    def close(self, **fields):
+        self.emit({"event": "end", "done": self.done, "total": self.total,
+                   "elapsed": time.time() - self.start_time, **fields})
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # the "end" event of a failed job carries the error
+        self.close(**({"error": str(exc)} if exc_type else {}))
+
+
+class TelemetrySink:
+    """
+    Sweep sink that feeds the timing of every record to a Telemetry.
+    """
+
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+
+    def write(self, record):
+        # the zoom group size tells readers the timing is a share of the group's
+        fields = {"zoom_positions": record["zoom_positions"]} if "zoom_positions" in record else {}
+        self.telemetry.point_done(record.get("timing"), group_size=record.get("zoom_positions"),
+                                  index=record.get("index"), **fields)
+
+    def close(self, error=None):
+        # the "end" event of a failed sweep carries the error
+        self.telemetry.close(**({"error": error} if error else {}))
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return "--"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def follow(path, poll=1.0, stop_at_end=True):
+    """
+    Yields the events of a telemetry file as they are written, like tail -f.
+    Stops after the "end" event unless stop_at_end is False.
+    """
+    while not os.path.exists(path):
+        time.sleep(poll)
+    with open(path, "r") as f:
+        buffer = ""
+        while True:
+            line = f.readline()
+            if not line:
+                time.sleep(poll)
+                continue
+            buffer += line
+            if not buffer.endswith("\n"):
+                # partial line, wait for the rest
+                continue
+            event = json.loads(buffer)
+            buffer = ""
+            yield event
+            if stop_at_end and event.get("event") == "end":
+                return
+
+
+def read_events(path):
+    # all events written so far
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
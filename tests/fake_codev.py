@@ -0,0 +1,211 @@
+"""
+In-memory stand-in for the CODE V COM session, for the tests.
+
+The lens is a set of thicknesses, XY-polynomial coefficients and a Lohmann
+decenter. "AUT" sets the SLM tilt (SCO S13 C2) of every zoom position from a
+linear power model, so the sweep readouts have known values:
+
+    power = 1000/S0 + sum(GAINS[s]*(THI s - BASELINE[s])) + LOHMANN_GAIN*ZDE
+"""
+
+import os
+import re
+import subprocess
+import sys
+import time
+
+from params import Params
+
+params = Params()
+
+BASELINE = {"S0": 500.0, "S3": 1.0, "S9": 2.0, "S12": 3.0, "S13": 4.0, "S19": 5.0, "S22": 6.0, "S26": 7.0,
+            "S29": 8.0}
+GAINS = {"S3": 0.5, "S9": -0.25, "S12": 0.1, "S19": 0.05, "S22": -0.3, "S26": 0.2, "S29": 0.4}
+LOHMANN_GAIN = 2.0
+
+WRI_PATTERN = re.compile(r'^WRI\s+"([^"]*)"\s+(\(.*\))$')
+ITEM_PATTERN = re.compile(r"^\((THI|SCO)\s+(S\d+)(?:\s+(C\d+))?(?:\s+Z(\d+))?\)$", re.IGNORECASE)
+
+
+def model_power(thickness, distance_mm, lohmann):
+    power = 1000/distance_mm + LOHMANN_GAIN*lohmann
+    for surface, gain in GAINS.items():
+        power += gain*(thickness[surface] - BASELINE[surface])
+    return power
+
+
+class FakeCodeV:
+    """
+    Implements Command, EvaluateExpression and StopCodeV for the commands the
+    sweep engine sends. `hang_on` / `fail_on` / `warn_on` are command
+    substrings that make Command sleep, raise or raise a CODE V warning event.
+    With `events` the session has an event_log, as cvh.start_session gives
+    sessions started with events. With `process_dir` the session runs a
+    dummy "CODE V process" whose id is listed there (see process_ids).
+    """
+
+    def __init__(self, hang_on=None, fail_on=None, warn_on=None, events=False, process_dir=None):
+        self.thickness = dict(BASELINE)
+        self.coefficients = {("S13", "C2"): 0.0}
+        self.lohmann = 0.0
+        self.positions = [BASELINE["S0"]]
+        self.tilts = [0.0]
+        self.saved = {}
+        self.commands = []
+        self.optimizations = 0
+        self.hang_on = hang_on
+        self.fail_on = fail_on
+        self.warn_on = warn_on
+        if events:
+            self.event_log = []
+        self.process = None
+        self.process_dir = process_dir
+        if process_dir:
+            self.process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+            open(os.path.join(process_dir, str(self.process.pid)), "w").close()
+
+    # --------------------------------------------------------------------------
+    # COM interface
+    # --------------------------------------------------------------------------
+
+    def Command(self, command):
+        if self.hang_on and self.hang_on in command:
+            time.sleep(60)
+        if self.fail_on and self.fail_on in command:
+            raise RuntimeError(f"fake failure on {command}")
+        if self.warn_on and self.warn_on in command and hasattr(self, "event_log"):
+            self.event_log.append(("warning", f"fake warning on {command}"))
+        self.commands.append(command)
+        output = []
+        for part in command.split(";"):
+            result = self._run(part.strip())
+            if result is not None:
+                output.append(result)
+        return "\r\n".join(output)
+
+    def EvaluateExpression(self, expression):
+        return self._item(expression)
+
+    def StopCodeV(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            os.remove(os.path.join(self.process_dir, str(self.process.pid)))
+            self.process = None
+
+    # --------------------------------------------------------------------------
+
+    def _item(self, expression):
+        match = ITEM_PATTERN.match(expression.strip())
+        if not match:
+            return None
+        kind, surface, coeff, zoom = match.groups()
+        position = int(zoom) - 1 if zoom else 0
+        if kind.upper() == "THI":
+            return self.positions[position] if surface == "S0" else self.thickness[surface]
+        if (surface, coeff) == ("S13", "C2"):
+            return self.tilts[position]
+        return self.coefficients.get((surface, coeff), 0.0)
+
+    def _state(self):
+        return (dict(self.thickness), dict(self.coefficients), self.lohmann, list(self.positions), list(self.tilts))
+
+    def _run(self, command):
+        words = command.split()
+        if not words:
+            return None
+        keyword = words[0].upper()
+        if keyword == "?THI":
+            return f"THI {words[1]} = {self._item(f'(THI {words[1]})')}\r"
+        if keyword == "?SCO":
+            return f"SCO {words[1]} {words[2]} = {self._item(f'(SCO {words[1]} {words[2]})')}\r"
+        if keyword == "THI":
+            if len(words) == 4:
+                self.positions[int(words[2][1:]) - 1] = float(words[3])
+            elif words[1] == "S0":
+                self.positions = [float(words[2])]*len(self.positions)
+            else:
+                self.thickness[words[1]] = float(words[2])
+            return None
+        if keyword == "SCO":
+            if (words[1], words[2]) == ("S13", "C2"):
+                self.tilts = [float(words[3])]*len(self.tilts)
+            else:
+                self.coefficients[(words[1], words[2])] = float(words[3])
+            return None
+        if keyword == "ZDE":
+            self.lohmann = float(words[2])
+            return None
+        if keyword == "INS":
+            self.positions.append(self.positions[-1])
+            self.tilts.append(self.tilts[-1])
+            return None
+        if keyword == "AUT":
+            self.optimizations += 1
+            self.tilts = [params.calculate_tilt(model_power(self.thickness, distance, self.lohmann))
+                          for distance in self.positions]
+            return None
+        if keyword == "SAV":
+            self.saved[words[1]] = self._state()
+            return None
+        if keyword == "RES":
+            if words[1] in self.saved:
+                thickness, coefficients, self.lohmann, positions, tilts = self.saved[words[1]]
+                self.thickness, self.coefficients = dict(thickness), dict(coefficients)
+                self.positions, self.tilts = list(positions), list(tilts)
+            return None
+        if keyword == "WRI":
+            match = WRI_PATTERN.match(command)
+            return f"{match.group(1)}{self._item(match.group(2))}"
+        if keyword == "RUN":
+            # macro files of the macro executor; the vignetting macro does nothing here
+            path = command.split('"')[1]
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    return self.Command("; ".join(line.strip() for line in f if line.strip()))
+            return None
+        return None
+
+
+def make_spec(executor=None, distances=(0.5, 0.8), epsilons=(-1e-3, 0.0, 1e-3)):
+    # S3 and S22 perturbed in turn at every distance
+    return {
+        "name": "test",
+        "lens_file": "lens",
+        "working_dir": "",
+        "parameters": {
+            "distance": {"type": "thi", "surface": "S0", "absolute": True, "scale": 1000},
+            "S3": {"type": "thi", "surface": "S3", "scale": 1000},
+            "S22": {"type": "thi", "surface": "S22", "scale": 1000},
+        },
+        "axes": [
+            {"name": "surface", "select": ["S3", "S22"]},
+            {"name": "dist", "parameter": "distance", "values": list(distances)},
+            {"name": "epsilon", "parameter": "@surface", "values": list(epsilons)},
+        ],
+        "readouts": {"power": {"type": "tilt_power", "surface": "S13", "coeff": "C2"}},
+        "executor": executor or {"type": "serial"},
+    }
+
+
+def expected_power(record):
+    # model power of a make_spec record
+    thickness = dict(BASELINE)
+    thickness[record["surface"]] += record["epsilon"]*1000
+    return model_power(thickness, record["dist"]*1000, 0.0)
+
+
+def process_ids(process_dir):
+    # the ids of the dummy CODE V processes that are running
+    return {int(name) for name in os.listdir(process_dir)}
+
+
+def kill_process(process_dir, pid):
+    try:
+        os.kill(pid, 9)
+    except ProcessLookupError:
+        pass
+    path = os.path.join(process_dir, str(pid))
+    if os.path.exists(path):
+        os.remove(path)
+    return True
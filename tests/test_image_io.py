@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+import focus_calibration as fc
+from image_io import format_for_filename, frame_name, parse_frame_name, read_bmp, write_bmp
+
+
+@pytest.mark.parametrize("value, text", [
+    (12.34, "12p34"),
+    (-1.05, "-1p05"),
+    (1.996, "2p00"),
+    (0.999, "1p00"),
+    (-0.004, "0p00"),
+    (0.0, "0p00"),
+])
+def test_format_for_filename_rounds(value, text):
+    assert format_for_filename(value) == text
+
+
+@pytest.mark.parametrize("power", [1.996, 0.999, -0.004, -1.234])
+def test_frame_name_round_trip(power):
+    distance, parsed, kind = parse_frame_name(frame_name(0.5, power) + ".bmp")
+    assert distance == 0.5
+    assert parsed == pytest.approx(round(power, 2))
+    assert kind is None
+
+
+def test_bmp_round_trip(tmp_path):
+    image = (np.arange(35*17) % 256).astype(np.uint8).reshape(17, 35)
+    path = str(tmp_path / "frame.bmp")
+    write_bmp(path, image)
+    np.testing.assert_array_equal(read_bmp(path), image)
+
+
+class FakeImsHelper:
+    # writes a frame whose sharpness peaks at the SLM tilt of 1 D
+    def __init__(self):
+        self.tilt = None
+        self.ims_runs = []
+
+    def set_object_distance(self, distance):
+        pass
+
+    def set_slm_tilt(self, tilt):
+        self.tilt = tilt
+
+    def run_ims(self, image_file, output_file, **settings):
+        self.ims_runs.append(os.path.basename(output_file))
+        blur = abs(fc.params.tilt2power(self.tilt) - 1.0)
+        stripes = 128 + 100*np.cos(np.arange(64)/(1 + 20*blur))
+        write_bmp(output_file + ".bmp", np.tile(stripes, (32, 1)))
+
+
+def test_calibrate_distance_reuses_frames_by_name(tmp_path):
+    helper = FakeImsHelper()
+    result = fc.calibrate_distance(helper, 0.5, "star.bmp", str(tmp_path), seed_power=0.9, max_evals=12)
+    # every IMS run writes its own frame, and frames are never overwritten
+    assert len(helper.ims_runs) == len(set(helper.ims_runs)) == result["n_ims"]
+    assert result["best_power"] == pytest.approx(1.0, abs=0.02)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import power_lookup
+from power_lookup import PowerTable, pchip_rows
+
+
+def thin_lens(distance):
+    return 9/(16*(distance - 0.075))
+
+
+def test_nominal_lookup_uses_precomputed_slopes(monkeypatch):
+    distance = np.array([0.4, 0.5, 0.6, 0.7, 0.8, 2.0, 3.75])
+    table = PowerTable(distance, thin_lens(distance))
+    queries = np.linspace(0.4, 3.75, 1000)
+
+    # the PCHIP of the whole table row, as computed before the slopes were kept
+    u = 1/queries
+    expected = pchip_rows(table.u, np.broadcast_to(table.power, (len(u), len(table.u))).copy(), u)
+
+    def no_slopes(x, y):
+        raise AssertionError("slopes recomputed on a query")
+
+    monkeypatch.setattr(power_lookup, "pchip_slopes", no_slopes)
+    power, bound = table.lookup(queries)
+    np.testing.assert_allclose(power, expected)
+    assert np.all(np.abs(power - thin_lens(queries)) <= bound + 1e-3)
+
+
+def test_nominal_lookup_outside_range():
+    distance = np.array([0.4, 0.8, 2.0])
+    table = PowerTable(distance, thin_lens(distance))
+    power, bound = table.lookup([0.3, 0.5, 5.0])
+    assert np.isnan(power[[0, 2]]).all() and np.isinf(bound[[0, 2]]).all()
+    assert power[1] == pytest.approx(thin_lens(0.5), rel=0.05)
+    power, _ = table.lookup(0.5, epsilon=1e-3)
+    assert np.isnan(power)
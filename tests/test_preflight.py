@@ -0,0 +1,50 @@
+import pytest
+
+import preflight as pf
+import sweep_engine as se
+from fake_codev import FakeCodeV, make_spec
+
+
+def test_for_outside_macro_does_not_assign():
+    errors, _ = pf.validate_commands(["FOR ^i 1 3", "THI S^i 1"])
+    assert any("FOR only works inside a .seq macro" in error for error in errors)
+    assert any("^i is used before it is assigned" in error for error in errors)
+
+    errors, _ = pf.validate_commands(["FOR ^i 1 3", "THI S^i 1", "END FOR"], macro=True)
+    assert errors == []
+
+
+def test_zoom_stream_builds_the_zoom_system():
+    spec = dict(make_spec({"type": "zoom", "axis": "dist"}), run_id="test")
+    commands = [command for command, macro in pf.expand_command_stream(spec)]
+
+    assert any("INS Z2" in command and "THI S0 Z2 800.0" in command for command in commands)
+    # one AUT and one zoom query per group, no per-point distance change
+    n_groups = len(pf.run_units(spec, se.expand_points(spec)))
+    assert sum(command.startswith("AUT") for command in commands) == n_groups
+    assert sum("(SCO S13 C2 Z2)" in command for command in commands) == n_groups
+    assert not any(command.startswith("THI S0 ") and " Z" not in command for command in commands)
+    assert pf.validate_commands(commands) == ([], [])
+
+
+def test_macro_stream_records_the_macro_lines(tmp_path):
+    spec = dict(make_spec({"type": "macro", "chunk_size": 4}), run_id="test", working_dir=str(tmp_path) + "/")
+    stream = pf.expand_command_stream(spec)
+
+    lines = [command for command, macro in stream if macro]
+    assert sum(line.startswith(f'WRI "{se.MACRO_TAG}') for line in lines) == len(se.expand_points(spec))
+    assert [command for command, macro in stream if not macro and command.startswith("run")]
+    # the macro files are removed again
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_preflight_samples_whole_zoom_groups(monkeypatch):
+    monkeypatch.setattr(se, "open_spec_session", lambda spec, debug=False: FakeCodeV())
+    spec = make_spec({"type": "zoom", "axis": "dist"})
+    report = pf.preflight(spec, sample=2)
+
+    assert report["ok"], report["errors"]
+    assert report["n_units"] == len(se.expand_points(spec))//2
+    assert len(report["sample"]) == 4
+    unit_seconds = sum(sum(record["timing"].values()) for record in report["sample"])/2
+    assert report["projected_seconds"] == pytest.approx(unit_seconds*report["n_units"])
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import sweep_engine as se
+from fake_codev import FakeCodeV, expected_power, make_spec
+from results_store import NpzSink, ResultsStore, StoreSink, npz_filename
+
+
+def test_npz_sink_writes_one_curve_per_surface_and_distance(tmp_path, monkeypatch):
+    monkeypatch.setattr(se, "open_spec_session", lambda spec, debug=False: FakeCodeV())
+    spec = make_spec()
+    sink = NpzSink(str(tmp_path))
+    records = list(se.run_sweep(spec, sink=sink))
+    sink.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        npz_filename(surface, dist) for surface in ("S3", "S22") for dist in (0.5, 0.8))
+    for surface in ("S3", "S22"):
+        for dist in (0.5, 0.8):
+            data = np.load(tmp_path / npz_filename(surface, dist))
+            curve = [r for r in records if r["surface"] == surface and r["dist"] == dist]
+            assert data["dist"] == dist
+            np.testing.assert_allclose(data["epsilon"], [r["epsilon"] for r in curve])
+            np.testing.assert_allclose(data["powers"], [expected_power(r) for r in curve])
+
+
+def test_npz_filename_rounds_distance_to_mm():
+    assert npz_filename("S3", 0.4) == "sensitivity_S3_dist_400mm.npz"
+    assert npz_filename("S3", 3.75) == "sensitivity_S3_dist_3750mm.npz"
+
+
+def test_append_records_reads_distance_axis_and_phase_timings(tmp_path):
+    spec = make_spec(distances=(0.5,), epsilons=(1e-3,))
+    spec["axes"][1]["name"] = "object_distance"
+    records = [{"run_id": "run", "lens_file": "lens", "surface": "S3", "object_distance": 0.5, "epsilon": 1e-3,
+                "power": 2.0, "timing": {"set": 0.5, "optimize": 1.0, "readout": 0.25}}]
+    # entries that are not phases (e.g. counts) are not seconds
+    records[0]["timing"]["n_commands"] = 12
+
+    store = ResultsStore(str(tmp_path))
+    sink = StoreSink.for_spec(store, spec)
+    assert sink.distance_key == "object_distance"
+    for record in records:
+        sink.write(record)
+    sink.close()
+
+    data = store.query()
+    assert data["distance"].tolist() == [0.5]
+    assert data["elapsed"].tolist() == [1.75]
+
+
+def test_reading_a_store_does_not_import_the_engine():
+    code = ("import sys, power_lookup, results_store, tolerance_budget; "
+            "print(sorted({'sweep_engine', 'codev_helper'} & set(sys.modules)))")
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    assert output.strip() == "[]"
@@ -0,0 +1,33 @@
+import json
+
+import sweep_engine as se
+from fake_codev import FakeCodeV, make_spec
+from scheduler import CostModel
+from telemetry import Telemetry, TelemetrySink
+
+
+def test_load_timings_skips_zoom_points(tmp_path, monkeypatch):
+    monkeypatch.setattr(se, "open_spec_session", lambda spec, debug=False: FakeCodeV())
+    path = tmp_path / "zoom.telemetry.jsonl"
+    sink = TelemetrySink(Telemetry(12, path=str(path), echo=False))
+    records = list(se.run_sweep(make_spec({"type": "zoom", "axis": "dist"}), sink=sink))
+    sink.close()
+    with open(tmp_path / "zoom.jsonl", "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    model = CostModel()
+    # neither the records nor their telemetry events are observed
+    assert model.load_timings(str(tmp_path / "zoom.jsonl")) == 0
+    assert model.load_timings(str(path)) == 0
+
+
+def test_load_timings_maps_phases_to_kinds(tmp_path):
+    path = tmp_path / "serial.jsonl"
+    with open(path, "w") as f:
+        f.write(json.dumps({"timing": {"set": 0.01, "vignette": 0.2, "optimize": 4.0, "readout": 0.1}}) + "\n")
+
+    model = CostModel()
+    # the parameter changes ("set") are not a query job
+    assert model.load_timings(str(path)) == 2
+    assert model.observations == {"aut": [({}, 4.0)], "query": [({}, 0.1)]}
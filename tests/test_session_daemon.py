@@ -0,0 +1,83 @@
+import socket
+import sys
+import threading
+import time
+import types
+from multiprocessing.connection import Client
+
+import pytest
+
+import codev_helper as cvh
+import session_daemon
+import sweep_engine as se
+from fake_codev import FakeCodeV, expected_power, make_spec
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def daemon(monkeypatch):
+    """
+    A daemon holding "lens" on FakeCodeV sessions, which raise a warning
+    event on every S22 change. Yields its port.
+    """
+    monkeypatch.setitem(sys.modules, "pythoncom", types.SimpleNamespace(
+        COINIT_MULTITHREADED=0, CoInitializeEx=lambda flags: None, CoUninitialize=lambda: None))
+    monkeypatch.setattr(cvh, "start_session", lambda working_dir, lens_file, setup_commands=(), debug=False,
+                        events=False: FakeCodeV(warn_on="THI S22", events=events))
+
+    address = ("localhost", free_port())
+    server = session_daemon.SessionServer(".", "lens", [], n_sessions=1, address=address)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    # the listener opens once the sessions are up
+    for _ in range(100):
+        try:
+            Client(address, authkey=session_daemon.DEFAULT_AUTHKEY).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    yield address
+    session_daemon.shutdown(address)
+    thread.join(timeout=10)
+
+
+def test_lease_of_another_lens_is_refused(daemon):
+    with pytest.raises(RuntimeError, match="not 'other_lens'"):
+        session_daemon.connect(daemon, lens_file="other_lens")
+    # the refused client did not keep the only session
+    with session_daemon.connect(daemon, lens_file="C:\\lenses\\LENS.len") as lease:
+        assert lease.session_index == 0
+
+
+def test_lease_relays_events_to_helper(daemon):
+    with session_daemon.connect(daemon, lens_file="lens") as lease:
+        helper = cvh.CodeVHelper(lease)
+        helper.command("THI S3 2.0")
+        assert helper.take_flags() == []
+        helper.command("THI S22 7.0")
+        assert helper.take_flags() == [{"command": "THI S22 7.0", "kind": "warning",
+                                         "message": "fake warning on THI S22 7.0"}]
+        assert lease.event_log == [("warning", "fake warning on THI S22 7.0")]
+
+
+def test_sweep_runs_on_daemon_lease(daemon):
+    spec = make_spec()
+    spec.update(session="daemon", daemon_port=daemon[1], events={"warning": "flag"})
+    records = list(se.run_sweep(spec))
+
+    for record in records:
+        assert record["power"] == pytest.approx(expected_power(record))
+        # every S22 point changes S22, whose warnings come back as flags of the point
+        assert bool(record.get("flags")) == (record["surface"] == "S22")
+
+
+def test_daemon_session_is_rejected_for_resilient_executor():
+    spec = make_spec({"type": "resilient"})
+    spec["session"] = "daemon"
+    with pytest.raises(ValueError, match="resilient"):
+        se.validate_spec(spec)
@@ -0,0 +1,41 @@
+import numpy as np
+
+import star_mtf
+from image_io import frame_name, write_bmp
+
+
+def siemens_star(size, n_cycles=12):
+    # binary star centred in a size x size frame
+    y, x = np.mgrid[:size, :size] - (size - 1)/2
+    return np.where(np.sin(n_cycles*np.arctan2(y, x)) >= 0, 255, 0).astype(np.uint8)
+
+
+def test_frames_of_different_sizes_share_frequency_axis(tmp_path):
+    sizes = {0.5: 120, 0.8: 200}
+    for distance, size in sizes.items():
+        write_bmp(str(tmp_path / (frame_name(distance, 1.0) + ".bmp")), siemens_star(size))
+
+    # one frame per shard, so the shards have different radii
+    result = star_mtf.analyze_directory(str(tmp_path), n_cycles=12, n_radii=16, n_angles=256, workers=1,
+                                        shard_size=1)
+
+    assert result["frequency"].shape == (16,)
+    assert result["contrast"].shape == (2, 16)
+    # the common axis only spans frequencies every frame was sampled at
+    for distance, size in sizes.items():
+        frequency, contrast = star_mtf.star_contrast(siemens_star(size).astype(float), 12, 16, 256)
+        assert frequency.min() <= result["frequency"].min() and result["frequency"].max() <= frequency.max()
+        row = list(result["distance"]).index(distance)
+        np.testing.assert_allclose(result["contrast"][row],
+                                   np.interp(result["frequency"], frequency[::-1], contrast[0][::-1]), rtol=1e-5)
+
+
+def test_frames_of_one_size_keep_their_axis(tmp_path):
+    for power in (0.5, 1.0, 1.5):
+        write_bmp(str(tmp_path / (frame_name(0.5, power) + ".bmp")), siemens_star(120))
+
+    result = star_mtf.analyze_directory(str(tmp_path), n_cycles=12, n_radii=16, n_angles=256, workers=1,
+                                        shard_size=2)
+    frequency, contrast = star_mtf.star_contrast(siemens_star(120).astype(float), 12, 16, 256)
+    np.testing.assert_allclose(result["frequency"], frequency)
+    np.testing.assert_allclose(result["contrast"], np.tile(contrast, (3, 1)), rtol=1e-5)
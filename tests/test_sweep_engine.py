@@ -0,0 +1,152 @@
+import json
+
+import pytest
+
+import codev_helper as cvh
+import sweep_engine as se
+from fake_codev import FakeCodeV, expected_power, kill_process, make_spec, process_ids
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    # every session the engine opens is a FakeCodeV, kept for inspection
+    opened = []
+
+    def open_session(spec, debug=False):
+        opened.append(FakeCodeV())
+        return opened[-1]
+
+    monkeypatch.setattr(se, "open_spec_session", open_session)
+    return opened
+
+
+# ==============================================================================
+# Points and parameter changes
+# ==============================================================================
+
+def test_expand_points_selects_parameter_per_point():
+    points = se.expand_points(make_spec(distances=(0.5,), epsilons=(-1e-3, 1e-3)))
+
+    assert [p["coords"] for p in points] == [
+        {"surface": "S3", "dist": 0.5, "epsilon": -1e-3},
+        {"surface": "S3", "dist": 0.5, "epsilon": 1e-3},
+        {"surface": "S22", "dist": 0.5, "epsilon": -1e-3},
+        {"surface": "S22", "dist": 0.5, "epsilon": 1e-3},
+    ]
+    # the select axis only picks the parameter the "@surface" axis assigns
+    assert points[0]["assignments"] == {"distance": 0.5, "S3": -1e-3}
+    assert points[2]["assignments"] == {"distance": 0.5, "S22": -1e-3}
+    assert [p["index"] for p in points] == [0, 1, 2, 3]
+
+
+def test_point_commands_send_only_changed_parameters():
+    spec = make_spec()
+    spec["parameters"]["S3"]["compensate"] = "S9"
+    runner = se.SweepRunner(spec, se.make_helper(spec, FakeCodeV()))
+    runner.query_baselines()
+    points = se.expand_points(spec)
+
+    # S3 = -1 mm at the baseline distance: S9 takes the opposite change
+    assert runner.point_commands(points[0]) == ["THI S3 0.0", "THI S9 3.0"]
+    assert runner.point_commands(points[0]) == []
+    # next distance: only S0 and the epsilon of S3 move
+    assert runner.point_commands(points[3]) == ["THI S0 800.0"]
+    assert runner.point_commands(points[5]) == ["THI S3 2.0", "THI S9 1.0"]
+    # S22 point: S3 and S9 go back to their baselines
+    assert runner.point_commands(points[6]) == ["THI S0 500.0", "THI S3 1.0", "THI S9 2.0", "THI S22 5.0"]
+
+
+# ==============================================================================
+# Serial executor
+# ==============================================================================
+
+def test_serial_records_match_model(sessions):
+    spec = make_spec()
+    records = list(se.run_sweep(spec))
+
+    assert [r["index"] for r in records] == list(range(len(se.expand_points(spec))))
+    for record in records:
+        assert record["power"] == pytest.approx(expected_power(record))
+        assert set(record["timing"]) == {"set", "vignette", "optimize", "readout"}
+    # one session, one AUT per point
+    assert len(sessions) == 1
+    assert sessions[0].optimizations == len(records)
+
+
+def test_serial_rollback_restores_lens_before_every_point(sessions):
+    spec = make_spec(distances=(0.5,))
+    spec["rollback"] = True
+    records = list(se.run_sweep(spec))
+
+    for record in records:
+        assert record["power"] == pytest.approx(expected_power(record))
+        assert "restore" in record["timing"]
+    assert sessions[0].thickness["S3"] == 1.0
+
+
+# ==============================================================================
+# Zoom executor
+# ==============================================================================
+
+def test_zoom_records_match_model(sessions):
+    spec = make_spec({"type": "zoom", "axis": "dist"})
+    records = list(se.run_sweep(spec))
+
+    assert len(records) == len(se.expand_points(spec))
+    for record in records:
+        assert record["power"] == pytest.approx(expected_power(record))
+        assert record["zoom_positions"] == 2
+        # the timing holds seconds per phase and nothing else
+        assert set(record["timing"]) == {"set", "vignette", "optimize", "readout"}
+    # one AUT per zoom group instead of one per point
+    assert sessions[0].optimizations == len(records)//2
+
+
+# ==============================================================================
+# Resilient executor
+# ==============================================================================
+
+@pytest.fixture
+def codev_processes(tmp_path, monkeypatch):
+    """
+    Resilient workers get FakeCodeV sessions that run a dummy CODE V process,
+    listed in a directory, and hang on the S3 = +1 mm point.
+    """
+    process_dir = tmp_path / "processes"
+    process_dir.mkdir()
+    monkeypatch.setattr(se, "open_spec_session",
+                        lambda spec, debug=False: FakeCodeV(hang_on="THI S3 2.0", process_dir=str(process_dir)))
+    monkeypatch.setattr(cvh, "codev_process_ids", lambda: process_ids(str(process_dir)))
+    monkeypatch.setattr(cvh, "kill_process", lambda pid: kill_process(str(process_dir), pid))
+    return process_dir
+
+
+def resilient_spec(tmp_path, **options):
+    executor = {"type": "resilient", "workers": 1, "timeout": 1, "startup_timeout": 10, "max_attempts": 2,
+                "backoff": 0, "quarantine_file": str(tmp_path / "quarantine.json")}
+    executor.update(options)
+    return make_spec(executor, distances=(0.5,), epsilons=(0.0, 1e-3))
+
+
+def test_resilient_kills_codev_process_of_hung_worker(tmp_path, codev_processes):
+    spec = resilient_spec(tmp_path)
+    records = list(se.run_sweep(spec))
+
+    # the S3 = +1 mm point hangs twice and is quarantined, the others run
+    assert sorted((r["surface"], r["epsilon"]) for r in records) == [("S22", 0.0), ("S22", 1e-3), ("S3", 0.0)]
+    for record in records:
+        assert record["power"] == pytest.approx(expected_power(record))
+    with open(tmp_path / "quarantine.json") as f:
+        quarantined = json.load(f)["points"]
+    assert [point["coords"]["surface"] for point in quarantined] == ["S3"]
+    # the CODE V process of every killed or stopped worker is gone
+    assert process_ids(str(codev_processes)) == set()
+
+
+def test_resilient_stops_when_codev_process_survives(tmp_path, codev_processes, monkeypatch):
+    monkeypatch.setattr(cvh, "kill_process", lambda pid: False)
+    spec = resilient_spec(tmp_path)
+    with pytest.raises(RuntimeError, match="Could not kill CODE V process"):
+        list(se.run_sweep(spec))
+    for pid in process_ids(str(codev_processes)):
+        kill_process(str(codev_processes), pid)
@@ -0,0 +1,67 @@
+import json
+import runpy
+import sys
+
+import pytest
+
+import codev_helper as cvh
+import sweep_engine
+import telemetry
+from fake_codev import make_spec
+from telemetry import Telemetry, TelemetrySink, read_events
+
+
+def test_telemetry_ends_stream_when_job_fails(tmp_path):
+    path = str(tmp_path / "telemetry.jsonl")
+    with pytest.raises(RuntimeError):
+        with Telemetry(3, path=path, job="test", echo=False) as telemetry:
+            with telemetry.phase("ims"):
+                pass
+            telemetry.point_done(power=1.0)
+            raise RuntimeError("CODE V died")
+
+    assert telemetry.file is None
+    events = read_events(path)
+    assert [event["event"] for event in events] == ["start", "point", "end"]
+    assert events[-1]["done"] == 1
+    assert events[-1]["error"] == "CODE V died"
+
+
+def test_eta_is_steady_through_zoom_bursts(monkeypatch):
+    # 70 points in zoom groups of 7; each group takes 7 s and its records arrive at once
+    clock = [1000.0]
+    monkeypatch.setattr(telemetry.time, "time", lambda: clock[0])
+    sink = TelemetrySink(Telemetry(70, echo=False))
+
+    etas = []
+    for group in range(10):
+        clock[0] += 7.0
+        for position in range(7):
+            sink.write({"index": 7*group + position, "zoom_positions": 7,
+                        "timing": {"optimize": 6.0/7, "readout": 1.0/7}})
+            etas.append((70 - sink.telemetry.done, sink.telemetry.eta()))
+    sink.close()
+
+    # no estimate until the first group is done, then one second per point
+    # throughout instead of the whole group time on the first record of a group
+    assert [eta for _, eta in etas[:6]] == [None]*6
+    for remaining, eta in etas[6:]:
+        assert eta == pytest.approx(remaining*1.0)
+
+
+def test_sweep_cli_ends_telemetry_with_error(tmp_path, monkeypatch):
+    def no_license(*args, **kwargs):
+        raise RuntimeError("no CODE V license")
+
+    monkeypatch.setattr(cvh, "start_session", no_license)
+    spec_path = tmp_path / "spec.json"
+    spec_path.write_text(json.dumps(make_spec()))
+    path = tmp_path / "telemetry.jsonl"
+    monkeypatch.setattr(sys, "argv", ["sweep_engine.py", str(spec_path), "--telemetry", str(path)])
+
+    with pytest.raises(RuntimeError, match="no CODE V license"):
+        runpy.run_path(sweep_engine.__file__, run_name="__main__")
+
+    events = read_events(str(path))
+    assert events[-1]["event"] == "end"
+    assert events[-1]["error"] == "no CODE V license"
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import codev_helper as cvh
+import sweep_engine as se
+from fake_codev import FakeCodeV, make_spec
+from tor_analysis import tor_curves
+
+LISTING = os.path.join(os.path.dirname(__file__), "data", "tor_listing.txt")
+
+
+def read_listing():
+    with open(LISTING, "r") as f:
+        return f.read()
+
+
+def test_parse_tor_sensitivity_reads_compensator_change_table():
+    rows = cvh.parse_tor_sensitivity(read_listing())
+
+    # the performance table before it has the same codes and is ignored
+    assert rows == [
+        {"code": "DLT S3", "tolerance": 0.1, "plus": -2.341e-4, "minus": 2.338e-4},
+        {"code": "DLT S22", "tolerance": 0.1, "plus": 1.102e-4, "minus": -1.105e-4},
+        {"code": "DLX S8..9", "tolerance": 0.05, "plus": 3.2e-6, "minus": -3.1e-6},
+    ]
+
+
+def test_parse_tor_sensitivity_requires_change_table():
+    listing = read_listing()
+    with pytest.raises(ValueError, match="no compensator change table"):
+        cvh.parse_tor_sensitivity(listing[:listing.index("COMPENSATOR CHANGES")])
+    with pytest.raises(ValueError, match="no rows"):
+        cvh.parse_tor_sensitivity(listing[:listing.index("   DLT   S3        0.1000        -2.3410E-04")])
+
+
+def test_parse_tor_sensitivity_rejects_missing_change():
+    listing = read_listing().replace("3.2000E-06   -3.1000E-06", "3.2000E-06")
+    with pytest.raises(ValueError, match="DLX S8..9"):
+        cvh.parse_tor_sensitivity(listing)
+
+
+def test_tor_curves_reject_tolerance_without_row(monkeypatch):
+    spec = make_spec()
+    helper = se.make_helper(spec, FakeCodeV())
+    monkeypatch.setattr(helper, "run_tolerance_analysis",
+                        lambda tolerances, compensators: cvh.parse_tor_sensitivity(read_listing()))
+    curves = tor_curves(helper, spec, [0.5], [1e-3])
+    assert sorted(curves) == [("S22", 0.5), ("S3", 0.5)]
+
+    spec["parameters"]["S9"] = {"type": "thi", "surface": "S9", "scale": 1000}
+    with pytest.raises(ValueError, match="no row for tolerance 'DLT S9'"):
+        tor_curves(helper, spec, [0.5], [1e-3])
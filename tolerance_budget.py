@@ -0,0 +1,276 @@
+"""
+Tolerance budget: how tight each gap must be for a target power error.
+
+The sensitivity curves (NPZ files, the results store) or a Jacobian
+(jacobian.py) give the power change of every parameter at every distance.
+All curves are fitted at once with a batched least-squares pass
+
+    P(eps) = p0 + a eps + b eps^2          (b = 0 with degree 1)
+
+giving (distance, parameter) matrices of a and b. The allocation then
+scales a set of relative tolerances w_j (by default "equal effect": every
+parameter contributes the same error at its worst distance, optionally
+weighted by how hard it is to hold) by the largest factor s that keeps the
+power error within the target at every distance:
+
+    rss          sqrt(sum_j (a_ij s w_j)^2)             <= E_i
+    worst_case   sum_j |a_ij| s w_j + |b_ij| (s w_j)^2  <= E_i
+
+Parameters with a fixed tolerance use up their share of the budget first.
+Solving is a few array operations, so a changed target or weighting is
+re-solved instantly from the same fit:
+
+    budget = ToleranceBudget.from_npz_directory("sensitivity_analysis")
+    allocation = budget.solve(target=0.05, method="rss")
+    allocation = budget.solve(target={0.4: 0.02, 3.75: 0.1}, method="worst_case", fixed={"lohmann": 1e-4})
+
+Usage:
+    python tolerance_budget.py --npz sensitivity_analysis --target 0.02 0.05 0.1 --method rss
+    python tolerance_budget.py --jacobian jacobian.npz --target 0.05 --method worst_case --weight S3=2
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from results_store import NPZ_PATTERN, ResultsStore
+
+METHODS = ["rss", "worst_case"]
+
+
+# ==============================================================================
+# Batched fit
+# ==============================================================================
+
+def fit_curves(epsilon, power, degree=2):
+    """
+    Least-squares polynomial fit of C curves at once. epsilon and power are
+    (C, N) arrays padded with NaN; returns (C, degree + 1) coefficients in
+    increasing order (p0, a, b) and the (C,) RMS residual.
+    """
+    epsilon = np.asarray(epsilon, dtype=float)
+    power = np.asarray(power, dtype=float)
+    valid = np.isfinite(epsilon) & np.isfinite(power)
+    # per-curve scaling keeps the normal equations well conditioned
+    scale = np.nanmax(np.abs(np.where(valid, epsilon, np.nan)), axis=1, keepdims=True)
+    scale = np.where(np.isfinite(scale) & (scale > 0), scale, 1.0)
+    u = np.where(valid, epsilon/scale, 0.0)
+    y = np.where(valid, power, 0.0)
+
+    vandermonde = u[..., None]**np.arange(degree + 1)*valid[..., None]
+    normal = np.einsum("cni,cnj->cij", vandermonde, vandermonde)
+    rhs = np.einsum("cni,cn->ci", vandermonde, y)
+    # a curve with too few points gets NaN instead of stopping the batch
+    enough = valid.sum(axis=1) > degree
+    normal[~enough] = np.eye(degree + 1)
+    coefficients = np.linalg.solve(normal, rhs[..., None])[..., 0]
+    coefficients[~enough] = np.nan
+
+    residual = np.where(valid, y - np.einsum("cni,ci->cn", vandermonde, coefficients), 0.0)
+    rms = np.sqrt(np.sum(residual**2, axis=1)/np.maximum(valid.sum(axis=1), 1))
+    return coefficients/scale**np.arange(degree + 1), rms
+
+
+def pad_curves(curves):
+    # list of (epsilon, powers) -> two NaN-padded (C, N) arrays
+    length = max(len(epsilon) for epsilon, _ in curves)
+    epsilon = np.full((len(curves), length), np.nan)
+    power = np.full((len(curves), length), np.nan)
+    for k, (e, p) in enumerate(curves):
+        epsilon[k, :len(e)] = e
+        power[k, :len(p)] = p
+    return epsilon, power
+
+
+# ==============================================================================
+# Budget
+# ==============================================================================
+
+class ToleranceBudget:
+    """
+    Linear (a) and quadratic (b) power sensitivities, shape (distance,
+    parameter), in D per spec unit of the parameter.
+    """
+
+    def __init__(self, distances, parameters, linear, quadratic=None, residual=None, ranges=None):
+        self.distances = np.asarray(distances, dtype=float)
+        self.parameters = list(parameters)
+        self.linear = np.asarray(linear, dtype=float)
+        self.quadratic = np.zeros_like(self.linear) if quadratic is None else np.asarray(quadratic, dtype=float)
+        self.residual = residual
+        # {parameter: largest |epsilon| the sensitivities were measured at}
+        self.ranges = ranges or {}
+
+    @classmethod
+    def from_curves(cls, curves, degree=2):
+        """
+        From ResultsStore.curves() output ([{'s', 'distances': [{'d' (mm),
+        'epsilon', 'powers'}]}]), all curves fitted in one batch.
+        """
+        parameters = [entry["s"] for entry in curves]
+        distances = sorted({item["d"] for entry in curves for item in entry["distances"]})
+        keys, data, ranges = [], [], {}
+        for entry in curves:
+            for item in entry["distances"]:
+                keys.append((distances.index(item["d"]), parameters.index(entry["s"])))
+                data.append((item["epsilon"], item["powers"]))
+                ranges[entry["s"]] = max(ranges.get(entry["s"], 0.0), float(np.nanmax(np.abs(item["epsilon"]))))
+        coefficients, rms = fit_curves(*pad_curves(data), degree=degree)
+
+        shape = (len(distances), len(parameters))
+        linear, quadratic, residual = np.full(shape, np.nan), np.zeros(shape), np.full(shape, np.nan)
+        for (i, j), c, r in zip(keys, coefficients, rms):
+            linear[i, j] = c[1]
+            if degree >= 2:
+                quadratic[i, j] = c[2]
+            residual[i, j] = r
+        return cls(np.array(distances)/1000, parameters, linear, quadratic, residual, ranges)
+
+    @classmethod
+    def from_store(cls, store, degree=2, **filters):
+        return cls.from_curves(store.curves(**filters), degree=degree)
+
+    @classmethod
+    def from_npz_directory(cls, directory, degree=2):
+        # the sensitivity_{surface}_dist_{mm}mm.npz files of the sensitivity scripts
+        curves = {}
+        for filename in sorted(os.listdir(directory)):
+            match = NPZ_PATTERN.match(filename)
+            if not match:
+                continue
+            data = np.load(os.path.join(directory, filename))
+            curves.setdefault(match.group("surface"), []).append(
+                {"d": int(match.group("mm")), "epsilon": data["epsilon"], "powers": data["powers"]})
+        return cls.from_curves([{"s": surface, "distances": entries} for surface, entries in curves.items()],
+                               degree=degree)
+
+    @classmethod
+    def from_jacobian(cls, path):
+        # jacobian.py output: slopes and curvatures (b = curvature/2)
+        data = np.load(path)
+        slope = data["richardson"] if np.all(np.isfinite(data["richardson"])) else data["jacobian"]
+        parameters = [str(name) for name in data["parameters"]]
+        return cls(data["distances"], parameters, slope, data["curvature"]/2,
+                   ranges=dict(zip(parameters, 2*data["steps"])))
+
+    def targets(self, target):
+        # scalar, {distance: error} or per-distance array -> (distances,) array
+        if isinstance(target, dict):
+            return np.array([target.get(d, target.get(round(d, 3), np.inf)) for d in self.distances], dtype=float)
+        return np.broadcast_to(np.asarray(target, dtype=float), self.distances.shape).astype(float)
+
+    def errors(self, tolerances, method="rss"):
+        """
+        Power error at every distance for {parameter: tolerance}.
+        """
+        t = np.array([tolerances.get(name, 0.0) for name in self.parameters])
+        a, b = np.nan_to_num(self.linear), np.nan_to_num(self.quadratic)
+        if method == "rss":
+            return np.sqrt(np.sum((a*t)**2, axis=1))
+        return np.sum(np.abs(a)*t + np.abs(b)*t**2, axis=1)
+
+    def solve(self, target, method="rss", weights=None, fixed=None, parameters=None):
+        """
+        Allocates the tolerances of `parameters` (default all that are not
+        fixed). `weights` ({parameter: w}, default 1) multiplies the
+        equal-effect tolerance; larger means the parameter gets more room.
+        Returns a dict with the tolerances, the error per distance, the
+        limiting distance and the scale factor.
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown method '{method}', use one of {METHODS}")
+        fixed = dict(fixed or {})
+        free = [name for name in (parameters or self.parameters) if name not in fixed]
+        columns = [self.parameters.index(name) for name in free]
+        a = np.abs(np.nan_to_num(self.linear[:, columns]))
+        b = np.abs(np.nan_to_num(self.quadratic[:, columns]))
+        budget = self.targets(target)
+
+        # what the fixed tolerances already use
+        used = self.errors(fixed, method)
+        if method == "rss":
+            remaining = np.sqrt(np.clip(budget**2 - used**2, 0, None))
+        else:
+            remaining = np.clip(budget - used, 0, None)
+
+        # equal effect: w_j such that every parameter gives the same error at its worst distance
+        with np.errstate(divide="ignore"):
+            worst = np.max(a/np.where(np.isfinite(budget), budget, np.inf)[:, None], axis=0)
+            relative = np.where(worst > 0, 1/worst, np.inf)
+        relative = relative*np.array([(weights or {}).get(name, 1.0) for name in free])
+        relative = np.where(np.isfinite(relative), relative, 0.0)
+
+        linear = a*relative
+        if method == "rss":
+            norm = np.sqrt(np.sum(linear**2, axis=1))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scales = np.where(norm > 0, remaining/norm, np.inf)
+        else:
+            # smallest root of q s^2 + l s - E = 0 per distance
+            l = np.sum(linear, axis=1)
+            q = np.sum(b*relative**2, axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                roots = np.where(q > 0, (-l + np.sqrt(l*l + 4*q*remaining))/(2*q),
+                                 np.where(l > 0, remaining/l, np.inf))
+            scales = roots
+        scales = np.where(np.isfinite(budget), scales, np.inf)
+        limiting = int(np.argmin(scales))
+        scale = float(scales[limiting])
+
+        tolerances = {name: scale*r if r > 0 else np.inf for name, r in zip(free, relative)}
+        tolerances.update(fixed)
+        finite = {name: value for name, value in tolerances.items() if np.isfinite(value)}
+        return {
+            "method": method,
+            "tolerances": tolerances,
+            "errors": self.errors(finite, method),
+            "targets": budget,
+            "limiting_distance": float(self.distances[limiting]),
+            "scale": scale,
+        }
+
+
+def print_allocation(budget, allocation, unit=1e-3, unit_name="mm"):
+    print(f"{allocation['method']} allocation, limited at dist = {allocation['limiting_distance']} m")
+    for name, value in allocation["tolerances"].items():
+        if not np.isfinite(value):
+            print(f"  {name:>12s}  unconstrained")
+            continue
+        # beyond the measured range the fitted sensitivity is an extrapolation
+        extrapolated = value > budget.ranges.get(name, np.inf)
+        print(f"  {name:>12s}  +-{value/unit:.4f} {unit_name}{'  (beyond the measured range)' if extrapolated else ''}")
+    for distance, error, target in zip(budget.distances, allocation["errors"], allocation["targets"]):
+        print(f"  dist {distance:5.2f} m: error {error:.4f} D (target {target:.4f} D)")
+
+
+def parse_assignments(items):
+    # ["S3=2", "lohmann=1e-4"] -> {"S3": 2.0, "lohmann": 1e-4}
+    return {key: float(value) for key, value in (item.split("=", 1) for item in items or [])}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Allocate gap tolerances for a target power error")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--npz", help="directory of sensitivity NPZ files")
+    source.add_argument("--store", help="results store directory")
+    source.add_argument("--jacobian", help="NPZ written by jacobian.py")
+    parser.add_argument("--degree", type=int, default=2, choices=[1, 2])
+    parser.add_argument("--target", type=float, nargs="+", required=True, help="power error targets (D)")
+    parser.add_argument("--method", default="rss", choices=METHODS)
+    parser.add_argument("--weight", nargs="*", help="relative weights, e.g. S3=2")
+    parser.add_argument("--fixed", nargs="*", help="fixed tolerances in spec units, e.g. lohmann=1e-4")
+    args = parser.parse_args()
+
+    if args.npz:
+        budget = ToleranceBudget.from_npz_directory(args.npz, degree=args.degree)
+    elif args.store:
+        budget = ToleranceBudget.from_store(ResultsStore(args.store), degree=args.degree)
+    else:
+        budget = ToleranceBudget.from_jacobian(args.jacobian)
+    print(f"{len(budget.parameters)} parameters x {len(budget.distances)} distances")
+
+    for target in args.target:
+        print()
+        allocation = budget.solve(target, args.method, parse_assignments(args.weight), parse_assignments(args.fixed))
+        print_allocation(budget, allocation)
@@ -0,0 +1,177 @@
+"""
+Sensitivity curves from CODE V's own tolerance analysis (TOR).
+
+The epsilon loops of sensitiviy_analysis_each_lens.py perturb one gap at a
+time, vignette, run AUT and read the SLM tilt, 15 times per surface and
+distance. TOR computes the same thing internally: with the tilt (SCO S13 C2)
+as compensator, its sensitivity listing gives the compensator change for
++tol and -tol of every tolerance in one pass. Running it for a few tolerance
+magnitudes gives curves with the layout of the NPZ results
+
+    sensitivity_{surface}_dist_{mm}mm.npz: epsilon (m), powers (D), dist (m)
+
+(epsilon = -m..., 0, +m...), so they can be cross-checked against the
+brute-force sweep and replace it where they agree.
+
+The spec is the sweep spec of the brute-force run (sweeps/each_lens.json):
+"thi" parameters become DLT tolerances; other parameters need their TOR code
+in the definition, e.g. "tor": "DLX S8..9", and are skipped otherwise.
+
+Usage:
+    python tor_analysis.py sweeps/each_lens.json --magnitudes 1e-3 2e-3 3e-3 --out tor_sensitivity --compare sensitivity_analysis
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+import codev_helper as cvh
+import sweep_engine as se
+from params import Params
+
+params = Params()
+
+TOR_CODES = {"thi": "DLT"}
+
+
+def tolerance_code(definition):
+    # TOR tolerance code of a sweep parameter, None if TOR has no equivalent
+    if "tor" in definition:
+        return definition["tor"].upper()
+    if definition["type"] in TOR_CODES and not definition.get("absolute") and not definition.get("compensate"):
+        return f"{TOR_CODES[definition['type']]} {definition['surface'].upper()}"
+    return None
+
+
+def tor_parameters(spec):
+    # {parameter name: (TOR code, scale)} for every parameter TOR can tolerance
+    parameters = {}
+    for name, definition in spec["parameters"].items():
+        code = tolerance_code(definition)
+        if code is None:
+            if not definition.get("absolute"):
+                print(f"Parameter '{name}' has no TOR tolerance code, skipped")
+            continue
+        parameters[name] = (code, definition.get("scale", 1))
+    return parameters
+
+
+def tor_curves(helper, spec, distances, magnitudes, compensator="SCO S13 C2"):
+    """
+    Runs TOR at every distance for each tolerance magnitude (spec units) and
+    returns {(parameter, distance): {"epsilon", "powers", "dist"}}, epsilon
+    sorted from -max(magnitudes) to +max(magnitudes) with the nominal at 0.
+    """
+    parameters = tor_parameters(spec)
+    magnitudes = sorted(magnitudes)
+    surface, coeff = compensator.split()[1:]
+    curves = {}
+    for distance in distances:
+        # the nominal state the brute-force sweep starts from
+        helper.set_object_distance(distance)
+        helper.apply_vignetting()
+        helper.optimize(spec.get("optimization", cvh.OPTIMIZATION_COMMAND))
+        tilt = helper.query_xypolynomial_coeff(surface, coeff)
+
+        changes = {name: ([], []) for name in parameters}
+        for magnitude in magnitudes:
+            tolerances = {code: magnitude*scale for code, scale in parameters.values()}
+            rows = {row["code"]: row for row in helper.run_tolerance_analysis(tolerances, [compensator])}
+            for name, (code, _) in parameters.items():
+                if code not in rows:
+                    raise ValueError(f"TOR listing has no row for tolerance '{code}' of parameter '{name}'")
+                row = rows[code]
+                changes[name][0].append(row["plus"])
+                changes[name][1].append(row["minus"])
+
+        for name, (plus, minus) in changes.items():
+            epsilon = np.concatenate([-np.array(magnitudes[::-1]), [0.0], magnitudes])
+            tilts = tilt + np.concatenate([minus[::-1], [0.0], plus])
+            curves[(name, distance)] = {"epsilon": epsilon, "powers": params.tilt2power(tilts),
+                                        "dist": distance}
+    return curves
+
+
+def curve_filename(name, distance):
+    return f"sensitivity_{name}_dist_{int(round(distance*1000))}mm.npz"
+
+
+def save_curves(curves, directory):
+    os.makedirs(directory, exist_ok=True)
+    for (name, distance), curve in curves.items():
+        np.savez(os.path.join(directory, curve_filename(name, distance)), **curve)
+
+
+def cross_check(curves, directory):
+    """
+    Compares each TOR curve with the brute-force NPZ of the same surface and
+    distance: the largest power difference at the TOR epsilons and the two
+    slopes at epsilon = 0 (D/m). Curves without a brute-force file are left
+    out.
+    """
+    results = []
+    for (name, distance), curve in curves.items():
+        path = os.path.join(directory, curve_filename(name, distance))
+        if not os.path.exists(path):
+            continue
+        data = np.load(path)
+        order = np.argsort(data["epsilon"])
+        brute = np.interp(curve["epsilon"], data["epsilon"][order], data["powers"][order])
+        valid = np.isfinite(curve["powers"])
+        results.append({
+            "parameter": name,
+            "dist": distance,
+            "max_difference": float(np.max(np.abs(curve["powers"][valid] - brute[valid]))) if valid.any() else None,
+            "tor_slope": float(np.polyfit(curve["epsilon"][valid], curve["powers"][valid], 1)[0])
+            if valid.sum() > 1 else None,
+            "brute_slope": float(np.polyfit(data["epsilon"], data["powers"], 1)[0]),
+        })
+    return results
+
+
+def print_cross_check(results, tolerance=0.01):
+    print(f"{'parameter':>10s} {'dist':>6s} {'max diff (D)':>13s} {'TOR slope':>12s} {'sweep slope':>12s}")
+    for result in results:
+        difference = result["max_difference"]
+        status = "" if difference is not None and difference <= tolerance else "  <-- check"
+        print(f"{result['parameter']:>10s} {result['dist']:6.2f} "
+              f"{difference if difference is not None else float('nan'):13.5f} "
+              f"{result['tor_slope'] if result['tor_slope'] is not None else float('nan'):12.3f} "
+              f"{result['brute_slope']:12.3f}{status}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sensitivity curves from CODE V tolerance analysis")
+    parser.add_argument("spec", help="sweep spec of the brute-force run")
+    parser.add_argument("--magnitudes", type=float, nargs="+", default=[1e-3, 2e-3, 3e-3],
+                        help="tolerance magnitudes (spec units)")
+    parser.add_argument("--distances", type=float, nargs="+", default=None,
+                        help="object distances (m), default: the values of the spec's distance axis")
+    parser.add_argument("--compensator", default="SCO S13 C2")
+    parser.add_argument("--out", default="tor_sensitivity", help="directory for the NPZ curves")
+    parser.add_argument("--compare", help="directory of the brute-force NPZ curves")
+    parser.add_argument("--session", choices=se.SESSION_TYPES, help="overrides the spec's session type")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    spec = se.load_spec(args.spec)
+    if args.session:
+        spec["session"] = args.session
+    distances = args.distances
+    if distances is None:
+        axis = next(axis for axis in spec["axes"] if axis["name"] == se.distance_axis(spec))
+        distances = se.axis_values(axis)
+
+    cv_session = None
+    try:
+        cv_session = se.open_spec_session(spec, debug=args.debug)
+        helper = se.make_helper(spec, cv_session, args.debug)
+        curves = tor_curves(helper, spec, distances, args.magnitudes, args.compensator)
+    finally:
+        se.close_spec_session(spec, cv_session)
+
+    save_curves(curves, args.out)
+    print(f"{len(curves)} TOR curves saved to {args.out}")
+    if args.compare:
+        print_cross_check(cross_check(curves, args.compare))
@@ -2,6 +2,7 @@ import win32com.client
 import os
 import numpy as np
 import time
+from image_io import format_for_filename
 from params import Params
 
 # ==============================================================================
@@ -10,22 +11,6 @@ from params import Params
 
 params = Params()
 
-def format_for_filename(value: float) -> str:
-    """
-    Formats a float into the specified '{integer}p{decimal}' string format.
-    Example: 12.34 -> "12p34"
-    """
-    if value < 0:
-        sign = "-" # Using 'm' for minus
-        value = abs(value)
-    else:
-        sign = ""
-    
-    integer_part = int(value)
-    # Get the decimal part as a string, remove the "0." part and take the first two digits
-    decimal_part = f"{(value - integer_part):.2f}"[2:]
-    return f"{sign}{integer_part}p{decimal_part}"
-
 def calculate_tilt(optical_power: float) -> float:
     """
     Placeholder function to calculate the tilt value from optical power.
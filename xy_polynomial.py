@@ -0,0 +1,173 @@
+"""
+Coefficient algebra for CODE V XY polynomial surfaces.
+
+CODE V numbers the XY polynomial terms x^m y^n as C{j} with
+j = (m+n)(m+n+1)/2 + n + 1, so C2 = X, C3 = Y, C4 = X2, ... C7 = X3, ... C10 = Y3,
+up to C66 = Y10 for order 10 (C1 is the conic constant and is left alone).
+
+Coefficient sets are arrays of shape (..., n_terms) ordered C2, C3, C4, ... so
+that whole stacks of surfaces or angles are handled at once:
+
+    base = coeffs_from_dict({"C7": 1/c0, "C10": 1/c0}, max_order=3)
+    rotated = rotate_coeffs(base, np.deg2rad(np.arange(-20, 20, 2)))   # (20, 9)
+    cvHelper.set_xypolynomial_coeffs("S9", rotated[0])                 # one command
+
+Rotation follows the convention of rotate_lohmann_lens in test.py:
+p'(x, y) = p(x cos(t) - y sin(t), x sin(t) + y cos(t)).
+"""
+
+from functools import lru_cache
+from math import comb
+
+import numpy as np
+
+MAX_ORDER = 10
+
+
+def coeff_number(m, n):
+    # CODE V coefficient number of the x^m y^n term
+    order = m + n
+    return order*(order + 1)//2 + n + 1
+
+
+@lru_cache(maxsize=None)
+def term_orders(max_order=MAX_ORDER):
+    """
+    (m, n) exponents of the terms C2 .. C{last} for polynomials up to max_order.
+    """
+    return tuple((order - n, n) for order in range(1, max_order + 1) for n in range(order + 1))
+
+
+def n_terms(max_order=MAX_ORDER):
+    return len(term_orders(max_order))
+
+
+def max_order_for(n):
+    # smallest order whose term count is at least n
+    order = 0
+    while n_terms(order) < n:
+        order += 1
+    return order
+
+
+def coeff_names(max_order=MAX_ORDER):
+    return [f"C{coeff_number(m, n)}" for m, n in term_orders(max_order)]
+
+
+def coeffs_from_dict(coeffs, max_order=MAX_ORDER):
+    """
+    {"C7": value, ...} -> coefficient array ordered C2, C3, ...
+    """
+    names = coeff_names(max_order)
+    array = np.zeros(len(names))
+    for name, value in coeffs.items():
+        if name.upper() not in names:
+            raise ValueError(f"{name} is not an XY polynomial term up to order {max_order}")
+        array[names.index(name.upper())] = value
+    return array
+
+
+def coeffs_to_dict(array, skip_zeros=False):
+    array = np.asarray(array, dtype=float)
+    names = coeff_names(max_order_for(array.shape[-1]))
+    return {name: float(value) for name, value in zip(names, array) if not (skip_zeros and value == 0)}
+
+
+@lru_cache(maxsize=None)
+def _rotation_terms(max_order):
+    """
+    Sparse description of the rotation matrix: for every contribution of an
+    input term to an output term, its binomial weight and the powers of cos
+    and sin. Computed once per order.
+    """
+    orders = term_orders(max_order)
+    index = {mn: i for i, mn in enumerate(orders)}
+    out_idx, in_idx, weights, cos_pow, sin_pow = [], [], [], [], []
+    for j, (m, n) in enumerate(orders):
+        # (x c - y s)^m (x s + y c)^n
+        for i in range(m + 1):
+            for k in range(n + 1):
+                out_idx.append(index[(m - i + k, i + n - k)])
+                in_idx.append(j)
+                weights.append(comb(m, i)*comb(n, k)*(-1)**i)
+                cos_pow.append(m - i + n - k)
+                sin_pow.append(i + k)
+    return (np.array(out_idx), np.array(in_idx), np.array(weights, dtype=float),
+            np.array(cos_pow), np.array(sin_pow))
+
+
+def rotation_matrix(theta, max_order=MAX_ORDER):
+    """
+    Matrices T of shape (..., n_terms, n_terms) with rotated = T @ coeffs, for
+    an array of angles (radians).
+    """
+    theta = np.asarray(theta, dtype=float)
+    out_idx, in_idx, weights, cos_pow, sin_pow = _rotation_terms(max_order)
+    c = np.cos(theta)[..., None]
+    s = np.sin(theta)[..., None]
+    values = weights*c**cos_pow*s**sin_pow
+
+    size = n_terms(max_order)
+    values = values.reshape(-1, len(weights))
+    T = np.zeros((values.shape[0], size*size))
+    # several contributions land on the same matrix entry, so accumulate
+    np.add.at(T, (slice(None), out_idx*size + in_idx), values)
+    return T.reshape(theta.shape + (size, size))
+
+
+def rotate_coeffs(coeffs, theta):
+    """
+    Rotates coefficient sets by theta (radians). coeffs (..., n_terms) and
+    theta broadcast against each other, so one base set and an array of
+    angles gives one rotated set per angle.
+    """
+    coeffs = np.asarray(coeffs, dtype=float)
+    T = rotation_matrix(theta, max_order_for(coeffs.shape[-1]))
+    return np.einsum("...ij,...j->...i", T, coeffs)
+
+
+def scale_coeffs(coeffs, factor):
+    """
+    Coefficients of p(x*factor, y*factor), e.g. to change the normalisation
+    radius. factor can be an array broadcasting against the leading axes.
+    """
+    coeffs = np.asarray(coeffs, dtype=float)
+    degree = np.array([m + n for m, n in term_orders(max_order_for(coeffs.shape[-1]))])
+    factor = np.asarray(factor, dtype=float)[..., None]
+    return coeffs*factor**degree
+
+
+def translate_coeffs(coeffs, dx, dy):
+    """
+    Coefficients of p(x - dx, y - dy), i.e. the surface shifted by (dx, dy).
+    The constant (piston) term has no XY polynomial coefficient and is
+    returned separately: (coeffs, piston).
+    """
+    coeffs = np.asarray(coeffs, dtype=float)
+    orders = term_orders(max_order_for(coeffs.shape[-1]))
+    index = {mn: i for i, mn in enumerate(orders)}
+    dx = np.asarray(dx, dtype=float)[..., None]
+    dy = np.asarray(dy, dtype=float)[..., None]
+
+    shape = np.broadcast_shapes(coeffs.shape, dx.shape)
+    out = np.zeros(shape)
+    piston = np.zeros(shape[:-1])
+    for j, (m, n) in enumerate(orders):
+        a = coeffs[..., j:j + 1]
+        # (x - dx)^m (y - dy)^n
+        for i in range(m + 1):
+            for k in range(n + 1):
+                value = (a*comb(m, i)*comb(n, k)*(-dx)**(m - i)*(-dy)**(n - k))[..., 0]
+                if i + k == 0:
+                    piston += value
+                else:
+                    out[..., index[(i, k)]] += value
+    return out, piston
+
+
+def upload_command(surface, coeffs, skip_zeros=False):
+    """
+    Single CODE V command line setting a whole coefficient set on a surface.
+    """
+    terms = coeffs_to_dict(coeffs, skip_zeros=skip_zeros) if not isinstance(coeffs, dict) else coeffs
+    return "; ".join(f"SCO {surface} {name} {value}" for name, value in terms.items())